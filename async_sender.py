@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+import aiohttp
+from telebot.apihelper import ApiTelegramException
+
+import config
+from resilience import async_call_with_retry, telegram_circuit
+
+logger = logging.getLogger(__name__)
+
+
+def _is_transient(error):
+    if isinstance(error, ApiTelegramException):
+        return error.error_code >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+class AsyncTelegramSender:
+    """Асинхронная отправка сообщений в Bot API через пул keep-alive соединений.
+
+    Одна aiohttp-сессия на цикл событий (async_utils.loop), в полёте не больше
+    concurrency запросов. Ошибки API поднимаются как ApiTelegramException,
+    чтобы BroadcastEngine обрабатывал их так же, как ошибки telebot.
+    """
+
+    def __init__(self, token, api_url=None, concurrency=None, timeout=None):
+        self.token = token
+        self.api_url = (api_url or config.BOT_API_URL).rstrip('/')
+        self.concurrency = concurrency or config.ASYNC_SENDER_CONCURRENCY
+        self.timeout = timeout or config.REQUEST_TIMEOUT
+        self._session = None
+        self._semaphore = None
+
+    def _ensure_session(self):
+        # Сессия и семафор привязаны к циклу, поэтому создаются при первом вызове внутри него
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                keepalive_timeout=config.ASYNC_SENDER_KEEPALIVE,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def call(self, method, params):
+        """Вызов метода Bot API через автомат Telegram; возвращает поле result ответа.
+
+        Повторы здесь не делаются — их планирует BroadcastEngine.
+        """
+        return await async_call_with_retry(
+            self._post, method, params,
+            circuit=telegram_circuit, is_transient=_is_transient, attempts=1
+        )
+
+    async def _post(self, method, params):
+        session = self._ensure_session()
+        url = f"{self.api_url}/bot{self.token}/{method}"
+        async with self._semaphore:
+            async with session.post(url, json=params) as response:
+                result_json = await response.json(content_type=None)
+        if not result_json.get('ok'):
+            raise ApiTelegramException(method, None, result_json)
+        return result_json.get('result')
+
+    async def send_message(self, chat_id, text, parse_mode='Markdown'):
+        params = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            params['parse_mode'] = parse_mode
+        return await self.call('sendMessage', params)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,70 @@
+"""Сравнение транспорта рассылки: bot.send_message в пуле потоков против AsyncTelegramSender.
+
+Оба варианта идут через BroadcastEngine к локальному фейковому Bot API
+с заданной задержкой ответа. Глобальный лимит снят, чтобы измерить сам транспорт;
+с --rate 30 видно, что оба упираются в лимит Telegram, а не в отправку.
+
+Запуск из корня проекта: python -m benchmarks.broadcast_bench [сообщений] [задержка_с]
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from telebot import apihelper
+
+import config
+from async_sender import AsyncTelegramSender
+from broadcast import BroadcastEngine, Delivery
+from benchmarks.fake_bot_api import FakeBotApi, start_in_thread
+
+TOKEN = "123456:BENCHMARK"
+
+
+def deliveries(count):
+    # Разные чаты, чтобы не упираться в интервал одного чата
+    return [Delivery(100000 + i, f"Анекдот #{i}") for i in range(count)]
+
+
+async def run_thread_pool(url, count, rate):
+    apihelper.API_URL = url + "/bot{0}/{1}"
+    bot = telebot.TeleBot(TOKEN)
+    executor = ThreadPoolExecutor(max_workers=config.SCHEDULER_THREAD_POOL_SIZE)
+    engine = BroadcastEngine(
+        lambda chat_id, text: bot.send_message(chat_id, text, parse_mode='Markdown'),
+        executor,
+        rate=rate
+    )
+    progress = await engine.broadcast(deliveries(count), label='thread pool')
+    executor.shutdown()
+    return progress
+
+
+async def run_async_sender(url, count, rate):
+    sender = AsyncTelegramSender(TOKEN, api_url=url)
+    engine = BroadcastEngine(sender.send_message, rate=rate, concurrency=config.ASYNC_SENDER_CONCURRENCY)
+    progress = await engine.broadcast(deliveries(count), label='aiohttp')
+    await sender.close()
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast transport benchmark")
+    parser.add_argument('count', type=int, nargs='?', default=2000)
+    parser.add_argument('latency', type=float, nargs='?', default=0.05)
+    parser.add_argument('--rate', type=float, default=1e9, help="глобальный лимит, сообщений/с")
+    args = parser.parse_args()
+
+    for name, runner in (("Thread pool", run_thread_pool), ("Async sender", run_async_sender)):
+        api = FakeBotApi(latency=args.latency)
+        url = start_in_thread(api)
+        start = time.perf_counter()
+        progress = asyncio.run(runner(url, args.count, args.rate))
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {progress.sent}/{args.count} sent in {elapsed:.2f}s "
+              f"({progress.sent / elapsed:.0f} msg/s, max in flight {api.max_in_flight})")
+
+
+if __name__ == "__main__":
+    main()
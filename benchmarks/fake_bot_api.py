@@ -0,0 +1,125 @@
+"""Локальный фейковый Bot API для тестов и бенчмарков рассылки.
+
+Понимает sendMessage (параметры в query, form или JSON), отвечает с заданной
+задержкой и может эмулировать лимит Telegram: при превышении rate_limit
+сообщений в секунду возвращает 429 с parameters.retry_after.
+
+Запуск отдельно:
+    python -m benchmarks.fake_bot_api --port 8081 --latency 0.05 --rate-limit 30
+и в config.py: BOT_API_URL = "http://127.0.0.1:8081"
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.05, rate_limit=None, retry_after=1):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.sent = 0
+        self.throttled = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._recent = deque()
+        self._message_id = 0
+
+    async def _params(self, request):
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        return params
+
+    def _over_limit(self):
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+
+        if method != 'sendMessage':
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found'}, status=404)
+        if self._over_limit():
+            self.throttled += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+
+        self.sent += 1
+        self._message_id += 1
+        chat_id = int(params['chat_id'])
+        return web.json_response({'ok': True, 'result': {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group' if chat_id < 0 else 'private'},
+            'text': params.get('text', '')
+        }})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+
+def start_in_thread(api, host='127.0.0.1', port=0):
+    """Запускает сервер в фоновом потоке; возвращает его базовый URL"""
+    ready = threading.Event()
+    address = {}
+
+    async def serve():
+        runner = web.AppRunner(api.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        sock = site._server.sockets[0]
+        address['url'] = f"http://{host}:{sock.getsockname()[1]}"
+        ready.set()
+        await asyncio.Event().wait()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True).start()
+    ready.wait(10)
+    return address['url']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    api = FakeBotApi(args.latency, args.rate_limit, args.retry_after)
+    print(json.dumps(vars(args)))
+    web.run_app(api.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Стресс-тест IdAllocator на локальной замене Firebase.
+
+Несколько «процессов» (экземпляров IdAllocator) в нескольких потоках одновременно
+одобряют анекдоты. Замена базы повторяет семантику транзакций Firebase:
+оптимистичное сравнение-и-запись с повтором до 25 раз.
+
+Запуск из корня проекта: python -m benchmarks.id_allocator_stress
+"""
+import random
+import threading
+import time
+
+from id_allocator import IdAllocator
+
+
+class LocalDatabase:
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+
+
+class LocalRef:
+    """Минимальная замена firebase_admin.db.Reference: get, set, transaction"""
+
+    def __init__(self, db, path=''):
+        self.db = db
+        self.path = path
+
+    def child(self, path):
+        return LocalRef(self.db, f"{self.path}/{path}".strip('/'))
+
+    def get(self):
+        with self.db.lock:
+            self.db.round_trips += 1
+            return self.db.data.get(self.path)
+
+    def set(self, value):
+        with self.db.lock:
+            self.db.round_trips += 1
+            self.db.data[self.path] = value
+
+    def transaction(self, update):
+        for _ in range(25):
+            current = self.get()
+            # Задержка сети между чтением и записью — окно для гонок
+            time.sleep(random.random() * 0.0005)
+            new_value = update(current)
+            with self.db.lock:
+                self.db.round_trips += 1
+                if self.db.data.get(self.path) == current:
+                    self.db.data[self.path] = new_value
+                    return new_value
+        raise RuntimeError("Transaction aborted after 25 attempts")
+
+
+def naive_next_id(ref):
+    """Старый get_next_approved_id: чтение и запись без транзакции"""
+    counter = ref.child('approved_counter')
+    value = (counter.get() or 0) + 1
+    time.sleep(random.random() * 0.0005)
+    counter.set(value)
+    return value
+
+
+def run(processes=4, threads=8, per_thread=200, block=20):
+    db = LocalDatabase()
+    root = LocalRef(db)
+    allocators = [IdAllocator(block_size=block) for _ in range(processes)]
+    for allocator in allocators:
+        allocator.start(root)
+
+    issued = []
+    issued_lock = threading.Lock()
+
+    def worker(allocator):
+        local = []
+        for i in range(per_thread):
+            if i % 50 == 49:
+                first = allocator.allocate_block(7)
+                local.extend(range(first, first + 7))
+            else:
+                local.append(allocator.allocate())
+        with issued_lock:
+            issued.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(allocators[i % processes],)) for i in range(processes * threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    for allocator in allocators:
+        allocator.release()
+
+    counter = db.data.get('approved_counter') or 0
+    gaps = set()
+    for path, end in db.data.items():
+        if path.startswith('approved_id_gaps/'):
+            gaps.update(range(int(path.split('/')[1]), end + 1))
+
+    assert len(issued) == len(set(issued)), "duplicate IDs issued"
+    assert not gaps & set(issued), "gap overlaps issued IDs"
+    assert set(issued) | gaps == set(range(1, counter + 1)), "IDs lost without a gap record"
+    print(f"Leased allocator: {len(issued)} unique IDs in {elapsed:.2f}s, "
+          f"{db.round_trips} DB round trips, counter={counter}, gaps={len(gaps)}")
+
+    db = LocalDatabase()
+    root = LocalRef(db)
+    naive = []
+
+    def naive_worker():
+        local = [naive_next_id(root) for _ in range(per_thread // 4)]
+        with issued_lock:
+            naive.extend(local)
+
+    workers = [threading.Thread(target=naive_worker) for _ in range(processes * threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    print(f"Naive get+set: {len(naive)} IDs, {len(naive) - len(set(naive))} duplicates, "
+          f"{db.round_trips} DB round trips")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,78 @@
+"""Сравнение MinHash/LSH с полным перебором на синтетическом корпусе.
+
+Запуск из корня проекта: python -m benchmarks.near_duplicates_bench [число анекдотов]
+"""
+import random
+import sys
+import time
+
+from near_duplicates import MinHashLSH, normalize_for_shingles
+
+WORDS = (
+    "вовочка учительница приходит домой жена муж тёща штирлиц мюллер чукча геолог "
+    "программист начальник доктор пациент заходит бар говорит спрашивает отвечает "
+    "вчера сегодня утром вечером после работы опять снова почему зачем однажды "
+    "купил продал потерял нашёл кошка собака рыбалка охота машина трамвай милиционер"
+).split()
+NAMES = ["Вовочка", "Петька", "Василий Иванович", "Штирлиц", "Рабинович", "Изя"]
+
+
+def make_joke(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(15, 40))]
+    words.insert(0, rng.choice(NAMES))
+    return ' '.join(words) + '.'
+
+
+def mutate(text, rng):
+    """Типичная повторная отправка: другое имя, пунктуация и лишняя строка"""
+    for name in NAMES:
+        if name in text:
+            text = text.replace(name, rng.choice(NAMES), 1)
+            break
+    text = text.replace(' ', ', ', 2).upper() if rng.random() < 0.3 else text
+    return text + "\nВот такая история!"
+
+
+def shingles(text, size):
+    normalized = normalize_for_shingles(text)
+    return {normalized[i:i + size] for i in range(max(1, len(normalized) - size + 1))}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def main(count=100_000, queries=200):
+    rng = random.Random(42)
+    jokes = {f"k{i}": make_joke(rng) for i in range(count)}
+    lsh = MinHashLSH()
+
+    start = time.perf_counter()
+    for key, text in jokes.items():
+        lsh.add(key, text)
+    build = time.perf_counter() - start
+    print(f"LSH build: {count} jokes in {build:.1f}s ({build / count * 1e6:.0f} µs/joke)")
+
+    targets = rng.sample(list(jokes), queries)
+    probes = [mutate(jokes[key], rng) for key in targets]
+
+    start = time.perf_counter()
+    hits = sum(1 for key, probe in zip(targets, probes) if key in {k for k, _ in lsh.query(probe)})
+    lsh_time = (time.perf_counter() - start) / queries
+    print(f"LSH query: {lsh_time * 1e3:.2f} ms, recall@3 = {hits / queries:.0%}")
+
+    brute_queries = min(queries, 10)
+    corpus_shingles = {key: shingles(text, lsh.shingle_size) for key, text in jokes.items()}
+    start = time.perf_counter()
+    brute_hits = 0
+    for key, probe in zip(targets[:brute_queries], probes[:brute_queries]):
+        probe_shingles = shingles(probe, lsh.shingle_size)
+        best = max(corpus_shingles, key=lambda k: jaccard(probe_shingles, corpus_shingles[k]))
+        brute_hits += best == key
+    brute_time = (time.perf_counter() - start) / brute_queries
+    print(f"Brute force: {brute_time * 1e3:.0f} ms per query, top-1 hits {brute_hits}/{brute_queries}")
+    print(f"Speedup: {brute_time / lsh_time:.0f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
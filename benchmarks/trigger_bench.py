@@ -0,0 +1,98 @@
+"""Поиск триггерных слов: подстроки из config против скомпилированного индекса.
+
+Корпус имитирует переписку в группах: в основном обычная болтовня, изредка
+просьбы об анекдоте в разных формах и с опечатками.
+
+Запуск из корня проекта: python -m benchmarks.trigger_bench [число сообщений]
+"""
+import random
+import sys
+import time
+
+import config
+from triggers import TriggerMatcher
+
+CHATTER = (
+    "привет всем как дела что нового кто идёт сегодня вечером на футбол "
+    "скиньте ссылку на документ завтра созвон в десять утра не забудьте "
+    "купил новую машину опять пробки на мосту погода отличная едем на дачу "
+    "кто-нибудь видел мои ключи ха-ха-ха ну ты даёшь согласен полностью "
+    "отчёт готов посмотрите пожалуйста кот уронил ёлку этот петя вышел "
+    "в субботу получилось спасибо большое"
+).split()
+
+# Похожие на триггеры слова, которые не должны срабатывать
+NEAR_MISSES = [
+    "анекдотический", "шутник", "смешно", "расскажу", "нешуточный",
+    "расписание", "прекрасно", "поиграем в доту",
+]
+
+REQUESTS = [
+    "расскажи анекдот", "анекдоты есть?", "хочу анекдотик", "давай шутку",
+    "бот, расскажи смешное", "расскажи мне смешное", "а шуток нет?",
+    "анегдот давай", "онекдот плиз", "ещё анекдтоы", "ну и шуточки у вас",
+]
+
+
+def make_message(rng, request_share):
+    words = [rng.choice(CHATTER) for _ in range(rng.randint(3, 25))]
+    if rng.random() < request_share:
+        words.insert(rng.randint(0, len(words)), rng.choice(REQUESTS))
+    if rng.random() < request_share:
+        words.insert(rng.randint(0, len(words)), rng.choice(NEAR_MISSES))
+    return ' '.join(words)
+
+
+# Расширенный список: так выглядит конфиг, когда в него добавляют синонимы
+EXTENDED_WORDS = config.GROUP_TRIGGER_WORDS + [
+    "прикол", "юмор", "байка", "хохма", "смешнявка", "рассмеши", "анекдотец",
+    "история смешная", "хочу посмеяться", "шутейка", "каламбур", "угар",
+]
+
+
+def legacy_filter(words):
+    """Прежний фильтр group_trigger"""
+    def matches(text):
+        return any(word in (text or '').lower() for word in words)
+    return matches
+
+
+def run(name, func, messages, repeat=3):
+    best = min(_timed(func, messages) for _ in range(repeat))
+    hits = {text for text in messages if func(text)}
+    print(f"{name:>28}: {len(messages) / best:>10.0f} msg/s, {len(hits)} triggers")
+    return hits
+
+
+def _timed(func, messages):
+    started = time.perf_counter()
+    for text in messages:
+        func(text)
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rng = random.Random(42)
+    messages = [make_message(rng, 0.05) for _ in range(count)]
+    print(f"{count} messages, {sum(len(m) for m in messages) // count} chars on average")
+
+    for words in (config.GROUP_TRIGGER_WORDS, EXTENDED_WORDS):
+        print(f"\n{len(words)} trigger words")
+        legacy = run("substring any()", legacy_filter(words), messages)
+        matcher = TriggerMatcher(words)
+        run("matcher, cold cache", TriggerMatcher(words).matches, messages, repeat=1)
+        compiled = run("matcher, warm cache", matcher.matches, messages)
+
+    only_matcher = sorted(compiled - legacy, key=len)
+    only_legacy = sorted(legacy - compiled, key=len)
+    print(f"\nFound only by the matcher ({len(only_matcher)}):")
+    for text in only_matcher[:3]:
+        print(f"  {text}")
+    print(f"Found only by substrings ({len(only_legacy)}):")
+    for text in only_legacy[:3]:
+        print(f"  {text}")
+
+
+if __name__ == "__main__":
+    main()
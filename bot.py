@@ -1,54 +1,107 @@
 import telebot
+from telebot import apihelper
 import config
 import logging
 from utils import setup_logging
 from handlers.init import setup_all_handlers
 from scheduler import JokeScheduler
 from async_utils import loop, run_async
+from id_allocator import id_allocator
+from write_buffer import write_buffer
+from network_utils import RobustSession
+from resilience import full_jitter, telegram_circuit
+from telegram_cache import telegram_cache
+from last_jokes import last_joke_tracker
+from states import state_store
 import time
-import requests
 
 logger = setup_logging()
 
-bot = telebot.TeleBot(config.BOT_TOKEN)
+# Все запросы telebot идут через сессию с повторами и автоматом Telegram
+apihelper.CUSTOM_REQUEST_SENDER = RobustSession().request
+
+
+class PollingErrors(telebot.ExceptionHandler):
+    """Запоминает ошибку, на которой остановился polling.
+
+    Без non_stop telebot при ошибке API просто выходит из polling(), не поднимая
+    исключения; по last_error супервизор отличает сбой от штатной остановки.
+    """
+
+    def __init__(self):
+        self.last_error = None
+
+    def handle(self, exception):
+        self.last_error = exception
+        return False
+
+
+polling_errors = PollingErrors()
+bot = telebot.TeleBot(config.BOT_TOKEN, exception_handler=polling_errors)
 logger.info("Bot initialized")
 
 setup_all_handlers(bot)
 
 if __name__ == "__main__":
     logger.info("Starting bot...")
-    max_restarts = 5
-    restart_delay = 30
     
     import threading
     threading.Thread(target=loop.run_forever, daemon=True).start()
     
+    joke_scheduler = None
     try:
+        # Профиль бота нужен для команд вида /joke@bot — загружаем его один раз заранее
+        try:
+            telegram_cache.get_bot_user(bot)
+        except Exception as e:
+            logger.warning(f"Could not load bot identity at startup, will retry on demand: {e}")
+
+        # Последние анекдоты чатов из снимка — чтобы после перезапуска не было повторов
+        last_joke_tracker.start()
+        # Незавершённые диалоги пользователей переживают перезапуск
+        state_store.start(config.USER_STATE_DB_PATH)
+
         joke_scheduler = JokeScheduler(bot)
         
         if config.RANDOM_JOKE_ENABLED:
             joke_scheduler.start(loop)
             logger.info("Random joke scheduler enabled")
         
+        # Супервизор polling: перезапуск с экспоненциальной паузой и джиттером,
+        # пока автомат Telegram разомкнут — не раньше пробного запроса
         restart_count = 0
-        while restart_count < max_restarts:
+        while True:
+            started = time.monotonic()
+            polling_errors.last_error = None
             try:
-                bot.infinity_polling(
+                # infinity_polling сам повторяет запросы с фиксированной паузой и не отдаёт
+                # ошибки наружу — поэтому polling без non_stop, а паузы выбирает супервизор
+                bot.polling(
+                    non_stop=False,
                     timeout=config.REQUEST_TIMEOUT,
-                    long_polling_timeout=config.LONG_POLLING_TIMEOUT
+                    long_polling_timeout=config.LONG_POLLING_TIMEOUT,
+                    allowed_updates=config.TELEGRAM_ALLOWED_UPDATES
                 )
-            except requests.exceptions.ReadTimeout:
-                logger.warning("Read timeout occurred, restarting polling...")
-                restart_count += 1
-                time.sleep(restart_delay)
+                if polling_errors.last_error is None:
+                    break  # Штатная остановка (Ctrl+C)
+                raise polling_errors.last_error
             except Exception as e:
-                logger.error(f"Unexpected error: {e}")
+                if time.monotonic() - started > config.POLLING_HEALTHY_PERIOD:
+                    restart_count = 0
+                delay = max(
+                    full_jitter(restart_count, cap=config.POLLING_MAX_RESTART_DELAY),
+                    telegram_circuit.retry_in()
+                )
                 restart_count += 1
-                time.sleep(restart_delay)
-                
-        logger.critical("Maximum restart attempts reached, exiting")
+                logger.error(f"Polling failed: {e}, restart #{restart_count} in {delay:.0f}s")
+                time.sleep(delay)
     except Exception as e:
         logger.critical(f"Bot crashed: {e}")
     finally:
-        if config.RANDOM_JOKE_ENABLED:
-            joke_scheduler.stop()
\ No newline at end of file
+        if config.RANDOM_JOKE_ENABLED and joke_scheduler is not None:
+            joke_scheduler.stop()
+        # Возвращаем неиспользованные ID одобренных анекдотов
+        id_allocator.release()
+        # Дописываем отложенные изменения
+        write_buffer.stop()
+        last_joke_tracker.stop()
\ No newline at end of file
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import re
+import time
+from collections import namedtuple
+
+import aiohttp
+import requests
+from telebot.apihelper import ApiTelegramException
+
+import config
+from resilience import CircuitOpenError, full_jitter
+
+logger = logging.getLogger(__name__)
+
+# Сообщение рассылки; on_sent — необязательная фабрика корутины, вызывается после доставки,
+# key — ключ идемпотентности сообщения в Outbox
+Delivery = namedtuple('Delivery', ['chat_id', 'text', 'on_sent', 'key'], defaults=[None, None])
+
+_RETRY_AFTER_TEXT = re.compile(r'retry after (\d+)', re.IGNORECASE)
+
+# Сетевые сбои обоих транспортов (telebot/requests и aiohttp), которые стоит повторить
+_TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+)
+
+
+def retry_after_seconds(error):
+    """Сколько секунд Telegram просит подождать (для ошибки 429), иначе None"""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 429:
+        return None
+    parameters = (error.result_json or {}).get('parameters') or {}
+    if parameters.get('retry_after') is not None:
+        return float(parameters['retry_after'])
+    match = _RETRY_AFTER_TEXT.search(error.description or '')
+    return float(match.group(1)) if match else 1.0
+
+
+def migrate_to_chat_id(error):
+    """Новый ID, если группа стала супергруппой (migrate_to_chat_id), иначе None"""
+    if not isinstance(error, ApiTelegramException):
+        return None
+    parameters = (error.result_json or {}).get('parameters') or {}
+    return parameters.get('migrate_to_chat_id')
+
+
+# Классы ошибок Bot API
+RATE_LIMITED = 'rate_limited'  # 429: ждать retry_after и повторить
+CIRCUIT_OPEN = 'circuit_open'  # Автомат Telegram разомкнут: ждать пробного запроса
+MIGRATED = 'migrated'  # Группа стала супергруппой: отправить по новому ID и перенести подписку
+TRANSIENT = 'transient'  # Сеть или 5xx: повторить позже
+PERMANENT = 'permanent'  # Чат недоступен навсегда: отписать
+REJECTED = 'rejected'  # Telegram отверг само сообщение: не повторять, но чат жив
+
+# Ответы 400, после которых писать в чат бессмысленно
+_PERMANENT_DESCRIPTIONS = (
+    'chat not found',
+    'user is deactivated',
+    'bot was kicked',
+    'bot is not a member',
+    'not enough rights to send',
+    'have no rights to send',
+    'chat_write_forbidden',
+)
+
+
+def classify_error(error):
+    """Класс ошибки отправки: RATE_LIMITED, MIGRATED, TRANSIENT, PERMANENT, REJECTED..."""
+    if retry_after_seconds(error) is not None:
+        return RATE_LIMITED
+    if migrate_to_chat_id(error) is not None:
+        return MIGRATED
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return TRANSIENT
+    if isinstance(error, ApiTelegramException):
+        if error.error_code >= 500:
+            return TRANSIENT
+        # 403: заблокирован пользователем, исключён из группы, пользователь удалён
+        if error.error_code == 403:
+            return PERMANENT
+        description = (error.description or '').lower()
+        if any(text in description for text in _PERMANENT_DESCRIPTIONS):
+            return PERMANENT
+    return REJECTED
+
+
+class TokenBucket:
+    """Глобальный лимит скорости: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def drain(self):
+        """Обнуляет запас, чтобы после паузы не было всплеска"""
+        self._tokens = 0
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastProgress:
+    """Счётчики одной рассылки для прогресса и итоговой сводки"""
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+        self.dead_chats = {}  # chat_id -> причина; такие чаты отписываются после рассылки
+        self.migrated_chats = {}  # старый chat_id -> новый; подписка переносится после рассылки
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"Broadcast '{self.label}': {self.done}/{self.total} done, "
+                f"{self.sent} sent, {self.failed} failed, {self.retried} retried, "
+                f"{self.throttled} throttled, {len(self.dead_chats)} dead chats, "
+                f"{len(self.migrated_chats)} migrated, "
+                f"{self.rate():.1f} msg/s over {self.elapsed():.0f}s")
+
+
+class BroadcastEngine:
+    """Рассылка с соблюдением лимитов Telegram.
+
+    Все рассылки процесса делят один глобальный token bucket (~30 сообщений/с).
+    Для каждого чата выдерживается интервал: 1 с для личных чатов, 60/20 с для групп.
+    Ответ 429 с retry_after ставит на паузу весь конвейер, а сообщение возвращается
+    в очередь — ничего не теряется. send_message(chat_id, text) — корутина
+    (AsyncTelegramSender) или синхронная функция, которая вызывается в executor.
+    """
+
+    def __init__(self, send_message, executor=None, rate=None, concurrency=None, outbox=None):
+        self._send_message = send_message
+        self._executor = executor
+        self._bucket = TokenBucket(rate or config.BROADCAST_RATE)
+        self._concurrency = concurrency or config.SCHEDULER_THREAD_POOL_SIZE
+        self._is_async = asyncio.iscoroutinefunction(send_message)
+        self._outbox = outbox
+        self._stopped = False
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._chat_ready_at = {}
+        self.last_progress = {}
+
+    def _chat_interval(self, chat_id):
+        # Отрицательные ID — группы и супергруппы
+        if int(chat_id) < 0:
+            return 60.0 / config.BROADCAST_GROUP_PER_MINUTE
+        return 1.0 / config.BROADCAST_PRIVATE_PER_SECOND
+
+    def stop(self):
+        """Прекращает рассылки; неотправленное остаётся в outbox со статусом pending"""
+        self._stopped = True
+
+    async def drain(self, timeout):
+        """Ждёт отправки, начатые до stop(), чтобы их статусы успели попасть в outbox"""
+        deadline = time.monotonic() + timeout
+        while self._in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._in_flight:
+            logger.warning(f"{self._in_flight} deliveries still in flight after {timeout}s, they will be resent")
+
+    def pause(self, seconds, reason="Telegram flood limit hit"):
+        """Останавливает все отправки на seconds секунд"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._bucket.drain()
+            logger.warning(f"{reason}, pausing broadcasts for {seconds:.0f}s")
+
+    async def _wait_turn(self, chat_id):
+        """Ждёт паузу, интервал чата и токен глобального лимита"""
+        while not self._stopped:
+            now = time.monotonic()
+            wait = max(self._paused_until, self._chat_ready_at.get(chat_id, 0.0)) - now
+            if wait > 0:
+                # Короткими шагами, чтобы stop() не ждал конца длинной паузы
+                await asyncio.sleep(min(wait, 1.0))
+                continue
+            await self._bucket.acquire()
+            # Пока ждали токен, могла начаться пауза
+            if time.monotonic() >= self._paused_until:
+                self._chat_ready_at[chat_id] = time.monotonic() + self._chat_interval(chat_id)
+                return
+
+    async def _send(self, chat_id, text):
+        if self._is_async:
+            return await self._send_message(chat_id, text)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._send_message, chat_id, text)
+
+    async def _deliver(self, delivery, progress):
+        self._in_flight += 1
+        try:
+            await self._deliver_one(delivery, progress)
+        finally:
+            self._in_flight -= 1
+
+    async def _deliver_one(self, delivery, progress):
+        attempt = 0
+        while True:
+            await self._wait_turn(delivery.chat_id)
+            if self._stopped:
+                return
+            try:
+                await self._send(delivery.chat_id, delivery.text)
+                progress.sent += 1
+                if self._outbox is not None and delivery.key is not None:
+                    self._outbox.mark_sent(delivery.key)
+                break
+            except Exception as e:
+                if self._stopped:
+                    return
+                kind = classify_error(e)
+                if kind == RATE_LIMITED:
+                    # Лимит не считается неудачной попыткой: сообщение ждёт своей очереди
+                    progress.throttled += 1
+                    self.pause(retry_after_seconds(e))
+                    continue
+                if kind == CIRCUIT_OPEN:
+                    # Telegram недоступен: весь конвейер ждёт, сообщения не теряются
+                    self.pause(e.retry_in, reason="Telegram circuit is open")
+                    continue
+                if kind == MIGRATED:
+                    # Группа стала супергруппой: то же сообщение уходит по новому ID
+                    new_chat_id = migrate_to_chat_id(e)
+                    logger.info(f"Chat {delivery.chat_id} migrated to {new_chat_id}")
+                    progress.migrated_chats[delivery.chat_id] = new_chat_id
+                    delivery = delivery._replace(chat_id=new_chat_id)
+                    continue
+                attempt += 1
+                if kind != TRANSIENT or attempt >= config.BROADCAST_MAX_RETRIES:
+                    if kind == PERMANENT:
+                        # Мёртвый чат: без повторов, после рассылки его отпишут
+                        logger.info(f"Chat {delivery.chat_id} is unreachable: {e}")
+                        progress.dead_chats[delivery.chat_id] = getattr(e, 'description', None) or str(e)
+                    else:
+                        logger.error(f"Error sending to {delivery.chat_id} (attempt {attempt}): {e}")
+                    progress.failed += 1
+                    if self._outbox is not None and delivery.key is not None:
+                        self._outbox.mark_failed(delivery.key, e)
+                    return
+                logger.warning(f"Transient error for {delivery.chat_id}, retrying: {e}")
+                progress.retried += 1
+                await asyncio.sleep(full_jitter(attempt - 1, base=config.BROADCAST_RETRY_DELAY))
+
+        if delivery.on_sent is not None:
+            try:
+                await delivery.on_sent()
+            except Exception as e:
+                logger.error(f"Error after sending to {delivery.chat_id}: {e}")
+
+    async def _worker(self, queue, progress):
+        while not self._stopped:
+            try:
+                delivery = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._deliver(delivery, progress)
+
+    async def _report(self, progress):
+        while True:
+            await asyncio.sleep(config.BROADCAST_PROGRESS_INTERVAL)
+            logger.info(progress.summary())
+
+    async def broadcast(self, deliveries, label='broadcast'):
+        """Доставляет все сообщения и возвращает BroadcastProgress"""
+        progress = BroadcastProgress(label, len(deliveries))
+        self.last_progress[label] = progress
+        if not deliveries:
+            return progress
+
+        queue = asyncio.Queue()
+        for delivery in deliveries:
+            queue.put_nowait(delivery)
+
+        reporter = asyncio.ensure_future(self._report(progress))
+        try:
+            workers = [self._worker(queue, progress) for _ in range(min(self._concurrency, len(deliveries)))]
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            progress.finished_at = time.monotonic()
+            self._forget_idle_chats()
+        logger.info(progress.summary())
+        return progress
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        self._chat_ready_at = {chat_id: ready for chat_id, ready in self._chat_ready_at.items() if ready > now}
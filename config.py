@@ -4,28 +4,116 @@ BOT_TOKEN = ""
 # Admin User IDs
 ADMIN_IDS = []
 
+# Storage backend: "firebase" или "sqlite" (локальная база в режиме WAL)
+STORAGE_BACKEND = "firebase"
+SQLITE_DB_PATH = "jokebot.db"
+
 # Firebase Settings
 FIREBASE_DATABASE_URL = ""
 FIREBASE_CREDENTIALS_FILE = ".json"
 
+# Joke cache settings
+JOKE_CACHE_LOAD_TIMEOUT = 30  # Сколько ждать первый снимок /jokes от listener
+JOKE_CACHE_RESYNC_INTERVAL = 30 * 60  # Периодическая полная пересинхронизация
+
+# Near-duplicate detection (MinHash + LSH)
+NEAR_DUP_ENABLED = True
+NEAR_DUP_NUM_PERM = 64  # Длина MinHash-сигнатуры
+NEAR_DUP_BANDS = 16  # Полос LSH (порог срабатывания ~ (1/16)^(1/4) ≈ 0.5)
+NEAR_DUP_SHINGLE_SIZE = 4  # Длина символьного шингла
+NEAR_DUP_TOP_K = 3  # Сколько похожих анекдотов показывать
+NEAR_DUP_MIN_SCORE = 0.4  # Минимальная оценка сходства для показа
+
+# Moderation settings
+MODERATION_LEASE_SECONDS = 10 * 60  # Сколько анекдот закреплён за администратором
+MODERATION_CLAIM_CANDIDATES = 10  # Сколько первых анекдотов очереди просматривать при захвате
+BULK_MODERATION_PAGE_SIZE = 10  # Анекдотов на странице пакетной модерации
+ID_LEASE_BLOCK_SIZE = 20  # Сколько ID одобренных анекдотов арендовать за одну транзакцию
+
+# Write-behind buffer (отложенная пакетная запись в базу)
+WRITE_BUFFER_FLUSH_INTERVAL = 0.5  # Секунд между сбросами
+WRITE_BUFFER_MAX_ENTRIES = 500  # Сбросить раньше, если накопилось столько путей
+WRITE_BUFFER_RETRY_DELAY = 5  # Пауза после неудачного сброса
+WRITE_BUFFER_MAX_RETRY_BATCHES = 100  # Сколько неудачных пакетов держать для повтора
+
+# Last delivered joke per chat (для случайного режима без повторов подряд)
+LAST_JOKE_MAX_CHATS = 1000000  # Дальше вытесняются давно не получавшие анекдот чаты
+LAST_JOKE_SNAPSHOT_PATH = "last_jokes.bin"  # None — не сохранять между перезапусками
+LAST_JOKE_SNAPSHOT_INTERVAL = 5 * 60
+
+# User conversation states
+USER_STATE_TTL = 60 * 60  # Брошенный диалог (добавление, модерация) забывается через час
+USER_STATE_MAX_ENTRIES = 10000  # Сверх этого вытесняются давно не использованные
+USER_STATE_DB_PATH = "states.db"  # None — хранить только в памяти
+USER_STATE_SWEEP_INTERVAL = 60  # Как часто вычищать просроченные состояния
+
 # Application Settings
 MIN_JOKE_LENGTH = 10
 
 # Random joke settings
 RANDOM_JOKE_ENABLED = True
+JOKE_DECK_MODE = True  # Каждый чат проходит все анекдоты без повторов
 JOKE_INTERVAL = 12 * 60 * 60
+JOKE_DELIVERY_MODE = "spread"  # "spread" — каждому подписчику в его слот интервала, "batch" — всем сразу
+JOKE_DELIVERY_TICK = 60  # Шаг колеса рассылки в режиме spread, секунд
 
 # Group settings
 GROUP_DB_PATH = "groups"  # Отдельная ветка в Firebase для групп
 GROUP_TRIGGER_WORDS = ["анекдот", "шутка", "расскажи смешное"]  # Триггерные слова
-GROUP_JOKE_INTERVAL = 12 * 60 * 60
+GROUP_JOKE_INTERVAL = 12 * 60 * 60  # По умолчанию; группа может задать свой через /set_interval
+GROUP_MIN_INTERVAL = 60 * 60
+GROUP_MAX_INTERVAL = 7 * 24 * 60 * 60
+GROUP_TRIGGER_WORDS_FILE = "trigger_words.txt"  # Если файл есть, список берётся из него (по слову или фразе на строку)
+GROUP_TRIGGER_MAX_SUFFIX = 3  # Сколько букв может идти после основы триггера (анекдот-ик)
+GROUP_TRIGGER_TYPO_MIN_LENGTH = 5  # С какой длины основы прощается одна опечатка
+GROUP_TRIGGER_CACHE_SIZE = 50000  # Кеш результатов по отдельным словам
 
 # Thread pool settings
 USER_THREAD_POOL_SIZE = 20  # Для обработки пользовательских запросов
 SCHEDULER_THREAD_POOL_SIZE = 10  # Для отправки запланированных сообщений
+SCHEDULER_STOP_TIMEOUT = 15  # Сколько при остановке ждать уже начатые отправки, секунд
+
+# Broadcast limits (лимиты Telegram Bot API)
+BROADCAST_RATE = 30  # Сообщений в секунду на всего бота
+BROADCAST_PRIVATE_PER_SECOND = 1  # Сообщений в секунду в один личный чат
+BROADCAST_GROUP_PER_MINUTE = 20  # Сообщений в минуту в одну группу
+BROADCAST_MAX_RETRIES = 3  # Попыток при сетевых ошибках
+BROADCAST_RETRY_DELAY = 2
+BROADCAST_PROGRESS_INTERVAL = 30  # Как часто писать прогресс рассылки в лог
+
+# Async sender (aiohttp) for scheduled deliveries
+ASYNC_SENDER_ENABLED = True  # False — отправка через bot.send_message в пуле потоков
+ASYNC_SENDER_CONCURRENCY = 200  # Запросов в полёте одновременно
+ASYNC_SENDER_KEEPALIVE = 60  # Сколько держать простаивающее соединение
+BOT_API_URL = "https://api.telegram.org"
+
+# Durable outbox (SQLite WAL) for scheduled deliveries
+OUTBOX_ENABLED = True
+OUTBOX_DB_PATH = "outbox.db"
+OUTBOX_COMMIT_INTERVAL = 0.2  # Групповая фиксация статусов, секунд
+OUTBOX_MAX_AGE = 6 * 60 * 60  # Старше — не досылаем после перезапуска
+OUTBOX_RETENTION = 24 * 60 * 60  # Сколько хранить отправленные сообщения
 
 # Network settings
 REQUEST_TIMEOUT = 120
 LONG_POLLING_TIMEOUT = 100
 MAX_NETWORK_RETRIES = 5
+# chat_member приходит только если перечислен явно; нужен для сброса кеша администраторов
+TELEGRAM_ALLOWED_UPDATES = ["message", "callback_query", "my_chat_member", "chat_member"]
+
+# Telegram metadata cache
+TELEGRAM_ADMIN_CACHE_TTL = 10 * 60  # Сколько верить списку администраторов группы
+TELEGRAM_ADMIN_CACHE_SIZE = 10000  # Групп в кеше, дальше вытесняются давно не использованные
+
+# Resilience: экспоненциальная пауза с полным джиттером, бюджет повторов, автоматы
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+RETRY_MAX_ATTEMPTS = 3
+RETRY_MAX_429_WAIT = 5  # Дольше — не ждём внутри запроса, а отдаём 429 вызывающему
+RETRY_BUDGET_RATIO = 0.2  # Повторов на один исходный запрос
+RETRY_BUDGET_MAX_TOKENS = 20
+CIRCUIT_FAILURE_THRESHOLD = 5  # Сбоев подряд до размыкания
+CIRCUIT_RESET_TIMEOUT = 30  # Через сколько секунд пробовать снова
+POLLING_MAX_RESTART_DELAY = 5 * 60
+POLLING_HEALTHY_PERIOD = 10 * 60  # Столько без сбоев — и счётчик перезапусков сбрасывается
 
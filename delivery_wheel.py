@@ -0,0 +1,46 @@
+import threading
+import zlib
+
+
+class DeliveryWheel:
+    """Колесо таймеров для равномерной рассылки.
+
+    Интервал делится на слоты по tick секунд. Каждый чат получает постоянный
+    слот по crc32 своего ID, поэтому за оборот колеса (интервал) он встречается
+    ровно один раз, а нагрузка распределяется по слотам равномерно.
+    """
+
+    def __init__(self, interval, tick):
+        self.interval = interval
+        self.tick = tick
+        self.size = max(1, int(interval // tick))
+        self._lock = threading.Lock()
+        self._slots = [set() for _ in range(self.size)]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(slot) for slot in self._slots)
+
+    def slot_of(self, chat_id):
+        return zlib.crc32(str(chat_id).encode('utf-8')) % self.size
+
+    def slot_at(self, timestamp):
+        """Слот, который проходит колесо в момент timestamp"""
+        return int((timestamp % self.interval) // self.tick) % self.size
+
+    def seconds_until_next_slot(self, timestamp):
+        return self.tick - (timestamp % self.interval) % self.tick
+
+    def add(self, chat_id):
+        chat_id = int(chat_id)
+        with self._lock:
+            self._slots[self.slot_of(chat_id)].add(chat_id)
+
+    def remove(self, chat_id):
+        chat_id = int(chat_id)
+        with self._lock:
+            self._slots[self.slot_of(chat_id)].discard(chat_id)
+
+    def chats_in(self, slot):
+        with self._lock:
+            return list(self._slots[slot])
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+import time
+
+from async_utils import run_async
+from states import get_user_state
+from telegram_cache import telegram_cache
+from utils import is_admin, log_message
+
+logger = logging.getLogger(__name__)
+
+PRIVATE = 'private'
+GROUP = 'group'
+
+# Супергруппы обрабатываются так же, как обычные группы
+_CHAT_KINDS = {'private': PRIVATE, 'group': GROUP, 'supergroup': GROUP}
+
+
+class Route:
+    """Обработчик вместе со счётчиками вызовов и времени выполнения"""
+
+    def __init__(self, handler, name=None, admin_only=False, log=True):
+        self.handler = handler
+        self.name = name or handler.__name__
+        self.admin_only = admin_only
+        self.log = log
+        self.is_async = asyncio.iscoroutinefunction(handler)
+        self.logger = logging.getLogger(handler.__module__)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, failed=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+
+class Router:
+    """Таблица маршрутизации обновлений, собираемая один раз при старте.
+
+    Вместо цепочки фильтров telebot, которые проверяются по очереди для
+    каждого обновления, регистрируется по одному обработчику сообщений и
+    callback-запросов. Маршрут выбирается поиском в словарях: команда или
+    точный текст кнопки для типа чата, затем состояние пользователя (только
+    в личных чатах), затем запасной обработчик типа чата.
+    """
+
+    def __init__(self):
+        self._commands = {}  # (тип чата, команда) -> Route
+        self._texts = {}  # (тип чата, текст) -> Route
+        self._states = {}  # состояние пользователя -> Route
+        self._fallbacks = {}  # тип чата -> Route
+        self._callbacks = {}  # callback data -> Route
+        self._callback_prefixes = {}  # часть callback data до ':' -> Route
+        self._callback_fallback = None
+        self._routes = []
+
+    def _add(self, handler, name, admin_only=False, log=True):
+        route = Route(handler, name, admin_only, log)
+        self._routes.append(route)
+        return route
+
+    def command(self, commands, handler, chat_types=(PRIVATE,), admin_only=False, name=None):
+        route = self._add(handler, name, admin_only)
+        for chat_type in chat_types:
+            for command in commands:
+                self._commands[(chat_type, command.lower())] = route
+
+    def text(self, texts, handler, chat_types=(PRIVATE,), admin_only=False, name=None):
+        route = self._add(handler, name, admin_only)
+        for chat_type in chat_types:
+            for text in texts:
+                self._texts[(chat_type, text)] = route
+
+    def state(self, state, handler, name=None):
+        self._states[state] = self._add(handler, name)
+
+    def fallback(self, chat_type, handler, name=None):
+        """Обработчик сообщений без маршрута; логирует сообщения сам"""
+        self._fallbacks[chat_type] = self._add(handler, name, log=False)
+
+    def callback(self, data, handler, name=None):
+        route = self._add(handler, name)
+        for value in data:
+            self._callbacks[value] = route
+
+    def callback_prefix(self, prefix, handler, name=None):
+        self._callback_prefixes[prefix] = self._add(handler, name)
+
+    def callback_fallback(self, handler, name=None):
+        self._callback_fallback = self._add(handler, name)
+
+    def install(self, bot):
+        """Регистрирует в telebot единственные обработчики сообщений и callback-запросов"""
+        @bot.message_handler(func=lambda message: True)
+        def dispatch_message(message):
+            route = self.resolve_message(bot, message)
+            if route is not None:
+                if route.log:
+                    log_message(route.logger, message)
+                self._run(route, bot, message)
+
+        @bot.callback_query_handler(func=lambda call: True)
+        def dispatch_callback(call):
+            route = self.resolve_callback(call)
+            if route is not None:
+                self._run(route, bot, call)
+
+    def _command_of(self, bot, text):
+        """Команда из текста; None, если команда адресована другому боту"""
+        command, _, target = text.split(maxsplit=1)[0][1:].partition('@')
+        if target and target.lower() != telegram_cache.get_bot_username(bot):
+            return None
+        return command.lower()
+
+    def _allowed(self, route, user_id):
+        return route is not None and (not route.admin_only or is_admin(user_id))
+
+    def resolve_message(self, bot, message):
+        kind = _CHAT_KINDS.get(message.chat.type)
+        if kind is None:
+            return None
+        text = message.text or ''
+        user_id = message.from_user.id
+
+        if text.startswith('/'):
+            route = self._commands.get((kind, self._command_of(bot, text)))
+        else:
+            route = self._texts.get((kind, text))
+        if self._allowed(route, user_id):
+            return route
+
+        if kind == PRIVATE:
+            user_state = get_user_state(user_id)
+            if user_state:
+                route = self._states.get(user_state.get('state'))
+                if route is not None:
+                    return route
+
+        return self._fallbacks.get(kind)
+
+    def resolve_callback(self, call):
+        data = call.data or ''
+        route = self._callbacks.get(data)
+        if route is None:
+            route = self._callback_prefixes.get(data.partition(':')[0], self._callback_fallback)
+        return route
+
+    def _run(self, route, bot, update):
+        if route.is_async:
+            run_async(self._run_async(route, route.handler(bot, update)))
+            return
+        started = time.perf_counter()
+        failed = False
+        try:
+            route.handler(bot, update)
+        except Exception as e:
+            failed = True
+            route.logger.error(f"Error in {route.name}: {e}")
+        finally:
+            route.record(time.perf_counter() - started, failed)
+
+    async def _run_async(self, route, coro):
+        started = time.perf_counter()
+        failed = False
+        try:
+            await coro
+        except Exception as e:
+            failed = True
+            route.logger.error(f"Error in {route.name}: {e}")
+        finally:
+            route.record(time.perf_counter() - started, failed)
+
+    def stats(self):
+        """Счётчики маршрутов, самые затратные по суммарному времени первыми"""
+        result = []
+        for route in self._routes:
+            with route._lock:
+                result.append({
+                    'name': route.name,
+                    'calls': route.calls,
+                    'errors': route.errors,
+                    'total_time': route.total_time,
+                    'avg_time': route.total_time / route.calls if route.calls else 0.0,
+                    'max_time': route.max_time,
+                })
+        result.sort(key=lambda item: item['total_time'], reverse=True)
+        return result
+
+
+# Общая таблица маршрутов для всего процесса
+router = Router()
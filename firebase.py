@@ -3,9 +3,20 @@ from firebase_admin import credentials, db
 import random
 import logging
 import os
+import time
 import config
 import asyncio
 from datetime import datetime
+from joke_cache import joke_corpus, joke_text_digest
+from joke_deck import joke_decks
+from joke_assignment import JokePlan, assign_random, assign_from_decks
+from near_duplicates import near_duplicates
+from id_allocator import id_allocator
+from write_buffer import write_buffer
+from storage import generate_push_id
+from sqlite_db import SQLiteDatabase
+from resilience import ResilientReference
+from last_jokes import last_joke_tracker
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +24,29 @@ logger = logging.getLogger(__name__)
 root_ref = None
 
 def initialize_firebase():
+    """Открывает хранилище, выбранное в config.STORAGE_BACKEND, и прогревает кэши"""
     global root_ref
     if root_ref is not None:
         return root_ref
-        
+
+    if config.STORAGE_BACKEND == 'sqlite':
+        ref = SQLiteDatabase(config.SQLITE_DB_PATH).reference('/')
+        logger.info(f"SQLite storage opened: {config.SQLITE_DB_PATH}")
+    else:
+        ref = _initialize_firebase_app()
+    # Пока база недоступна, обращения к ней падают сразу, а не занимают потоки
+    root_ref = ResilientReference(ref)
+
+    write_buffer.start(root_ref)
+    # Загружаем анекдоты в память один раз, дальше их обновляет listener
+    joke_corpus.start(root_ref)
+    joke_decks.start(root_ref)
+    id_allocator.start(root_ref)
+    if config.NEAR_DUP_ENABLED:
+        near_duplicates.start(joke_corpus)
+    return root_ref
+
+def _initialize_firebase_app():
     # Проверяем наличие файла с учетными данными
     if not os.path.exists(config.FIREBASE_CREDENTIALS_FILE):
         logger.error(f"Firebase credentials file not found: {config.FIREBASE_CREDENTIALS_FILE}")
@@ -25,21 +55,18 @@ def initialize_firebase():
     try:
         cred = credentials.Certificate(config.FIREBASE_CREDENTIALS_FILE)
         firebase_admin.initialize_app(cred, {'databaseURL': config.FIREBASE_DATABASE_URL})
-        root_ref = db.reference('/')
+        ref = db.reference('/')
         logger.info("Firebase initialized successfully")
-        return root_ref
+        return ref
     except Exception as e:
         logger.error(f"Firebase initialization failed: {e}")
         raise
 
 async def get_next_approved_id(root_ref):
-    """Получает следующий ID для одобренного анекдота"""
+    """Получает следующий ID для одобренного анекдота из арендованного блока"""
     try:
-        counter_ref = root_ref.child('approved_counter')
-        current_value = counter_ref.get() or 0
-        new_value = current_value + 1
-        counter_ref.set(new_value)
-        return new_value
+        # Новый блок ID арендуется транзакцией — не в цикле событий
+        return await asyncio.get_running_loop().run_in_executor(None, id_allocator.allocate)
     except Exception as e:
         logger.error(f"Error updating approved joke counter: {e}")
         return None
@@ -47,16 +74,33 @@ async def get_next_approved_id(root_ref):
 async def get_approved_jokes_count(root_ref):
     """Получает количество одобренных анекдотов"""
     try:
-        counter = root_ref.child('approved_counter').get()
+        if joke_corpus.loaded:
+            return joke_corpus.approved_count()
+        counter = await root_ref.child('approved_counter').get_async()
         return counter or 0
     except Exception as e:
         logger.error(f"Error getting approved jokes count: {e}")
         return 0
 
+async def get_last_approved_id(root_ref):
+    """Наибольший ID среди одобренных анекдотов.
+
+    approved_counter включает арендованные, но ещё не выданные ID, поэтому берём его только без кэша.
+    """
+    try:
+        if joke_corpus.loaded:
+            return joke_corpus.max_joke_id()
+        return await root_ref.child('approved_counter').get_async() or 0
+    except Exception as e:
+        logger.error(f"Error getting last approved ID: {e}")
+        return 0
+
 async def get_total_jokes_count(root_ref):
     """Получает общее количество анекдотов (включая неодобренные)"""
     try:
-        jokes = root_ref.child('jokes').get()
+        if joke_corpus.loaded:
+            return joke_corpus.count()
+        jokes = await root_ref.child('jokes').get_async()
         return len(jokes) if jokes else 0
     except Exception as e:
         logger.error(f"Error getting total jokes count: {e}")
@@ -64,15 +108,17 @@ async def get_total_jokes_count(root_ref):
 
 async def get_user_jokes(root_ref, user_id, only_approved=True):
     try:
-        jokes_ref = root_ref.child('jokes')
-        all_jokes = jokes_ref.get() or {}
+        if joke_corpus.loaded:
+            return joke_corpus.user_jokes(user_id, only_approved)
+
+        # Индекс user_jokes/{user_id} хранит только ключи анекдотов пользователя
+        keys = await root_ref.child(f'user_jokes/{user_id}').get_async() or {}
         
-        # Фильтрация по пользователю и approved
         user_jokes = {}
-        for key, joke in all_jokes.items():
-            if joke.get('user_id') == user_id:
-                if not only_approved or joke.get('approved', False):
-                    user_jokes[key] = joke
+        for key in keys:
+            joke = await root_ref.child(f'jokes/{key}').get_async()
+            if joke and (not only_approved or joke.get('approved', False)):
+                user_jokes[key] = joke
         return user_jokes
     except Exception as e:
         logger.error(f"Error getting user jokes: {e}")
@@ -81,8 +127,10 @@ async def get_user_jokes(root_ref, user_id, only_approved=True):
 async def find_joke_by_key(root_ref, joke_key):
     """Находит анекдот по ключу в базе данных"""
     try:
+        if joke_corpus.loaded:
+            return joke_corpus.get(joke_key)
         joke_ref = root_ref.child(f'jokes/{joke_key}')
-        joke = joke_ref.get()
+        joke = await joke_ref.get_async()
         return joke if joke else None
     except Exception as e:
         logger.error(f"Error finding joke by key: {e}")
@@ -91,21 +139,24 @@ async def find_joke_by_key(root_ref, joke_key):
 async def find_joke_by_id(root_ref, joke_id):
     """Находит анекдот по ID (только для одобренных)"""
     try:
-        jokes_ref = root_ref.child('jokes')
-        jokes = jokes_ref.get() or {}
-        
-        for key, joke in jokes.items():
-            if joke.get('joke_id') == joke_id:
-                return key, joke
-        return None, None
+        if joke_corpus.loaded:
+            return joke_corpus.find_by_id(joke_id)
+
+        key = await root_ref.child(f'approved_by_id/{joke_id}').get_async()
+        if not key:
+            return None, None
+        joke = await root_ref.child(f'jokes/{key}').get_async()
+        return (key, joke) if joke else (None, None)
     except Exception as e:
         logger.error(f"Error finding joke by ID: {e}")
         return None, None
 
 async def get_random_joke(root_ref, exclude_joke_id=None):
     try:
-        jokes_ref = root_ref.child('jokes')
-        jokes = jokes_ref.get()
+        if joke_corpus.loaded:
+            return joke_corpus.random_approved(exclude_joke_id)
+
+        jokes = await root_ref.child('jokes').get_async()
         if not jokes:
             return None
 
@@ -132,10 +183,54 @@ async def get_random_joke(root_ref, exclude_joke_id=None):
         logger.error(f"Error getting random joke: {e}")
         return None
 
+async def get_joke_for_chat(root_ref, chat_id):
+    """Выбирает анекдот для чата: из колоды без повторов или случайный, кроме последнего"""
+    try:
+        if config.JOKE_DECK_MODE and joke_corpus.loaded:
+            return joke_decks.next_joke(chat_id)
+
+        joke = await get_random_joke(root_ref, exclude_joke_id=last_joke_tracker.get(chat_id))
+        if joke:
+            last_joke_tracker[chat_id] = joke['joke_id']
+        return joke
+    except Exception as e:
+        logger.error(f"Error getting joke for chat {chat_id}: {e}")
+        return None
+
+async def plan_jokes_for_chats(root_ref, chat_ids):
+    """Назначает анекдоты сразу всем получателям рассылки; возвращает JokePlan"""
+    try:
+        if config.JOKE_DECK_MODE and joke_corpus.loaded:
+            return assign_from_decks(chat_ids, joke_decks)
+
+        if joke_corpus.loaded:
+            approved = [joke for _, joke in joke_corpus.approved_items()]
+        else:
+            # Кэш не готов: один раз скачиваем корпус на всю рассылку
+            jokes = await root_ref.child('jokes').get_async() or {}
+            approved = [joke for joke in jokes.values() if joke.get('approved', False)]
+        return assign_random(chat_ids, approved, last_joke_tracker)
+    except Exception as e:
+        logger.error(f"Error planning jokes for {len(chat_ids)} chats: {e}")
+        return JokePlan.empty()
+
+# Подписчики на изменения подписок: callback(subscribed, user_id)
+_subscription_listeners = []
+
+def add_subscription_listener(callback):
+    _subscription_listeners.append(callback)
+
+def _notify_subscription(subscribed, user_id):
+    for callback in list(_subscription_listeners):
+        try:
+            callback(subscribed, user_id)
+        except Exception as e:
+            logger.error(f"Error in subscription listener: {e}")
+
 async def subscribe_user(root_ref, user_id):
     try:
-        ref = root_ref.child('subscribers').child(str(user_id))
-        ref.set(True)
+        write_buffer.set(f'subscribers/{user_id}', True)
+        _notify_subscription(True, user_id)
         return True
     except Exception as e:
         logger.error(f"Error subscribing user: {e}")
@@ -143,8 +238,8 @@ async def subscribe_user(root_ref, user_id):
 
 async def unsubscribe_user(root_ref, user_id):
     try:
-        ref = root_ref.child('subscribers').child(str(user_id))
-        ref.delete()
+        write_buffer.delete(f'subscribers/{user_id}')
+        _notify_subscription(False, user_id)
         return True
     except Exception as e:
         logger.error(f"Error unsubscribing user: {e}")
@@ -152,22 +247,37 @@ async def unsubscribe_user(root_ref, user_id):
 
 async def get_subscribers(root_ref):
     try:
+        # Отложенные подписки/отписки должны попасть в базу до чтения
+        await write_buffer.flush_async()
         ref = root_ref.child('subscribers')
-        subscribers = ref.get() or {}
+        subscribers = await ref.get_async() or {}
         return list(subscribers.keys())
     except Exception as e:
         logger.error(f"Error getting subscribers: {e}")
         return []
 
+# Подписчики на изменения групп: callback(chat_id, changes), changes=None — группа отписана
+_group_listeners = []
+
+def add_group_listener(callback):
+    _group_listeners.append(callback)
+
+def _notify_group(chat_id, changes):
+    for callback in list(_group_listeners):
+        try:
+            callback(chat_id, changes)
+        except Exception as e:
+            logger.error(f"Error in group listener: {e}")
+
 async def subscribe_group(root_ref, chat_id, group_name=None):
     try:
-        groups_ref = root_ref.child(config.GROUP_DB_PATH)
         group_data = {
             'subscribed': True,
             'name': group_name or f"Group {chat_id}",
             'last_joke_time': None
         }
-        groups_ref.child(str(chat_id)).set(group_data)
+        write_buffer.set(f'{config.GROUP_DB_PATH}/{chat_id}', group_data)
+        _notify_group(chat_id, group_data)
         return True
     except Exception as e:
         logger.error(f"Error subscribing group: {e}")
@@ -175,47 +285,235 @@ async def subscribe_group(root_ref, chat_id, group_name=None):
 
 async def unsubscribe_group(root_ref, chat_id):
     try:
-        groups_ref = root_ref.child(config.GROUP_DB_PATH)
-        groups_ref.child(str(chat_id)).delete()
+        write_buffer.delete(f'{config.GROUP_DB_PATH}/{chat_id}')
+        _notify_group(chat_id, None)
         return True
     except Exception as e:
         logger.error(f"Error unsubscribing group: {e}")
         return False
 
+async def set_group_interval(root_ref, chat_id, interval):
+    """Меняет частоту анекдотов подписанной группы (секунды); False, если группа не подписана"""
+    try:
+        await write_buffer.flush_async()
+        group_ref = root_ref.child(config.GROUP_DB_PATH).child(str(chat_id))
+        if not await group_ref.child('subscribed').get_async():
+            return False
+        write_buffer.update(f'{config.GROUP_DB_PATH}/{chat_id}', {'interval': interval})
+        _notify_group(chat_id, {'interval': interval})
+        return True
+    except Exception as e:
+        logger.error(f"Error setting interval for group {chat_id}: {e}")
+        return False
+
 async def get_subscribed_groups(root_ref):
     try:
+        await write_buffer.flush_async()
         groups_ref = root_ref.child(config.GROUP_DB_PATH)
-        groups = groups_ref.get() or {}
+        groups = await groups_ref.get_async() or {}
         return {int(gid): data for gid, data in groups.items() if data.get('subscribed')}
     except Exception as e:
         logger.error(f"Error getting group subscribers: {e}")
         return {}
 
+async def prune_chats(root_ref, dead_chats):
+    """Отписывает чаты, доставка в которые невозможна ({chat_id: причина}), и записывает причину"""
+    try:
+        now = time.time()
+        for chat_id, reason in dead_chats.items():
+            if int(chat_id) < 0:
+                write_buffer.delete(f'{config.GROUP_DB_PATH}/{chat_id}')
+                _notify_group(chat_id, None)
+            else:
+                write_buffer.delete(f'subscribers/{chat_id}')
+                _notify_subscription(False, chat_id)
+            write_buffer.set(f'pruned_chats/{chat_id}', {'reason': reason, 'at': now})
+        await root_ref.child('pruned_count').transaction_async(lambda current: (current or 0) + len(dead_chats))
+        logger.info(f"Pruned {len(dead_chats)} unreachable chats")
+        return True
+    except Exception as e:
+        logger.error(f"Error pruning {len(dead_chats)} chats: {e}")
+        return False
+
+async def migrate_groups(root_ref, migrations):
+    """Переносит подписку и интервал групп, ставших супергруппами ({старый ID: новый ID})"""
+    try:
+        await write_buffer.flush_async()
+        groups_ref = root_ref.child(config.GROUP_DB_PATH)
+        now = time.time()
+        for old_id, new_id in migrations.items():
+            group_data = await groups_ref.child(str(old_id)).get_async()
+            if group_data and group_data.get('subscribed'):
+                # Шутку только что доставили по новому ID — отсчёт интервала от неё
+                group_data['last_joke_time'] = now
+                write_buffer.set(f'{config.GROUP_DB_PATH}/{new_id}', group_data)
+                _notify_group(new_id, group_data)
+            write_buffer.delete(f'{config.GROUP_DB_PATH}/{old_id}')
+            _notify_group(old_id, None)
+        logger.info(f"Migrated {len(migrations)} groups to supergroups")
+        return True
+    except Exception as e:
+        logger.error(f"Error migrating {len(migrations)} groups: {e}")
+        return False
+
+async def get_pruned_chats_count(root_ref):
+    """Сколько мёртвых чатов отписано автоматически"""
+    try:
+        return await root_ref.child('pruned_count').get_async() or 0
+    except Exception as e:
+        logger.error(f"Error getting pruned chats count: {e}")
+        return 0
+
+async def find_duplicate_joke(root_ref, text):
+    """Ищет анекдот с тем же нормализованным текстом по индексу хешей"""
+    try:
+        digest = joke_text_digest(text)
+        if joke_corpus.loaded:
+            return joke_corpus.find_by_digest(digest)
+        return await root_ref.child(f'joke_hashes/{digest}').get_async()
+    except Exception as e:
+        logger.error(f"Error checking duplicate joke: {e}")
+        return None
+
+async def find_similar_jokes(root_ref, text, exclude_key=None):
+    """Ищет похожие одобренные анекдоты: список (анекдот, оценка сходства)"""
+    try:
+        if not config.NEAR_DUP_ENABLED or not near_duplicates.ready:
+            return []
+        similar = []
+        for key, score in near_duplicates.similar(text, exclude_key=exclude_key):
+            joke = joke_corpus.get(key)
+            if joke:
+                similar.append((joke, score))
+        return similar
+    except Exception as e:
+        logger.error(f"Error finding similar jokes: {e}")
+        return []
+
+async def set_group_last_joke_time(root_ref, group_id, timestamp):
+    try:
+        # После каждой отправки в группу: пишем пакетами через буфер
+        write_buffer.update(f'{config.GROUP_DB_PATH}/{group_id}', {'last_joke_time': timestamp})
+        return True
+    except Exception as e:
+        logger.error(f"Error updating last joke time for group {group_id}: {e}")
+        return False
+
 async def add_joke(root_ref, text, user_id):
     """Добавляет новый анекдот без ID (до модерации)"""
     try:
-        jokes_ref = root_ref.child('jokes')
-        new_joke_ref = jokes_ref.push({
+        joke_key = generate_push_id()
+        created_at = datetime.now()
+        joke_data = {
             'text': text,
             'user_id': user_id,
             'approved': False,
-            'created_at': datetime.now().isoformat(),
+            'created_at': created_at.isoformat(),
             'joke_id': None  # Будет установлен после модерации
+        }
+        # Анекдот, записи индексов и место в очереди модерации пишутся атомарно
+        await root_ref.update_async({
+            f'jokes/{joke_key}': joke_data,
+            f'joke_hashes/{joke_text_digest(text)}': joke_key,
+            f'user_jokes/{user_id}/{joke_key}': True,
+            f'moderation_queue/{joke_key}': int(created_at.timestamp() * 1000)
         })
-        return new_joke_ref.key
+        joke_corpus.put_joke(joke_key, joke_data)
+        await adjust_pending_count(root_ref, 1)
+        return joke_key
     except Exception as e:
         logger.error(f"Error adding joke: {e}")
         return None
 
-async def get_unapproved_joke(root_ref):
-    """Получает один неодобренный анекдот"""
+class LeaseHeldError(Exception):
+    """Анекдот уже закреплён за другим администратором"""
+
+
+async def claim_joke(root_ref, joke_key, admin_id):
+    """Транзакционно закрепляет анекдот за администратором на MODERATION_LEASE_SECONDS"""
+    now = time.time()
+
+    def claim(current):
+        if current and current.get('expires_at', 0) > now and current.get('admin_id') != admin_id:
+            raise LeaseHeldError(joke_key)
+        return {'admin_id': admin_id, 'expires_at': now + config.MODERATION_LEASE_SECONDS}
+
     try:
-        jokes_ref = root_ref.child('jokes')
-        jokes = jokes_ref.get() or {}
-        
-        for key, joke in jokes.items():
-            if not joke.get('approved', False):
+        await root_ref.child(f'moderation_leases/{joke_key}').transaction_async(claim)
+        return True
+    except LeaseHeldError:
+        return False
+    except Exception as e:
+        logger.error(f"Error claiming joke {joke_key}: {e}")
+        return False
+
+async def release_joke(root_ref, joke_key, admin_id):
+    """Снимает аренду администратора с анекдота (чужую не трогает)"""
+    def release(current):
+        if current and current.get('admin_id') != admin_id:
+            raise LeaseHeldError(joke_key)
+        return None
+
+    try:
+        await root_ref.child(f'moderation_leases/{joke_key}').transaction_async(release)
+    except LeaseHeldError:
+        pass
+    except Exception as e:
+        logger.error(f"Error releasing joke {joke_key}: {e}")
+
+async def claim_pending_joke(root_ref, admin_id, exclude_keys=()):
+    """Захватывает первый свободный анекдот из очереди модерации.
+
+    Каждый администратор получает свой анекдот; просроченные аренды
+    считаются свободными, поэтому брошенные анекдоты возвращаются в очередь сами.
+    """
+    try:
+        exclude_keys = set(exclude_keys)
+        limit = config.MODERATION_CLAIM_CANDIDATES + len(exclude_keys)
+        queue = await root_ref.child('moderation_queue').order_by_key().limit_to_first(limit).get_async() or {}
+        leases = await root_ref.child('moderation_leases').get_async() or {}
+        now = time.time()
+
+        for key in queue:
+            if key in exclude_keys:
+                continue
+            lease = leases.get(key)
+            if lease and lease.get('expires_at', 0) > now and lease.get('admin_id') != admin_id:
+                continue
+            if not await claim_joke(root_ref, key, admin_id):
+                continue
+            joke = await find_joke_by_key(root_ref, key)
+            if joke and not joke.get('approved', False):
                 return key, joke
+            # Запись очереди без анекдота на модерации — убираем её
+            await root_ref.update_async({f'moderation_queue/{key}': None, f'moderation_leases/{key}': None})
+        return None, None
+    except Exception as e:
+        logger.error(f"Error claiming pending joke: {e}")
+        return None, None
+
+async def adjust_pending_count(root_ref, delta):
+    """Транзакционно меняет счётчик анекдотов на модерации"""
+    try:
+        return await root_ref.child('pending_count').transaction_async(lambda current: max(0, (current or 0) + delta))
+    except Exception as e:
+        logger.error(f"Error updating pending counter: {e}")
+        return None
+
+async def get_unapproved_joke(root_ref, max_stale=10):
+    """Получает первый анекдот из очереди модерации (ключи push упорядочены по времени)"""
+    try:
+        queue_ref = root_ref.child('moderation_queue')
+        for _ in range(max_stale):
+            first = await queue_ref.order_by_key().limit_to_first(1).get_async() or {}
+            if not first:
+                return None, None
+            key = next(iter(first))
+            joke = await find_joke_by_key(root_ref, key)
+            if joke and not joke.get('approved', False):
+                return key, joke
+            # Запись очереди без анекдота на модерации — убираем её
+            await queue_ref.child(key).delete_async()
         return None, None
     except Exception as e:
         logger.error(f"Error getting unapproved joke: {e}")
@@ -224,33 +522,59 @@ async def get_unapproved_joke(root_ref):
 async def get_unapproved_count(root_ref):
     """Получает количество неодобренных анекдотов"""
     try:
-        jokes_ref = root_ref.child('jokes')
-        jokes = jokes_ref.get() or {}
-        
-        count = 0
-        for joke in jokes.values():
-            if not joke.get('approved', False):
-                count += 1
-        return count
+        return await root_ref.child('pending_count').get_async() or 0
     except Exception as e:
         logger.error(f"Error getting unapproved count: {e}")
         return 0
 
+def _approval_updates(joke_key, joke, joke_id, approved_at):
+    """Multi-path записи для одобрения анекдота и поля для кэша"""
+    update_data = {
+        'approved': True,
+        'joke_id': joke_id,
+        'approved_at': approved_at
+    }
+    updates = {f'jokes/{joke_key}/{field}': value for field, value in update_data.items()}
+    updates[f'joke_hashes/{joke_text_digest(joke.get("text"))}'] = joke_key
+    updates[f'user_jokes/{joke.get("user_id")}/{joke_key}'] = True
+    updates[f'approved_by_id/{joke_id}'] = joke_key
+    updates[f'moderation_queue/{joke_key}'] = None
+    updates[f'moderation_leases/{joke_key}'] = None
+    return updates, update_data
+
+def _deletion_updates(joke_key, joke, removed_keys=()):
+    """Multi-path записи для удаления анекдота вместе с индексами; removed_keys удаляются тем же пакетом"""
+    updates = {f'jokes/{joke_key}': None}
+    if joke:
+        digest = joke_text_digest(joke.get('text'))
+        # Если остался анекдот с тем же текстом, хеш переводится на него
+        others = joke_corpus.keys_by_digest(digest) - {joke_key} - set(removed_keys)
+        updates[f'joke_hashes/{digest}'] = min(others) if others else None
+        updates[f'user_jokes/{joke.get("user_id")}/{joke_key}'] = None
+        if joke.get('joke_id') is not None:
+            updates[f'approved_by_id/{joke["joke_id"]}'] = None
+    updates[f'moderation_queue/{joke_key}'] = None
+    updates[f'moderation_leases/{joke_key}'] = None
+    return updates
+
 async def approve_joke(root_ref, joke_key):
     """Одобряет анекдот и назначает ему ID"""
     try:
+        joke = await find_joke_by_key(root_ref, joke_key)
+        if not joke:
+            return False
+        if joke.get('approved', False):
+            return True
+
         # Получаем следующий ID для одобренных анекдотов
         joke_id = await get_next_approved_id(root_ref)
         if joke_id is None:
             return False
-            
-        jokes_ref = root_ref.child('jokes')
-        update_data = {
-            'approved': True,
-            'joke_id': joke_id,
-            'approved_at': datetime.now().isoformat()
-        }
-        jokes_ref.child(joke_key).update(update_data)
+
+        updates, update_data = _approval_updates(joke_key, joke, joke_id, datetime.now().isoformat())
+        await root_ref.update_async(updates)
+        joke_corpus.update_joke(joke_key, update_data)
+        await adjust_pending_count(root_ref, -1)
         return True
     except Exception as e:
         logger.error(f"Error approving joke: {e}")
@@ -259,9 +583,145 @@ async def approve_joke(root_ref, joke_key):
 async def delete_joke(root_ref, joke_key):
     """Удаляет анекдот"""
     try:
-        jokes_ref = root_ref.child('jokes')
-        jokes_ref.child(joke_key).delete()
+        joke = await find_joke_by_key(root_ref, joke_key)
+        await root_ref.update_async(_deletion_updates(joke_key, joke))
+        joke_corpus.remove_joke(joke_key)
+        if joke and not joke.get('approved', False):
+            await adjust_pending_count(root_ref, -1)
         return True
     except Exception as e:
         logger.error(f"Error deleting joke: {e}")
-        return False
\ No newline at end of file
+        return False
+
+async def reserve_approved_ids(root_ref, count):
+    """Резервирует непрерывный блок из count ID одной транзакцией; возвращает первый ID"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, id_allocator.allocate_block, count)
+    except Exception as e:
+        logger.error(f"Error reserving {count} approved IDs: {e}")
+        return None
+
+async def get_pending_page(root_ref, admin_id, limit):
+    """Страница анекдотов на модерации для пакетного режима.
+
+    Каждый анекдот закрепляется за администратором транзакцией, как в
+    claim_pending_joke: анекдоты, которые успел взять другой администратор,
+    на страницу не попадают.
+    """
+    try:
+        queue = await root_ref.child('moderation_queue').order_by_key().limit_to_first(
+            limit + config.MODERATION_CLAIM_CANDIDATES).get_async() or {}
+        leases = await root_ref.child('moderation_leases').get_async() or {}
+        now = time.time()
+
+        page = []
+        for key in queue:
+            lease = leases.get(key)
+            if lease and lease.get('expires_at', 0) > now and lease.get('admin_id') != admin_id:
+                continue
+            joke = await find_joke_by_key(root_ref, key)
+            if not joke or joke.get('approved', False):
+                continue
+            if not await claim_joke(root_ref, key, admin_id):
+                continue
+            page.append((key, joke))
+            if len(page) == limit:
+                break
+        return page
+    except Exception as e:
+        logger.error(f"Error getting pending page: {e}")
+        return []
+
+async def _find_jokes_by_keys(root_ref, joke_keys):
+    """Анекдоты {ключ: анекдот или None}: из кэша, а без него — параллельными чтениями"""
+    if joke_corpus.loaded:
+        return {key: joke_corpus.get(key) for key in joke_keys}
+    jokes = await asyncio.gather(*(find_joke_by_key(root_ref, key) for key in joke_keys))
+    return dict(zip(joke_keys, jokes))
+
+async def bulk_moderate(root_ref, approve_keys, reject_keys, release_keys=()):
+    """Одобряет и отклоняет анекдоты пакетно: одна транзакция на блок ID и один update().
+
+    Анекдоты, которые уже одобрил другой администратор или удалили, не трогаются
+    и возвращаются в 'skipped'.
+    """
+    try:
+        jokes = await _find_jokes_by_keys(root_ref, list(approve_keys) + list(reject_keys))
+        pending = {key: joke for key, joke in jokes.items() if joke and not joke.get('approved', False)}
+        to_approve = [(key, pending[key]) for key in approve_keys if key in pending]
+        to_reject = [(key, pending[key]) for key in reject_keys if key in pending]
+        skipped = [key for key in jokes if key not in pending]
+
+        updates = {}
+        approved = []
+        cache_updates = []
+        if to_approve:
+            first_id = await reserve_approved_ids(root_ref, len(to_approve))
+            if first_id is None:
+                return None
+            approved_at = datetime.now().isoformat()
+            for offset, (key, joke) in enumerate(to_approve):
+                joke_updates, update_data = _approval_updates(key, joke, first_id + offset, approved_at)
+                updates.update(joke_updates)
+                cache_updates.append((key, update_data))
+                approved.append((key, first_id + offset))
+        rejected_keys = [key for key, _ in to_reject]
+        for key, joke in to_reject:
+            updates.update(_deletion_updates(key, joke, rejected_keys))
+        # Пропущенные анекдоты сразу возвращаются в очередь
+        for key in release_keys:
+            updates[f'moderation_leases/{key}'] = None
+
+        if not updates:
+            return {'approved': [], 'rejected': 0, 'skipped': skipped}
+        await root_ref.update_async(updates)
+
+        for key, update_data in cache_updates:
+            joke_corpus.update_joke(key, update_data)
+        for key, _ in to_reject:
+            joke_corpus.remove_joke(key)
+
+        pending_removed = len(to_approve) + len(to_reject)
+        if pending_removed:
+            await adjust_pending_count(root_ref, -pending_removed)
+        return {'approved': approved, 'rejected': len(to_reject), 'skipped': skipped}
+    except Exception as e:
+        logger.error(f"Error in bulk moderation: {e}")
+        return None
+
+def _created_at_ms(joke):
+    try:
+        return int(datetime.fromisoformat(joke['created_at']).timestamp() * 1000)
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+async def rebuild_joke_indexes(root_ref):
+    """Полностью перестраивает индексы по ветке /jokes (разовая миграция)"""
+    try:
+        jokes = await root_ref.child('jokes').get_async() or {}
+        hashes = {}
+        user_jokes = {}
+        by_id = {}
+        queue = {}
+        for key, joke in jokes.items():
+            if not isinstance(joke, dict):
+                continue
+            hashes.setdefault(joke_text_digest(joke.get('text')), key)
+            user_jokes.setdefault(str(joke.get('user_id')), {})[key] = True
+            if joke.get('approved', False) and joke.get('joke_id') is not None:
+                by_id[str(joke['joke_id'])] = key
+            elif not joke.get('approved', False):
+                queue[key] = _created_at_ms(joke)
+
+        await root_ref.child('joke_hashes').set_async(hashes)
+        await root_ref.child('user_jokes').set_async(user_jokes)
+        await root_ref.child('approved_by_id').set_async(by_id)
+        await root_ref.child('moderation_queue').set_async(queue)
+        await root_ref.child('pending_count').set_async(len(queue))
+        logger.info(f"Rebuilt joke indexes: {len(jokes)} jokes, {len(hashes)} hashes, "
+                    f"{len(user_jokes)} users, {len(by_id)} approved IDs, {len(queue)} pending")
+        return {'jokes': len(jokes), 'hashes': len(hashes), 'users': len(user_jokes),
+                'approved': len(by_id), 'pending': len(queue)}
+    except Exception as e:
+        logger.error(f"Error rebuilding joke indexes: {e}")
+        return None
\ No newline at end of file
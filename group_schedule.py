@@ -0,0 +1,88 @@
+import heapq
+import threading
+
+
+class GroupSchedule:
+    """Расписание групп: min-куча (время следующей шутки, chat_id).
+
+    Изменение или удаление группы не ищет её в куче: актуальное время хранится
+    в словаре, а устаревшие записи кучи отбрасываются при извлечении (ленивое удаление).
+    Так и обновление, и извлечение стоят O(log n).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}  # chat_id -> [due, interval]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, chat_id):
+        with self._lock:
+            return int(chat_id) in self._entries
+
+    def schedule(self, chat_id, due, interval):
+        """Ставит (или переставляет) группу на время due с интервалом interval"""
+        chat_id = int(chat_id)
+        with self._lock:
+            self._entries[chat_id] = [due, interval]
+            self._push_locked(due, chat_id)
+
+    def set_interval(self, chat_id, interval, now):
+        """Меняет интервал: следующая шутка — через новый интервал после предыдущей"""
+        chat_id = int(chat_id)
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return
+            due, old_interval = entry
+            due = max(now, due - old_interval + interval)
+            self._entries[chat_id] = [due, interval]
+            self._push_locked(due, chat_id)
+
+    def _push_locked(self, due, chat_id):
+        heapq.heappush(self._heap, (due, chat_id))
+        # Устаревших записей стало слишком много — пересобираем кучу
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry[0], cid) for cid, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, chat_id):
+        with self._lock:
+            self._entries.pop(int(chat_id), None)
+
+    def _drop_stale_locked(self):
+        while self._heap:
+            due, chat_id = self._heap[0]
+            entry = self._entries.get(chat_id)
+            if entry is not None and entry[0] == due:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """Время ближайшей группы или None, если групп нет"""
+        with self._lock:
+            self._drop_stale_locked()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Группы [(chat_id, due, interval)], которым пора отправить шутку.
+
+        Каждая сразу переставляется на следующий интервал.
+        """
+        due_groups = []
+        with self._lock:
+            while True:
+                self._drop_stale_locked()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, chat_id = heapq.heappop(self._heap)
+                interval = self._entries[chat_id][1]
+                # После простоя не наверстываем пропущенные интервалы
+                next_due = due + interval if due + interval > now else now + interval
+                self._entries[chat_id] = [next_due, interval]
+                heapq.heappush(self._heap, (next_due, chat_id))
+                due_groups.append((chat_id, due, interval))
+        return due_groups
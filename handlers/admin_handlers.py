@@ -1,59 +1,73 @@
 import logging
+import threading
+import time
 from telebot import types
 from firebase import (
     initialize_firebase,
     get_approved_jokes_count,
     get_total_jokes_count,
+    get_last_approved_id,
+    get_pruned_chats_count,
     find_joke_by_id,
-    get_unapproved_joke,
+    claim_pending_joke,
+    release_joke,
     approve_joke,
     delete_joke,
-    find_joke_by_key
+    find_joke_by_key,
+    find_similar_jokes,
+    get_pending_page,
+    rebuild_joke_indexes
 )
-from keyboards import create_admin_keyboard, create_cancel_keyboard, create_moderation_reply_keyboard
-from states import set_user_state, get_user_state, delete_user_state
-from utils import is_admin, log_message
+from keyboards import create_admin_keyboard, create_cancel_keyboard, create_moderation_reply_keyboard, create_bulk_moderation_keyboard
+from states import set_user_state, get_user_state, delete_user_state, state_store
+from utils import format_similar_jokes
 import config
 from async_utils import run_async
+from dispatch import router
+from triggers import trigger_matcher
+from last_jokes import last_joke_tracker
 
 logger = logging.getLogger(__name__)
 
+# Заранее захваченный следующий анекдот для каждого администратора:
+# admin_id -> (key, joke, время окончания аренды). Доступ только под блокировкой,
+# чтобы словарь можно было трогать не только из цикла событий
+prefetched_jokes = {}
+_prefetch_lock = threading.Lock()
+
+
+def _store_prefetched(admin_id, key, joke, lease_expires_at):
+    """Запоминает захваченный анекдот; False, если у администратора он уже есть.
+
+    Заодно выбрасывает записи с истёкшей арендой: такие анекдоты уже
+    вернулись в очередь, и отдавать их из кэша нельзя.
+    """
+    now = time.time()
+    with _prefetch_lock:
+        for stale_id in [a for a, (_, _, expires_at) in prefetched_jokes.items() if expires_at <= now]:
+            del prefetched_jokes[stale_id]
+        if admin_id in prefetched_jokes:
+            return False
+        prefetched_jokes[admin_id] = (key, joke, lease_expires_at)
+        return True
+
+
+def _pop_prefetched(admin_id):
+    with _prefetch_lock:
+        return prefetched_jokes.pop(admin_id, None)
+
 
 def setup_admin_handlers(bot):
-    @bot.message_handler(func=lambda m: m.text == '🗑 Удалить по ID' and
-                                        is_admin(m.from_user.id) and
-                                        m.chat.type == 'private')
-    def admin_delete_start(message):
-        log_message(logger, message)
-        run_async(process_admin_delete_start(bot, message))
-
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) and
-                                        get_user_state(m.from_user.id).get('state') == 'admin_deleting' and
-                                        m.chat.type == 'private')
-    def admin_delete_joke(message):
-        log_message(logger, message)
-        run_async(process_admin_delete_joke(bot, message))
-
-    @bot.message_handler(func=lambda m: m.text == '📊 Статистика' and
-                                        is_admin(m.from_user.id) and
-                                        m.chat.type == 'private')
-    def show_stats(message):
-        log_message(logger, message)
-        run_async(process_show_stats(bot, message))
-
-    @bot.message_handler(func=lambda m: m.text == '👮 Модерация' and
-                                        is_admin(m.from_user.id) and
-                                        m.chat.type == 'private')
-    def moderation_start(message):
-        log_message(logger, message)
-        run_async(process_moderation_start(bot, message))
-
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) and
-                                        get_user_state(m.from_user.id).get('state') == 'moderation' and
-                                        m.chat.type == 'private')
-    def handle_moderation_action(message):
-        log_message(logger, message)
-        run_async(process_moderation_action(bot, message))
+    router.text(['🗑 Удалить по ID'], process_admin_delete_start, admin_only=True)
+    router.state('admin_deleting', process_admin_delete_joke)
+    router.text(['📊 Статистика'], process_show_stats, admin_only=True)
+    router.command(['rebuild_indexes'], process_rebuild_indexes, admin_only=True)
+    router.command(['reload_triggers'], process_reload_triggers, admin_only=True)
+    router.text(['👮 Модерация'], process_moderation_start, admin_only=True)
+    router.text(['📦 Пакетная модерация'], process_bulk_moderation_start, admin_only=True)
+    router.state('moderation', process_moderation_action)
+    # Сессию модерации могут завершить не только кнопкой: другой сценарий, TTL, вытеснение
+    state_store.add_listener(on_user_state_end)
 
 
 # Асинхронные функции обработки
@@ -117,18 +131,39 @@ async def process_admin_delete_joke(bot, message):
         bot.reply_to(message, "⚠️ Произошла ошибка при удалении анекдота")
 
 
+def format_route_stats(stats, limit=5):
+    """Блок с самыми затратными обработчиками для статистики"""
+    stats = [item for item in stats if item['calls']][:limit]
+    if not stats:
+        return ""
+    lines = ["\n\n⏱ *Обработчики (время суммарно / в среднем):*"]
+    for item in stats:
+        lines.append(
+            f"• `{item['name']}`: {item['calls']} вызовов, "
+            f"{item['total_time']:.1f} с / {item['avg_time'] * 1000:.0f} мс"
+            + (f", ошибок: {item['errors']}" if item['errors'] else "")
+        )
+    return "\n".join(lines)
+
+
 async def process_show_stats(bot, message):
     try:
         root_ref = initialize_firebase()
         approved_count = await get_approved_jokes_count(root_ref)
         total_count = await get_total_jokes_count(root_ref)
-        last_id = root_ref.child('approved_counter').get() or 0
+        last_id = await get_last_approved_id(root_ref)
+        pruned_count = await get_pruned_chats_count(root_ref)
 
         bot.send_message(
             message.chat.id,
             f"📈 *Статистика бота:*\n\n"
             f"• Одобрено анекдотов: *{approved_count}*\n"
-            f"• Последний ID одобренного: *{last_id}*",
+            f"• Последний ID одобренного: *{last_id}*\n"
+            f"• Отписано недоступных чатов: *{pruned_count}*\n"
+            f"• Незавершённых диалогов: *{len(state_store)}* (~{state_store.memory_usage() // 1024} КБ)\n"
+            f"• Чатов с последним анекдотом: *{len(last_joke_tracker)}* "
+            f"({last_joke_tracker.memory_usage() // 1024} КБ)"
+            f"{format_route_stats(router.stats())}",
             parse_mode='Markdown'
         )
     except Exception as e:
@@ -136,13 +171,55 @@ async def process_show_stats(bot, message):
         bot.reply_to(message, "⚠️ Ошибка при получении статистики")
 
 
+async def process_rebuild_indexes(bot, message):
+    try:
+        root_ref = initialize_firebase()
+        bot.send_message(message.chat.id, "⏳ Перестраиваю индексы анекдотов...")
+        result = await rebuild_joke_indexes(root_ref)
+        if result is None:
+            bot.send_message(message.chat.id, "❌ Ошибка при перестроении индексов")
+            return
+
+        bot.send_message(
+            message.chat.id,
+            f"✅ Индексы перестроены\n\n"
+            f"• Анекдотов: *{result['jokes']}*\n"
+            f"• Хешей текстов: *{result['hashes']}*\n"
+            f"• Авторов: *{result['users']}*\n"
+            f"• Одобренных ID: *{result['approved']}*\n"
+            f"• На модерации: *{result['pending']}*",
+            parse_mode='Markdown',
+            reply_markup=create_admin_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Error in rebuild_indexes: {e}")
+        bot.reply_to(message, "⚠️ Ошибка при перестроении индексов")
+
+
+async def process_reload_triggers(bot, message):
+    try:
+        words = trigger_matcher.reload()
+        bot.send_message(
+            message.chat.id,
+            f"✅ Триггеры перезагружены ({len(words)}):\n" + "\n".join(f"• {word}" for word in words)
+        )
+    except Exception as e:
+        logger.error(f"Error in reload_triggers: {e}")
+        bot.reply_to(message, "⚠️ Ошибка при перезагрузке триггеров")
+
+
 async def process_moderation_start(bot, message):
     try:
         user_id = message.from_user.id
         root_ref = initialize_firebase()
 
-        # Получаем первый неодобренный анекдот
-        key, joke = await get_unapproved_joke(root_ref)
+        # Повторный старт заменяет сессию того же типа — её аренды снимаем сами
+        previous = get_user_state(user_id)
+        if previous and previous.get('state') == 'moderation':
+            await release_moderation_session(root_ref, user_id, previous)
+
+        # Захватываем первый свободный анекдот (другие администраторы получат другие)
+        key, joke = await claim_pending_joke(root_ref, user_id)
 
         if not joke:
             bot.send_message(
@@ -156,18 +233,24 @@ async def process_moderation_start(bot, message):
         set_user_state(user_id, {
             'state': 'moderation',
             'current_joke_key': key,
-            'joke_id': joke.get('joke_id', 'N/A')
+            'joke_id': joke.get('joke_id', 'N/A'),
+            'skipped': []
         })
 
-        # Отправляем анекдот на модерацию
+        # Отправляем анекдот на модерацию вместе с похожими из базы
+        similar = await find_similar_jokes(root_ref, joke['text'], exclude_key=key)
         bot.send_message(
             message.chat.id,
             f"📜 *Новый анекдот на модерации (ID будет назначен после одобрения):*\n\n"
-            f"{joke['text']}\n\n"
+            f"{joke['text']}"
+            f"{format_similar_jokes(similar)}\n\n"
             f"Выберите действие:",
             parse_mode='Markdown',
             reply_markup=create_moderation_reply_keyboard()
         )
+
+        # Пока администратор читает, захватываем следующий анекдот
+        run_async(prefetch_moderation_joke(root_ref, user_id, [key]))
     except Exception as e:
         logger.error(f"Error in moderation_start: {e}")
         bot.reply_to(message, "⚠️ Произошла ошибка при запуске модерации")
@@ -189,6 +272,7 @@ async def process_moderation_action(bot, message):
         action = message.text
         root_ref = initialize_firebase()
         joke_key = user_state['current_joke_key']
+        skipped = list(user_state.get('skipped', []))
 
         if action == "✅ Одобрить":
             if await approve_joke(root_ref, joke_key):
@@ -204,9 +288,13 @@ async def process_moderation_action(bot, message):
                 response = "❌ Ошибка при удалении анекдота"
 
         elif action == "➡️ Следующий":
+            # Пропущенный анекдот сразу возвращается в очередь для других администраторов
+            skipped.append(joke_key)
+            await release_joke(root_ref, joke_key, user_id)
             response = f"➡️ Переходим к следующему анекдоту"
 
         elif action == "🚫 Завершить":
+            # Аренды текущего и заранее захваченного анекдотов снимет on_user_state_end
             delete_user_state(user_id)
             bot.send_message(
                 message.chat.id,
@@ -218,26 +306,30 @@ async def process_moderation_action(bot, message):
             bot.reply_to(message, "❌ Неизвестное действие, используйте кнопки")
             return
 
-        # Получаем следующий анекдот для модерации
-        next_key, next_joke = await get_unapproved_joke(root_ref)
+        # Берём заранее захваченный анекдот или захватываем следующий
+        next_key, next_joke = await take_moderation_joke(root_ref, user_id, skipped + [joke_key])
 
         if next_joke:
             # Обновляем состояние для следующего анекдота
             set_user_state(user_id, {
                 'state': 'moderation',
                 'current_joke_key': next_key,
-                'joke_id': next_joke.get('joke_id', 'N/A')
+                'joke_id': next_joke.get('joke_id', 'N/A'),
+                'skipped': skipped
             })
 
             # Отправляем результат действия и следующий анекдот
+            similar = await find_similar_jokes(root_ref, next_joke['text'], exclude_key=next_key)
             bot.send_message(
                 message.chat.id,
                 f"{response}\n\n"
                 f"📜 *Следующий анекдот на модерации:*\n\n"
-                f"{next_joke['text']}",
+                f"{next_joke['text']}"
+                f"{format_similar_jokes(similar)}",
                 parse_mode='Markdown',
                 reply_markup=create_moderation_reply_keyboard()
             )
+            run_async(prefetch_moderation_joke(root_ref, user_id, skipped + [joke_key, next_key]))
         else:
             # Нет больше анекдотов для модерации
             delete_user_state(user_id)
@@ -253,4 +345,97 @@ async def process_moderation_action(bot, message):
             message.chat.id,
             "⚠️ Произошла ошибка при обработке действия",
             reply_markup=create_admin_keyboard()
-        )
\ No newline at end of file
+        )
+
+
+async def process_bulk_moderation_start(bot, message):
+    try:
+        user_id = message.from_user.id
+        root_ref = initialize_firebase()
+
+        page = await get_pending_page(root_ref, user_id, config.BULK_MODERATION_PAGE_SIZE)
+        if not page:
+            bot.send_message(
+                message.chat.id,
+                "🎉 Все анекдоты прошли модерацию! Нет новых для проверки.",
+                reply_markup=create_admin_keyboard()
+            )
+            return
+
+        decisions = ['skip'] * len(page)
+        # В состоянии храним только ключи и отметки, без текстов
+        set_user_state(user_id, {
+            'state': 'bulk_moderation',
+            'keys': [key for key, _ in page],
+            'decisions': decisions
+        })
+
+        lines = ["📦 Пакетная модерация", "Отметьте анекдоты кнопками и нажмите «Применить»:", ""]
+        for i, (_, joke) in enumerate(page, 1):
+            text = joke.get('text', '')
+            preview = text[:150] + '...' if len(text) > 150 else text
+            lines.append(f"{i}. {preview}\n")
+        bot.send_message(
+            message.chat.id,
+            "\n".join(lines),
+            reply_markup=create_bulk_moderation_keyboard(decisions)
+        )
+    except Exception as e:
+        logger.error(f"Error in bulk_moderation_start: {e}")
+        bot.reply_to(message, "⚠️ Произошла ошибка при запуске пакетной модерации")
+
+
+async def prefetch_moderation_joke(root_ref, admin_id, exclude_keys):
+    """Захватывает следующий анекдот заранее, чтобы «➡️ Следующий» отвечал сразу"""
+    try:
+        with _prefetch_lock:
+            if admin_id in prefetched_jokes:
+                return
+        lease_expires_at = time.time() + config.MODERATION_LEASE_SECONDS
+        key, joke = await claim_pending_joke(root_ref, admin_id, exclude_keys)
+        if not joke:
+            return
+        user_state = get_user_state(admin_id)
+        if not user_state or user_state.get('state') != 'moderation':
+            # Сессия закончилась, пока шёл захват
+            await release_joke(root_ref, key, admin_id)
+            return
+        if not _store_prefetched(admin_id, key, joke, lease_expires_at):
+            # Параллельный prefetch успел первым — лишний анекдот возвращаем в очередь
+            await release_joke(root_ref, key, admin_id)
+    except Exception as e:
+        logger.error(f"Error prefetching moderation joke: {e}")
+
+
+async def take_moderation_joke(root_ref, admin_id, exclude_keys):
+    """Следующий анекдот для модерации: заранее захваченный, если аренда ещё не истекла.
+
+    Аренду только что взяли сами, поэтому в базе её не перепроверяем.
+    """
+    prefetched = _pop_prefetched(admin_id)
+    if prefetched:
+        key, _, lease_expires_at = prefetched
+        if key not in exclude_keys and time.time() < lease_expires_at:
+            current = await find_joke_by_key(root_ref, key)
+            if current and not current.get('approved', False):
+                return key, current
+        else:
+            await release_joke(root_ref, key, admin_id)
+    return await claim_pending_joke(root_ref, admin_id, exclude_keys)
+
+
+async def release_moderation_session(root_ref, admin_id, user_state):
+    """Снимает аренды текущего и заранее захваченного анекдотов сессии модерации"""
+    keys = [user_state.get('current_joke_key')]
+    prefetched = _pop_prefetched(admin_id)
+    if prefetched:
+        keys.append(prefetched[0])
+    for key in keys:
+        if key:
+            await release_joke(root_ref, key, admin_id)
+
+
+def on_user_state_end(user_id, user_state):
+    """Сессия модерации закончилась — аренды её анекдотов возвращаются в очередь"""
+    if user_state.get('state') == 'moderation':
+        run_async(release_moderation_session(initialize_firebase(), user_id, user_state))
\ No newline at end of file
@@ -1,27 +1,24 @@
 import logging
 from telebot import types
-from firebase import approve_joke, delete_joke, find_joke_by_key, initialize_firebase
-from keyboards import create_admin_keyboard, create_moderation_reply_keyboard
+from firebase import approve_joke, delete_joke, find_joke_by_key, find_similar_jokes, initialize_firebase, claim_joke, bulk_moderate
+from keyboards import create_admin_keyboard, create_moderation_reply_keyboard, create_bulk_moderation_keyboard
 from states import get_user_state, set_user_state, delete_user_state
-from utils import log_message
-from async_utils import run_async
+from utils import log_message, format_similar_jokes
+from dispatch import router
 import config
 
 logger = logging.getLogger(__name__)
 
 def setup_callback_handlers(bot):
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('delete:'))
-    def handle_joke_delete(call):
-        run_async(process_joke_delete(bot, call))
-        
-    @bot.callback_query_handler(func=lambda call: call.data in ['approve', 'reject', 'skip', 'cancel_mod'])
-    def handle_moderation_actions(call):
-        # Этот обработчик теперь не нужен, но оставим для совместимости
-        bot.answer_callback_query(call.id, "⚠️ Действие устарело, используйте новую модерацию")
-        
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('moderate:'))
-    def handle_moderate_callback(call):
-        run_async(process_moderate_callback(bot, call))
+    router.callback_prefix('delete', process_joke_delete)
+    router.callback(['approve', 'reject', 'skip', 'cancel_mod'], handle_moderation_actions)
+    router.callback_prefix('moderate', process_moderate_callback)
+    router.callback_prefix('bulk', process_bulk_moderation_callback)
+
+
+def handle_moderation_actions(bot, call):
+    # Этот обработчик теперь не нужен, но оставим для совместимости
+    bot.answer_callback_query(call.id, "⚠️ Действие устарело, используйте новую модерацию")
 
 # Асинхронные функции обработки
 async def process_joke_delete(bot, call):
@@ -30,23 +27,19 @@ async def process_joke_delete(bot, call):
         joke_key = call.data.split(':')[1]
         
         user_state = get_user_state(user_id)
-        if not user_state or 'jokes' not in user_state:
+        if not user_state or user_state.get('state') != 'deleting_joke':
             bot.answer_callback_query(call.id, "❌ Сессия устарела")
             return
         
-        if joke_key not in user_state['jokes']:
+        if joke_key not in user_state['keys']:
             bot.answer_callback_query(call.id, "❌ Анекдот не найден")
             return
         
         root_ref = initialize_firebase()
-        try:
-            jokes_ref = root_ref.child('jokes')
-            jokes_ref.child(joke_key).delete()
-            logger.info(f"User {user_id} deleted joke {joke_key}")
-        except Exception as e:
-            logger.error(f"Error deleting joke: {e}")
+        if not await delete_joke(root_ref, joke_key):
             bot.answer_callback_query(call.id, "❌ Ошибка при удалении")
             return
+        logger.info(f"User {user_id} deleted joke {joke_key}")
         
         delete_user_state(user_id)
         
@@ -71,22 +64,29 @@ async def process_moderate_callback(bot, call):
         root_ref = initialize_firebase()
         joke = await find_joke_by_key(root_ref, joke_key)
         
-        if not joke:
+        if not joke or joke.get('approved', False):
             bot.answer_callback_query(call.id, "❌ Анекдот не найден или уже промодерирован")
             return
         
+        if not await claim_joke(root_ref, joke_key, user_id):
+            bot.answer_callback_query(call.id, "👮 Этот анекдот уже модерирует другой администратор")
+            return
+        
         # Сохраняем состояние модерации
         set_user_state(user_id, {
             'state': 'moderation',
             'current_joke_key': joke_key,
-            'joke_id': joke.get('joke_id', 'N/A')
+            'joke_id': joke.get('joke_id', 'N/A'),
+            'skipped': []
         })
         
-        # Редактируем сообщение с уведомлением
+        # Редактируем сообщение с уведомлением, показывая похожие анекдоты из базы
+        similar = await find_similar_jokes(root_ref, joke['text'], exclude_key=joke_key)
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            text=f"📜 *Анекдот на модерации (ID будет назначен после одобрения):*\n\n{joke['text']}",
+            text=f"📜 *Анекдот на модерации (ID будет назначен после одобрения):*\n\n{joke['text']}"
+                 f"{format_similar_jokes(similar)}",
             parse_mode='Markdown',
             reply_markup=None  # Убираем inline-кнопки
         )
@@ -101,4 +101,73 @@ async def process_moderate_callback(bot, call):
         bot.answer_callback_query(call.id)
     except Exception as e:
         logger.error(f"Error in process_moderate_callback: {e}")
+        bot.answer_callback_query(call.id, "⚠️ Произошла ошибка")
+
+# Порядок переключения отметки в пакетной модерации
+BULK_DECISION_CYCLE = {'skip': 'approve', 'approve': 'reject', 'reject': 'skip'}
+
+async def process_bulk_moderation_callback(bot, call):
+    try:
+        user_id = call.from_user.id
+        if user_id not in config.ADMIN_IDS:
+            bot.answer_callback_query(call.id, "❌ Только администраторы могут модерировать анекдоты")
+            return
+
+        user_state = get_user_state(user_id)
+        if not user_state or user_state.get('state') != 'bulk_moderation':
+            bot.answer_callback_query(call.id, "❌ Сессия устарела")
+            return
+
+        parts = call.data.split(':')
+        action = parts[1]
+        keys = user_state['keys']
+        decisions = list(user_state['decisions'])
+
+        if action in ('toggle', 'all'):
+            if action == 'toggle':
+                index = int(parts[2])
+                decisions[index] = BULK_DECISION_CYCLE[decisions[index]]
+            else:
+                decisions = [parts[2]] * len(keys)
+            set_user_state(user_id, dict(user_state, decisions=decisions))
+            bot.edit_message_reply_markup(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=create_bulk_moderation_keyboard(decisions)
+            )
+            bot.answer_callback_query(call.id)
+            return
+
+        root_ref = initialize_firebase()
+
+        if action == 'cancel':
+            await bulk_moderate(root_ref, [], [], release_keys=keys)
+            text = "🚫 Пакетная модерация отменена"
+        else:
+            approve_keys = [k for k, d in zip(keys, decisions) if d == 'approve']
+            reject_keys = [k for k, d in zip(keys, decisions) if d == 'reject']
+            skip_keys = [k for k, d in zip(keys, decisions) if d == 'skip']
+            result = await bulk_moderate(root_ref, approve_keys, reject_keys, release_keys=skip_keys)
+            if result is None:
+                # Состояние и блокировки остаются: решения можно применить ещё раз
+                bot.answer_callback_query(call.id, "❌ Ошибка при применении решений, попробуйте ещё раз")
+                return
+            ids = ', '.join(f"#{joke_id}" for _, joke_id in result['approved'])
+            text = (
+                f"✅ Одобрено: {len(result['approved'])}" + (f" ({ids})" if ids else "") + "\n"
+                f"❌ Отклонено: {result['rejected']}\n"
+                f"⏸ Пропущено: {len(skip_keys)}"
+            )
+            if result['skipped']:
+                text += f"\n⚠️ Уже промодерированы или удалены: {len(result['skipped'])}"
+        delete_user_state(user_id)
+
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text
+        )
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.error(f"Error in process_bulk_moderation_callback: {e}")
         bot.answer_callback_query(call.id, "⚠️ Произошла ошибка")
\ No newline at end of file
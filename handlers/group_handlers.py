@@ -2,12 +2,18 @@ import logging
 import re
 from telebot import types
 import config
-from firebase import initialize_firebase, get_random_joke, subscribe_group, unsubscribe_group
-from utils import log_message, is_group_admin, last_joke_cache
+from firebase import initialize_firebase, get_joke_for_chat, subscribe_group, unsubscribe_group, set_group_interval
+from utils import log_message, is_group_admin
 from async_utils import run_async
+from dispatch import router, GROUP
+from triggers import trigger_matcher
+from telegram_cache import telegram_cache
 
 logger = logging.getLogger(__name__)
 
+_INTERVAL_UNITS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+_INTERVAL_PATTERN = re.compile(r'^(\d+)\s*([mhd]?)$')
+
 
 def setup_group_handlers(bot):
     # Регистрируем команды для бота (чтобы показывались в подсказках при вводе /)
@@ -15,37 +21,33 @@ def setup_group_handlers(bot):
         types.BotCommand("joke", "Получить случайный анекдот"),
         types.BotCommand("subscribe_group", "Подписать группу на анекдоты"),
         types.BotCommand("unsubscribe_group", "Отписать группу от анекдотов"),
+        types.BotCommand("set_interval", "Частота анекдотов: /set_interval 6h"),
         types.BotCommand("help", "Показать помощь по командам")
     ], scope=types.BotCommandScopeAllGroupChats())
 
-    # Обработчик для команд в группах
-    @bot.message_handler(commands=['joke', 'subscribe_group', 'unsubscribe_group', 'help', 'start'],
-                         chat_types=['group', 'supergroup'])
-    def handle_group_commands(message):
-        log_message(logger, message)
-        command = message.text.split()[0].lower()
-        bot_username = bot.get_me().username.lower()
-
-        # Проверка команды с упоминанием бота
-        if command == '/joke' or command == f'/joke@{bot_username}':
-            run_async(process_manual_joke_request(bot, message))
-        elif command == '/subscribe_group' or command == f'/subscribe_group@{bot_username}':
-            run_async(process_subscribe_group(bot, message))
-        elif command == '/unsubscribe_group' or command == f'/unsubscribe_group@{bot_username}':
-            run_async(process_unsubscribe_group(bot, message))
-        elif command == '/help' or command == f'/help@{bot_username}' or \
-                command == '/start' or command == f'/start@{bot_username}':
-            run_async(process_send_group_help(bot, message))
-
-    # Обработчик для сообщений в группах (триггер по ключевым словам)
-    @bot.message_handler(
-        func=lambda m: m.chat.type in ['group', 'supergroup'] and
-                       any(word in (m.text or '').lower() for word in config.GROUP_TRIGGER_WORDS) and
-                       not m.text.startswith('/')  # Игнорируем команды
-    )
-    def group_trigger(message):
-        log_message(logger, message)
-        run_async(process_group_trigger(bot, message))
+    router.command(['joke'], process_manual_joke_request, chat_types=(GROUP,))
+    router.command(['subscribe_group'], process_subscribe_group, chat_types=(GROUP,))
+    router.command(['unsubscribe_group'], process_unsubscribe_group, chat_types=(GROUP,))
+    router.command(['set_interval'], process_set_group_interval, chat_types=(GROUP,))
+    router.fallback(GROUP, handle_group_message)
+
+    # Смена администраторов сбрасывает их кешированный список
+    @bot.chat_member_handler()
+    def chat_member_updated(update):
+        telegram_cache.on_chat_member_updated(update)
+
+    @bot.my_chat_member_handler()
+    def my_chat_member_updated(update):
+        telegram_cache.on_chat_member_updated(update)
+
+
+def handle_group_message(bot, message):
+    """Сообщения в группах без команды: ответ на ключевые слова"""
+    text = message.text or ''
+    if text.startswith('/') or not trigger_matcher.matches(text):
+        return
+    log_message(logger, message)
+    run_async(process_group_trigger(bot, message))
 
 
 # Асинхронные функции обработки
@@ -54,19 +56,13 @@ async def process_group_trigger(bot, message):
         chat_id = message.chat.id
         root_ref = initialize_firebase()
 
-        # Получаем ID последней шутки для этой группы
-        last_joke_id = last_joke_cache.get(chat_id)
-
-        # Получаем случайную шутку, исключая последнюю
-        joke = await get_random_joke(root_ref, exclude_joke_id=last_joke_id)
+        # Получаем следующую шутку для этой группы без повторов
+        joke = await get_joke_for_chat(root_ref, chat_id)
 
         if not joke:
             bot.reply_to(message, "😢 В базе пока нет анекдотов!")
             return
 
-        # Обновляем кэш
-        last_joke_cache[chat_id] = joke['joke_id']
-
         bot.reply_to(
             message,
             f"📜 *Анекдот #{joke['joke_id']}*\n\n{joke['text']}",
@@ -82,19 +78,13 @@ async def process_manual_joke_request(bot, message):
         chat_id = message.chat.id
         root_ref = initialize_firebase()
 
-        # Получаем ID последней шутки для этой группы
-        last_joke_id = last_joke_cache.get(chat_id)
-
-        # Получаем случайную шутку, исключая последнюю
-        joke = await get_random_joke(root_ref, exclude_joke_id=last_joke_id)
+        # Получаем следующую шутку для этой группы без повторов
+        joke = await get_joke_for_chat(root_ref, chat_id)
 
         if not joke:
             bot.reply_to(message, "😢 В базе пока нет анекдотов!")
             return
 
-        # Обновляем кэш
-        last_joke_cache[chat_id] = joke['joke_id']
-
         bot.reply_to(
             message,
             f"📜 *Анекдот #{joke['joke_id']}*\n\n{joke['text']}",
@@ -107,7 +97,7 @@ async def process_manual_joke_request(bot, message):
 
 async def process_subscribe_group(bot, message):
     try:
-        if not is_group_admin(bot, message.chat, message.from_user.id):
+        if not await is_group_admin(bot, message.chat, message.from_user.id):
             bot.reply_to(message, "❌ Только администраторы группы могут подписывать на анекдоты.")
             return
 
@@ -129,7 +119,7 @@ async def process_subscribe_group(bot, message):
 
 async def process_unsubscribe_group(bot, message):
     try:
-        if not is_group_admin(bot, message.chat, message.from_user.id):
+        if not await is_group_admin(bot, message.chat, message.from_user.id):
             bot.reply_to(message, "❌ Только администраторы группы могут отписывать от анекдотов.")
             return
 
@@ -148,24 +138,45 @@ async def process_unsubscribe_group(bot, message):
         bot.reply_to(message, "⚠️ Произошла ошибка при отписке группы")
 
 
-async def process_send_group_help(bot, message):
+def parse_interval(text):
+    """'90m', '6h', '1d' или число часов → секунды; None, если не разобрать"""
+    match = _INTERVAL_PATTERN.match(text.strip().lower())
+    if not match:
+        return None
+    value, unit = int(match.group(1)), match.group(2) or 'h'
+    return value * _INTERVAL_UNITS[unit]
+
+
+def format_interval(seconds):
+    if seconds % _INTERVAL_UNITS['d'] == 0:
+        return f"{seconds // _INTERVAL_UNITS['d']} дн."
+    if seconds % _INTERVAL_UNITS['h'] == 0:
+        return f"{seconds // _INTERVAL_UNITS['h']} ч."
+    return f"{seconds // _INTERVAL_UNITS['m']} мин."
+
+
+async def process_set_group_interval(bot, message):
     try:
-        text = (
-            "🤖 *Помощь для групп*\n\n"
-            "Используйте следующие команды:\n\n"
-            "*/joke* - получить случайный анекдот\n"
-            "*/subscribe_group* - подписать группу на регулярные анекдоты\n"
-            "*/unsubscribe_group* - отписать группу от регулярных анекдотов\n"
-            "*/help* - показать это сообщение\n\n"
-            "Администраторы группы также могут использовать команды:\n"
-            "*/subscribe_group* и */unsubscribe_group* для управления подпиской.\n\n"
-            "Чтобы увидеть все команды, введите / в поле сообщения."
-        )
-        bot.send_message(
-            message.chat.id,
-            text,
-            parse_mode='Markdown'
-        )
+        if not await is_group_admin(bot, message.chat, message.from_user.id):
+            bot.reply_to(message, "❌ Только администраторы группы могут менять частоту анекдотов.")
+            return
+
+        parts = message.text.split(maxsplit=1)
+        interval = parse_interval(parts[1]) if len(parts) > 1 else None
+        if interval is None or not config.GROUP_MIN_INTERVAL <= interval <= config.GROUP_MAX_INTERVAL:
+            bot.reply_to(
+                message,
+                "ℹ️ Укажите интервал, например: /set_interval 6h, /set_interval 90m или /set_interval 1d\n"
+                f"Допустимо от {format_interval(config.GROUP_MIN_INTERVAL)} "
+                f"до {format_interval(config.GROUP_MAX_INTERVAL)}"
+            )
+            return
+
+        root_ref = initialize_firebase()
+        if await set_group_interval(root_ref, message.chat.id, interval):
+            bot.reply_to(message, f"⏱ Теперь анекдоты будут приходить раз в {format_interval(interval)}")
+        else:
+            bot.reply_to(message, "⚠️ Не удалось изменить частоту. Убедитесь, что группа подписана (/subscribe_group).")
     except Exception as e:
-        logger.error(f"Error in send_group_help: {e}")
-        bot.reply_to(message, "⚠️ Произошла ошибка при отправке помощи")
\ No newline at end of file
+        logger.error(f"Error in set_group_interval: {e}")
+        bot.reply_to(message, "⚠️ Произошла ошибка при изменении частоты")
@@ -4,6 +4,7 @@ from .admin_handlers import setup_admin_handlers
 from .callback_handlers import setup_callback_handlers
 from .group_handlers import setup_group_handlers
 from .error_handlers import setup_error_handlers
+from dispatch import router
 
 def setup_all_handlers(bot):
     setup_common_handlers(bot)
@@ -11,4 +12,6 @@ def setup_all_handlers(bot):
     setup_admin_handlers(bot)
     setup_callback_handlers(bot)
     setup_group_handlers(bot)
-    setup_error_handlers(bot)
\ No newline at end of file
+    setup_error_handlers(bot)
+    # Таблица маршрутов собрана — регистрируем в telebot единственные обработчики
+    router.install(bot)
\ No newline at end of file
@@ -2,62 +2,32 @@ import logging
 from telebot import types
 import config
 from keyboards import create_main_keyboard, create_cancel_keyboard, create_admin_keyboard
-from states import set_user_state, get_user_state, delete_user_state
-from utils import log_message, is_admin, last_joke_cache
-from async_utils import run_async
-from firebase import initialize_firebase, add_joke, get_user_jokes, get_random_joke, get_unapproved_count, subscribe_user, unsubscribe_user
+from states import set_user_state, delete_user_state
+from utils import format_similar_jokes
+from dispatch import router
+from firebase import initialize_firebase, add_joke, find_duplicate_joke, find_similar_jokes, get_user_jokes, get_joke_for_chat, get_unapproved_count, subscribe_user, unsubscribe_user
 
 logger = logging.getLogger(__name__)
 
 def setup_user_handlers(bot):
-    @bot.message_handler(func=lambda m: m.text == '🎲 Случайная шутка' and m.chat.type == 'private')
-    def random_joke(message):
-        log_message(logger, message)
-        run_async(process_random_joke(bot, message))
+    router.text(['🎲 Случайная шутка'], process_random_joke)
+    router.text(['➕ Добавить шутку'], process_add_joke_start)
+    router.state('adding_joke', process_add_joke_text)
+    router.text(['📜 Мои шутки'], process_show_user_jokes)
+    router.text(['❌ Удалить шутку'], process_delete_joke_start)
+    router.text(['🔔 Подписаться'], process_subscribe)
+    router.text(['🔕 Отписаться'], process_unsubscribe)
+    router.text(['🛠 Админ-панель'], admin_panel, admin_only=True)
 
-    @bot.message_handler(func=lambda m: m.text == '➕ Добавить шутку' and m.chat.type == 'private')
-    def add_joke_start(message):
-        log_message(logger, message)
-        run_async(process_add_joke_start(bot, message))
 
-    @bot.message_handler(func=lambda m: get_user_state(m.from_user.id) and 
-                                        get_user_state(m.from_user.id).get('state') == 'adding_joke' and 
-                                        m.chat.type == 'private')
-    def add_joke_text(message):
-        log_message(logger, message)
-        run_async(process_add_joke_text(bot, message))
+def admin_panel(bot, message):
+    bot.send_message(
+        message.chat.id,
+        "⚙️ *Панель администратора*",
+        parse_mode='Markdown',
+        reply_markup=create_admin_keyboard()
+    )
 
-    @bot.message_handler(func=lambda m: m.text == '📜 Мои шутки' and m.chat.type == 'private')
-    def show_user_jokes(message):
-        log_message(logger, message)
-        run_async(process_show_user_jokes(bot, message))
-
-    @bot.message_handler(func=lambda m: m.text == '❌ Удалить шутку' and m.chat.type == 'private')
-    def delete_joke_start(message):
-        log_message(logger, message)
-        run_async(process_delete_joke_start(bot, message))
-    
-    @bot.message_handler(func=lambda m: m.text == '🔔 Подписаться' and m.chat.type == 'private')
-    def subscribe_random_jokes(message):
-        log_message(logger, message)
-        run_async(process_subscribe(bot, message))
-
-    @bot.message_handler(func=lambda m: m.text == '🔕 Отписаться' and m.chat.type == 'private')
-    def unsubscribe_random_jokes(message):
-        log_message(logger, message)
-        run_async(process_unsubscribe(bot, message))
-
-    @bot.message_handler(func=lambda m: m.text == '🛠 Админ-панель' and 
-                                        is_admin(m.from_user.id) and 
-                                        m.chat.type == 'private')
-    def admin_panel(message):
-        log_message(logger, message)
-        bot.send_message(
-            message.chat.id,
-            "⚙️ *Панель администратора*",
-            parse_mode='Markdown',
-            reply_markup=create_admin_keyboard()
-        )
 
 # Асинхронные функции обработки
 async def process_random_joke(bot, message):
@@ -65,19 +35,13 @@ async def process_random_joke(bot, message):
         chat_id = message.chat.id
         root_ref = initialize_firebase()
         
-        # Получаем ID последней шутки для этого чата
-        last_joke_id = last_joke_cache.get(chat_id)
-        
-        # Получаем случайную шутку, исключая последнюю (если есть)
-        joke = await get_random_joke(root_ref, exclude_joke_id=last_joke_id)
+        # Получаем следующую шутку для этого чата без повторов
+        joke = await get_joke_for_chat(root_ref, chat_id)
         
         if not joke:
             bot.reply_to(message, "😢 В базе пока нет анекдотов!")
             return
         
-        # Обновляем кэш последней шутки для этого чата
-        last_joke_cache[chat_id] = joke['joke_id']
-        
         bot.send_message(
             message.chat.id,
             f"📜 *Анекдот #{joke['joke_id']}*\n\n{joke['text']}",
@@ -121,23 +85,14 @@ async def process_add_joke_text(bot, message):
             )
             return
         
-        # Проверка на существующий анекдот
+        # Проверка на существующий анекдот по индексу хешей нормализованного текста
         root_ref = initialize_firebase()
-        jokes_ref = root_ref.child('jokes')
-        all_jokes = jokes_ref.get() or {}
-        
-        # Нормализация текста для сравнения (приведение к нижнему регистру и удаление лишних пробелов)
-        normalized_text = " ".join(text.lower().split())
-        
-        for joke in all_jokes.values():
-            # Нормализация существующего текста
-            existing_text = " ".join(joke.get('text', '').lower().split())
-            if existing_text == normalized_text:
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Такой анекдот уже существует в базе!"
-                )
-                return
+        if await find_duplicate_joke(root_ref, text):
+            bot.send_message(
+                message.chat.id,
+                "❌ Такой анекдот уже существует в базе!"
+            )
+            return
         
         # Добавляем анекдот с флагом approved=False
         joke_key = await add_joke(root_ref, text, user_id)
@@ -153,14 +108,15 @@ async def process_add_joke_text(bot, message):
             reply_markup=create_main_keyboard(user_id)
         )
         
-        # Отправляем уведомление администраторам
-        await notify_admins_new_joke(bot, joke_key, text)
+        # Отправляем уведомление администраторам вместе с похожими анекдотами
+        similar = await find_similar_jokes(root_ref, text)
+        await notify_admins_new_joke(bot, joke_key, text, similar)
         
     except Exception as e:
         logger.error(f"Error in add_joke_text: {e}")
         bot.reply_to(message, "⚠️ Произошла ошибка при добавлении шутки")
 
-async def notify_admins_new_joke(bot, joke_key, text):
+async def notify_admins_new_joke(bot, joke_key, text, similar=None):
     """Отправляет уведомление администраторам о новом анекдоте на модерации"""
     try:
         root_ref = initialize_firebase()
@@ -170,7 +126,8 @@ async def notify_admins_new_joke(bot, joke_key, text):
         # Формируем сообщение
         message_text = (
             f"⚠️ *Новый анекдот на модерации!*\n\n"
-            f"📊 Всего на модерации: {unapproved_count}\n\n"
+            f"📊 Всего на модерации: {unapproved_count}"
+            f"{format_similar_jokes(similar)}"
         )
         
         # Отправляем всем админам
@@ -233,7 +190,8 @@ async def process_delete_joke_start(bot, message):
                 callback_data=f"delete:{key}"
             ))
         
-        set_user_state(user_id, {'state': 'deleting_joke', 'jokes': user_jokes})
+        # В состоянии только ключи: тексты анекдотов для удаления не нужны
+        set_user_state(user_id, {'state': 'deleting_joke', 'keys': list(user_jokes)})
         bot.send_message(
             message.chat.id,
             "🗑 Выберите анекдот для удаления:",
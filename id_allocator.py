@@ -0,0 +1,74 @@
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class IdAllocator:
+    """Выдаёт ID одобренных анекдотов из арендованных у approved_counter блоков.
+
+    Блок резервируется одной транзакцией, дальше ID раздаются из памяти.
+    Неиспользованный остаток блока при освобождении возвращается в счётчик,
+    если за нами никто не резервировал, иначе записывается как пропуск в approved_id_gaps.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or config.ID_LEASE_BLOCK_SIZE
+        self._lock = threading.Lock()
+        self._root_ref = None
+        self._next = 1
+        self._end = 0  # Последний ID текущего блока включительно
+
+    def start(self, root_ref):
+        self._root_ref = root_ref
+
+    def _reserve(self, count):
+        """Транзакционно увеличивает счётчик на count; возвращает (первый, последний) ID"""
+        new_value = self._root_ref.child('approved_counter').transaction(lambda current: (current or 0) + count)
+        return new_value - count + 1, new_value
+
+    def allocate(self):
+        """Следующий уникальный ID"""
+        with self._lock:
+            if self._next > self._end:
+                self._next, self._end = self._reserve(self.block_size)
+            joke_id = self._next
+            self._next += 1
+            return joke_id
+
+    def allocate_block(self, count):
+        """Непрерывный блок из count ID; возвращает первый ID"""
+        with self._lock:
+            if self._end - self._next + 1 >= count:
+                first = self._next
+                self._next += count
+                return first
+            first, _ = self._reserve(count)
+            return first
+
+    def release(self):
+        """Возвращает неиспользованный остаток блока (вызывается при остановке)"""
+        with self._lock:
+            if self._root_ref is None or self._next > self._end:
+                return
+            first_unused, end = self._next, self._end
+            self._next, self._end = 1, 0
+
+        try:
+            result = self._root_ref.child('approved_counter').transaction(
+                lambda current: first_unused - 1 if current == end else current
+            )
+            if result != first_unused - 1:
+                # После нас блоки уже резервировали: фиксируем дыру в нумерации
+                self._root_ref.child(f'approved_id_gaps/{first_unused}').set(end)
+                logger.info(f"Recorded unused approved IDs {first_unused}-{end} as a gap")
+            else:
+                logger.info(f"Returned unused approved IDs {first_unused}-{end}")
+        except Exception as e:
+            logger.error(f"Error releasing approved ID lease: {e}")
+
+
+# Общий экземпляр для всего процесса
+id_allocator = IdAllocator()
@@ -0,0 +1,84 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз перетягивать анекдоты, совпавшие с последним показанным в чате
+MAX_REDRAW_ROUNDS = 16
+
+
+class JokePlan:
+    """План рассылки: чат → анекдот.
+
+    Хранится компактно: массив ID чатов (int64), массив индексов (int32)
+    и общий список анекдотов, на который они ссылаются.
+    """
+
+    def __init__(self, chat_ids, joke_indexes, jokes):
+        self.chat_ids = chat_ids
+        self.joke_indexes = joke_indexes
+        self.jokes = jokes
+
+    def __len__(self):
+        return len(self.chat_ids)
+
+    def __iter__(self):
+        """Пары (chat_id, joke)"""
+        jokes = self.jokes
+        for chat_id, index in zip(self.chat_ids.tolist(), self.joke_indexes.tolist()):
+            yield chat_id, jokes[index]
+
+    def messages(self, format_joke):
+        """Пары (chat_id, текст); текст форматируется один раз на анекдот"""
+        texts = [format_joke(joke) for joke in self.jokes]
+        for chat_id, index in zip(self.chat_ids.tolist(), self.joke_indexes.tolist()):
+            yield chat_id, texts[index]
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), [])
+
+
+def assign_random(chat_ids, jokes, last_jokes, rng=None):
+    """Случайный анекдот каждому чату одним векторным проходом.
+
+    jokes — список одобренных анекдотов, last_jokes — LastJokeTracker с ID
+    последнего показанного анекдота каждого чата; он обновляется. Совпадения с последним анекдотом
+    перетягиваются только для совпавших чатов.
+    """
+    if not jokes or not chat_ids:
+        return JokePlan.empty()
+    rng = rng or np.random.default_rng()
+
+    chats = np.fromiter((int(c) for c in chat_ids), dtype=np.int64, count=len(chat_ids))
+    joke_ids = np.fromiter((joke.get('joke_id') or -1 for joke in jokes), dtype=np.int64, count=len(jokes))
+    last = np.array(last_jokes.get_many(chats.tolist(), -1), dtype=np.int64)
+
+    draws = rng.integers(0, len(jokes), size=len(chats), dtype=np.int32)
+    if len(jokes) > 1:
+        for _ in range(MAX_REDRAW_ROUNDS):
+            collided = np.flatnonzero(joke_ids[draws] == last)
+            if collided.size == 0:
+                break
+            draws[collided] = rng.integers(0, len(jokes), size=collided.size, dtype=np.int32)
+
+    last_jokes.update(zip(chats.tolist(), joke_ids[draws].tolist()))
+    return JokePlan(chats, draws, jokes)
+
+
+def assign_from_decks(chat_ids, decks):
+    """Следующий анекдот из колоды каждого чата; чаты без анекдота в план не попадают"""
+    chats, indexes, jokes, index_by_key = [], [], [], {}
+    decks.load()
+    for chat_id in chat_ids:
+        joke = decks.next_joke(chat_id)
+        if joke is None:
+            continue
+        key = joke.get('joke_id')
+        if key not in index_by_key:
+            index_by_key[key] = len(jokes)
+            jokes.append(joke)
+        chats.append(int(chat_id))
+        indexes.append(index_by_key[key])
+    return JokePlan(np.array(chats, dtype=np.int64), np.array(indexes, dtype=np.int32), jokes)
@@ -0,0 +1,340 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз перевыбирать ключ, если попали в исключённую шутку
+MAX_SAMPLE_REJECTIONS = 16
+
+
+def normalize_joke_text(text):
+    """Нормализация текста для сравнения (нижний регистр, схлопнутые пробелы)"""
+    return " ".join((text or '').lower().split())
+
+
+def joke_text_digest(text):
+    """Хеш нормализованного текста — ключ индекса дубликатов joke_hashes"""
+    return hashlib.sha1(normalize_joke_text(text).encode('utf-8')).hexdigest()
+
+
+class ApprovedSampler:
+    """Массив ключей одобренных анекдотов с O(1) добавлением, удалением и выбором"""
+
+    def __init__(self):
+        self._keys = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def add(self, key):
+        if key in self._positions:
+            return
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+
+    def remove(self, key):
+        """Удаление через перестановку с последним элементом"""
+        pos = self._positions.pop(key, None)
+        if pos is None:
+            return
+        last_key = self._keys.pop()
+        if last_key != key:
+            self._keys[pos] = last_key
+            self._positions[last_key] = pos
+
+    def clear(self):
+        self._keys = []
+        self._positions = {}
+
+    def choice(self):
+        return self._keys[random.randrange(len(self._keys))]
+
+    def keys(self):
+        return list(self._keys)
+
+
+class JokeCorpus:
+    """Копия ветки /jokes в памяти процесса, обновляемая через listen()"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._jokes = {}
+        self._approved = ApprovedSampler()
+        self._by_id = {}
+        self._hashes = {}  # хеш текста -> ключи анекдотов с таким текстом
+        self._by_user = {}
+        self._max_joke_id = 0
+        self._listeners = []
+        self._ready = threading.Event()
+        self._jokes_ref = None
+        self._registration = None
+        self._resync_thread = None
+        self._running = False
+
+    @property
+    def loaded(self):
+        return self._ready.is_set()
+
+    def start(self, root_ref):
+        """Загружает анекдоты и подписывается на изменения ветки /jokes"""
+        if self._running:
+            return
+        self._running = True
+        self._jokes_ref = root_ref.child('jokes')
+        self._listen()
+
+        # Первое событие listen() содержит всё дерево; если его нет — грузим вручную
+        if not self._ready.wait(config.JOKE_CACHE_LOAD_TIMEOUT):
+            logger.warning("Joke listener did not deliver initial snapshot, loading directly")
+            self.load()
+
+        self._resync_thread = threading.Thread(target=self._resync_loop, daemon=True)
+        self._resync_thread.start()
+        logger.info(f"Joke corpus started with {self.count()} jokes")
+
+    def stop(self):
+        self._running = False
+        self._close_listener()
+
+    def add_listener(self, callback):
+        """Подписка на изменения множества одобренных анекдотов.
+
+        callback(event, key, joke): event — 'approved', 'removed' или 'reset'
+        (полная перезагрузка). Вызывается под блокировкой корпуса, поэтому должен быть быстрым.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, event, key=None, joke=None):
+        for callback in self._listeners:
+            try:
+                callback(event, key, joke)
+            except Exception as e:
+                logger.error(f"Error in joke corpus listener: {e}")
+
+    def load(self):
+        """Полная перезагрузка ветки /jokes"""
+        try:
+            jokes = self._jokes_ref.get() or {}
+            self._replace_all(jokes)
+        except Exception as e:
+            logger.error(f"Error loading joke corpus: {e}")
+
+    def _listen(self):
+        try:
+            self._registration = self._jokes_ref.listen(self._on_event)
+        except Exception as e:
+            logger.error(f"Error starting joke listener: {e}")
+            self._registration = None
+
+    def _close_listener(self):
+        if self._registration is not None:
+            try:
+                self._registration.close()
+            except Exception as e:
+                logger.error(f"Error closing joke listener: {e}")
+            self._registration = None
+
+    def _resync_loop(self):
+        """Периодически переподключает поток: новое подключение заново присылает всё дерево"""
+        while self._running:
+            time.sleep(config.JOKE_CACHE_RESYNC_INTERVAL)
+            if not self._running:
+                break
+            logger.info("Resyncing joke corpus")
+            self._close_listener()
+            self._listen()
+            if self._registration is None:
+                self.load()
+
+    def _on_event(self, event):
+        try:
+            parts = [p for p in event.path.split('/') if p]
+            data = event.data
+            if not parts:
+                if event.event_type == 'put':
+                    self._replace_all(data or {})
+                else:
+                    for key, joke in (data or {}).items():
+                        self.put_joke(key, joke)
+            elif len(parts) == 1:
+                if event.event_type == 'put':
+                    self.put_joke(parts[0], data)
+                else:
+                    self.update_joke(parts[0], data or {})
+            else:
+                self._set_nested(parts[0], parts[1:], data)
+        except Exception as e:
+            logger.error(f"Error applying joke event {event.path}: {e}")
+
+    def _replace_all(self, jokes):
+        with self._lock:
+            self._jokes = {key: joke for key, joke in jokes.items() if isinstance(joke, dict)}
+            self._approved.clear()
+            self._by_id = {}
+            self._hashes = {}
+            self._by_user = {}
+            for key, joke in self._jokes.items():
+                self._index(key, joke)
+            self._notify('reset')
+        self._ready.set()
+
+    def _set_nested(self, key, path, value):
+        with self._lock:
+            joke = dict(self._jokes.get(key) or {})
+            node = joke
+            for part in path[:-1]:
+                node[part] = dict(node.get(part) or {})
+                node = node[part]
+            if value is None:
+                node.pop(path[-1], None)
+            else:
+                node[path[-1]] = value
+            self._store(key, joke)
+
+    def put_joke(self, key, joke):
+        """Записывает анекдот целиком (None — удаление)"""
+        if not isinstance(joke, dict):
+            self.remove_joke(key)
+            return
+        with self._lock:
+            self._store(key, dict(joke))
+
+    def update_joke(self, key, fields):
+        """Частичное обновление полей анекдота"""
+        with self._lock:
+            joke = dict(self._jokes.get(key) or {})
+            for field, value in fields.items():
+                if value is None:
+                    joke.pop(field, None)
+                else:
+                    joke[field] = value
+            self._store(key, joke)
+
+    def remove_joke(self, key):
+        with self._lock:
+            old = self._jokes.pop(key, None)
+            self._unindex(key, old)
+            if old and old.get('approved', False):
+                self._notify('removed', key, old)
+
+    def _store(self, key, joke):
+        """Сохраняет анекдот и поддерживает индексы одобренных"""
+        old = self._jokes.get(key) or {}
+        self._unindex(key, old)
+        self._jokes[key] = joke
+        self._index(key, joke)
+
+        was_approved = old.get('approved', False)
+        if joke.get('approved', False):
+            if not was_approved or old.get('text') != joke.get('text'):
+                self._notify('approved', key, joke)
+        elif was_approved:
+            self._notify('removed', key, old)
+
+    def _index(self, key, joke):
+        self._hashes.setdefault(joke_text_digest(joke.get('text')), set()).add(key)
+        self._by_user.setdefault(joke.get('user_id'), set()).add(key)
+        if not joke.get('approved', False):
+            return
+        self._approved.add(key)
+        joke_id = joke.get('joke_id')
+        if isinstance(joke_id, int):
+            self._by_id[joke_id] = key
+            self._max_joke_id = max(self._max_joke_id, joke_id)
+
+    def _unindex(self, key, joke):
+        self._approved.remove(key)
+        if not joke:
+            return
+        if self._by_id.get(joke.get('joke_id')) == key:
+            del self._by_id[joke['joke_id']]
+        digest = joke_text_digest(joke.get('text'))
+        digest_keys = self._hashes.get(digest)
+        if digest_keys is not None:
+            digest_keys.discard(key)
+            if not digest_keys:
+                del self._hashes[digest]
+        user_keys = self._by_user.get(joke.get('user_id'))
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._by_user[joke.get('user_id')]
+
+    def get(self, key):
+        with self._lock:
+            return self._jokes.get(key)
+
+    def count(self):
+        with self._lock:
+            return len(self._jokes)
+
+    def approved_items(self):
+        with self._lock:
+            return [(key, self._jokes[key]) for key in self._approved.keys()]
+
+    def approved_count(self):
+        with self._lock:
+            return len(self._approved)
+
+    def random_approved(self, exclude_joke_id=None):
+        """Случайный одобренный анекдот за O(1): выборка с отклонением исключённого ID"""
+        with self._lock:
+            count = len(self._approved)
+            if count == 0:
+                return None
+            joke = self._jokes[self._approved.choice()]
+            if exclude_joke_id is None:
+                return joke
+            if count == 1:
+                logger.warning(f"No jokes available after excluding joke {exclude_joke_id}. Returning random from all.")
+                return joke
+            for _ in range(MAX_SAMPLE_REJECTIONS):
+                if joke.get('joke_id') != exclude_joke_id:
+                    break
+                joke = self._jokes[self._approved.choice()]
+            return joke
+
+    def user_jokes(self, user_id, only_approved=True):
+        with self._lock:
+            user_jokes = {}
+            for key in self._by_user.get(user_id, ()):
+                joke = self._jokes[key]
+                if not only_approved or joke.get('approved', False):
+                    user_jokes[key] = joke
+            return user_jokes
+
+    def find_by_id(self, joke_id):
+        with self._lock:
+            key = self._by_id.get(joke_id)
+            if key is None:
+                return None, None
+            return key, self._jokes[key]
+
+    def find_by_digest(self, digest):
+        """Ключ анекдота с таким же нормализованным текстом или None"""
+        with self._lock:
+            keys = self._hashes.get(digest)
+            return min(keys) if keys else None
+
+    def keys_by_digest(self, digest):
+        """Ключи всех анекдотов с таким нормализованным текстом"""
+        with self._lock:
+            return frozenset(self._hashes.get(digest, ()))
+
+    def max_joke_id(self):
+        """Наибольший выданный ID одобренного анекдота (ID не переиспользуются)"""
+        with self._lock:
+            return self._max_joke_id
+
+
+# Общий экземпляр для всего процесса
+joke_corpus = JokeCorpus()
@@ -0,0 +1,160 @@
+import logging
+import random
+import struct
+import threading
+
+from joke_cache import joke_corpus
+from write_buffer import write_buffer
+
+logger = logging.getLogger(__name__)
+
+# Состояние колоды: seed, позиция в перестановке, границы диапазона ID (lo, span]
+_STATE_FORMAT = '<IIII'
+_FEISTEL_ROUNDS = 4
+
+
+def _mix(x):
+    """Перемешивающая функция для раундов сети Фейстеля (32 бита)"""
+    x &= 0xFFFFFFFF
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    return x ^ (x >> 16)
+
+
+def permute(index, size, seed):
+    """Позиция index в псевдослучайной перестановке [0, size), заданной seed.
+
+    Сеть Фейстеля над ближайшей степенью четвёрки с cycle-walking:
+    перестановка вычисляется по одному элементу и не хранится.
+    """
+    half = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    x = index
+    while True:
+        left, right = x >> half, x & mask
+        for rnd in range(_FEISTEL_ROUNDS):
+            left, right = right, left ^ (_mix(right ^ _mix(seed + rnd * 0x9E3779B9)) & mask)
+        x = (left << half) | right
+        if x < size:
+            return x
+
+
+def _reshuffle_seed(size, avoid_first, attempts=32):
+    """Новый seed, при котором колода не начинается с только что показанного ID"""
+    seed = random.getrandbits(32)
+    for _ in range(attempts):
+        if size < 2 or avoid_first is None or 1 + permute(0, size, seed) != avoid_first:
+            break
+        seed = random.getrandbits(32)
+    return seed
+
+
+def next_in_deck(state, max_id, is_available):
+    """Следующий ID анекдота для колоды и новое состояние.
+
+    Колода проходит ID из диапазона (lo, span] в перестановке без повторов.
+    Когда диапазон пройден, сначала доигрываются ID, одобренные позже (span, max_id],
+    и только потом колода перетасовывается заново.
+    """
+    seed, cursor, lo, span = state
+    steps = 0
+    limit = 2 * max_id + 2
+    while steps <= limit:
+        if cursor >= span - lo:
+            if max_id > span:
+                lo, span = span, max_id
+            else:
+                last_id = lo + 1 + permute(cursor - 1, span - lo, seed) if cursor else None
+                seed, lo, span = _reshuffle_seed(max_id, last_id), 0, max_id
+            cursor = 0
+            if span == lo:
+                return None, (seed, cursor, lo, span)
+        joke_id = lo + 1 + permute(cursor, span - lo, seed)
+        cursor += 1
+        steps += 1
+        # ID удалённых анекдотов просто пропускаем
+        if is_available(joke_id):
+            return joke_id, (seed, cursor, lo, span)
+    return None, (seed, cursor, lo, span)
+
+
+class DeckStore:
+    """Колоды без повторов для каждого чата.
+
+    Состояние колоды — 16 байт, но с объектами bytes и int и слотом dict
+    в памяти выходит около 130 байт на чат.
+
+    Сохранённые колоды читаются из базы одним запросом при старте, а не по
+    запросу на чат в первой рассылке после перезапуска.
+    """
+
+    def __init__(self, corpus):
+        self._corpus = corpus
+        self._lock = threading.Lock()
+        self._decks = {}
+        self._ref = None
+        self._loaded = False
+
+    def start(self, root_ref):
+        self._ref = root_ref.child('joke_decks')
+        self.load()
+
+    def load(self):
+        """Поднимает все сохранённые колоды одним get(); после ошибки повторяется в следующей рассылке"""
+        if self._ref is None or self._loaded:
+            return
+        try:
+            saved_decks = self._ref.get() or {}
+        except Exception as e:
+            logger.error(f"Error loading joke decks: {e}")
+            return
+        # Firebase отдаёт узел с числовыми ключами как список
+        if isinstance(saved_decks, list):
+            saved_decks = {chat_id: saved for chat_id, saved in enumerate(saved_decks) if saved}
+        decks = {}
+        for chat_id, saved in saved_decks.items():
+            try:
+                if isinstance(saved, list) and len(saved) == 4:
+                    decks[int(chat_id)] = struct.pack(_STATE_FORMAT, *(int(v) for v in saved))
+            except (ValueError, struct.error):
+                continue
+        with self._lock:
+            # Колоды, изменённые до окончания загрузки, новее сохранённых
+            decks.update(self._decks)
+            self._decks = decks
+            self._loaded = True
+        logger.info(f"Loaded joke decks for {len(decks)} chats")
+
+    def _save(self, chat_id, state):
+        if self._ref is None:
+            return
+        # Колоды меняются при каждой отправке: пишем пакетами через буфер
+        write_buffer.set(f'joke_decks/{chat_id}', list(state))
+
+    def next_joke(self, chat_id):
+        """Следующий анекдот из колоды чата или None, если одобренных нет"""
+        chat_id = int(chat_id)
+        # Чтение, сдвиг и запись колоды под одной блокировкой: иначе два
+        # одновременных вызова для чата получат один и тот же анекдот
+        with self._lock:
+            packed = self._decks.get(chat_id)
+            if packed is not None:
+                state = struct.unpack(_STATE_FORMAT, packed)
+            else:
+                state = (random.getrandbits(32), 0, 0, 0)
+
+            max_id = self._corpus.max_joke_id()
+            joke_id, state = next_in_deck(
+                state, max_id, lambda jid: self._corpus.find_by_id(jid)[0] is not None
+            )
+
+            self._decks[chat_id] = struct.pack(_STATE_FORMAT, *state)
+            self._save(chat_id, state)
+
+        if joke_id is None:
+            return None
+        return self._corpus.find_by_id(joke_id)[1]
+
+
+# Общий экземпляр для всего процесса
+joke_decks = DeckStore(joke_corpus)
@@ -22,6 +22,7 @@ def create_admin_keyboard():
         KeyboardButton("🗑 Удалить по ID"),
         KeyboardButton("📊 Статистика"),
         KeyboardButton("👮 Модерация"),
+        KeyboardButton("📦 Пакетная модерация"),
         KeyboardButton("🔙 Главное меню")
     ]
     keyboard.add(*buttons)
@@ -42,4 +43,24 @@ def create_moderation_reply_keyboard():
         KeyboardButton("🚫 Завершить")
     ]
     keyboard.add(*buttons)
+    return keyboard
+
+# Отметки пакетной модерации: пропустить, одобрить, отклонить
+BULK_DECISION_MARKS = {'skip': '⏸', 'approve': '✅', 'reject': '❌'}
+
+def create_bulk_moderation_keyboard(decisions):
+    """Inline-клавиатура пакетной модерации: по кнопке-переключателю на анекдот"""
+    keyboard = InlineKeyboardMarkup(row_width=5)
+    keyboard.add(*[
+        InlineKeyboardButton(f"{i + 1} {BULK_DECISION_MARKS[decision]}", callback_data=f"bulk:toggle:{i}")
+        for i, decision in enumerate(decisions)
+    ])
+    keyboard.row(
+        InlineKeyboardButton("✅ Все", callback_data="bulk:all:approve"),
+        InlineKeyboardButton("❌ Все", callback_data="bulk:all:reject")
+    )
+    keyboard.row(
+        InlineKeyboardButton("💾 Применить", callback_data="bulk:apply"),
+        InlineKeyboardButton("🚫 Отмена", callback_data="bulk:cancel")
+    )
     return keyboard
\ No newline at end of file
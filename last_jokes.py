@@ -0,0 +1,268 @@
+import logging
+import os
+import random
+import struct
+import threading
+from array import array
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = 0  # ID чата 0 не бывает, поэтому 0 отмечает свободную ячейку
+_MIN_SLOTS = 1024
+_MAX_LOAD = 0.8
+_GOLDEN = 0x9E3779B97F4A7C15  # Множитель Фибоначчиева хеширования
+_MASK64 = (1 << 64) - 1
+_MAX_TICK = (1 << 32) - 1
+_EVICTION_SAMPLES = 8
+_SNAPSHOT_HEADER = struct.Struct('<4sQQQ')  # метка, ячеек, чатов, часы
+_SNAPSHOT_MAGIC = b'LJT1'
+
+
+class LastJokeTracker:
+    """Последний показанный анекдот каждого чата в компактной хеш-таблице.
+
+    Открытая адресация с линейным пробированием поверх трёх массивов: ID чатов
+    array('q'), ID анекдотов array('i') и отметки обращений array('I') —
+    16 байт на ячейку (около 20 на чат при заполнении 0.8) вместо сотни с
+    лишним байт на запись словаря. Удаление сдвигает следующие записи назад,
+    так что надгробий нет. Таблица растёт удвоением до max_chats записей;
+    дальше вытесняется самая давняя из нескольких случайных (приблизительный
+    LRU). Снимок таблицы пишется на диск периодически и при остановке и
+    читается при старте.
+    """
+
+    def __init__(self, max_chats=None, snapshot_path=None):
+        self.max_chats = max_chats or config.LAST_JOKE_MAX_CHATS
+        self.snapshot_path = config.LAST_JOKE_SNAPSHOT_PATH if snapshot_path is None else snapshot_path
+        # Размер не обязан быть степенью двойки: ячейка выбирается умножением, а не маской
+        self._max_slots = max(_MIN_SLOTS, int(self.max_chats / _MAX_LOAD) + 1)
+        self._lock = threading.Lock()
+        # Отдельно от _lock: запись файла не должна блокировать таблицу
+        self._save_lock = threading.Lock()
+        self._allocate(_MIN_SLOTS)
+        self._clock = 0
+        self._dirty = False
+        self._running = False
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _allocate(self, slots):
+        self._slots = slots
+        self._keys = array('q', bytes(8 * slots))
+        self._values = array('i', bytes(4 * slots))
+        self._ticks = array('I', bytes(4 * slots))
+        self._count = 0
+
+    def _home(self, key):
+        return (((key * _GOLDEN) & _MASK64) * self._slots) >> 64
+
+    def _find(self, key):
+        """Ячейка ключа или первая свободная ячейка на его пути"""
+        keys, slots = self._keys, self._slots
+        i = (((key * _GOLDEN) & _MASK64) * slots) >> 64
+        while True:
+            k = keys[i]
+            if k == key or k == _EMPTY:
+                return i
+            i += 1
+            if i == slots:
+                i = 0
+
+    def _tick(self):
+        self._clock += 1
+        if self._clock >= _MAX_TICK:
+            # Часы переполнились: сжимаем все отметки вдвое, порядок сохраняется
+            self._ticks = array('I', (tick >> 1 for tick in self._ticks))
+            self._clock >>= 1
+        return self._clock
+
+    def _get_locked(self, key, default):
+        i = self._find(key)
+        if self._keys[i] == _EMPTY:
+            return default
+        self._ticks[i] = self._tick()
+        return self._values[i]
+
+    def _set_locked(self, key, value):
+        i = self._find(key)
+        if self._keys[i] == _EMPTY:
+            if self._count + 1 > self._slots * _MAX_LOAD and self._slots < self._max_slots:
+                self._resize(min(self._slots * 2, self._max_slots))
+            elif self._count >= self.max_chats:
+                self._evict()
+            i = self._find(key)
+            self._keys[i] = key
+            self._count += 1
+        self._values[i] = value
+        self._ticks[i] = self._tick()
+        self._dirty = True
+
+    def _resize(self, slots):
+        keys, values, ticks = self._keys, self._values, self._ticks
+        self._allocate(slots)
+        for k, value, tick in zip(keys, values, ticks):
+            if k != _EMPTY:
+                i = self._find(k)
+                self._keys[i], self._values[i], self._ticks[i] = k, value, tick
+                self._count += 1
+
+    def _evict(self):
+        keys = self._keys
+        victim = None
+        found = 0
+        while found < _EVICTION_SAMPLES:
+            i = random.randrange(self._slots)
+            if keys[i] != _EMPTY:
+                found += 1
+                if victim is None or self._ticks[i] < self._ticks[victim]:
+                    victim = i
+        self._delete_slot(victim)
+
+    def _delete_slot(self, hole):
+        """Удаление со сдвигом: записи за дырой, которым можно, переезжают ближе к дому"""
+        keys, values, ticks, slots = self._keys, self._values, self._ticks, self._slots
+        j = hole
+        while True:
+            j = (j + 1) % slots
+            k = keys[j]
+            if k == _EMPTY:
+                break
+            # Запись может занять дыру, если дыра не раньше её домашней ячейки
+            if (j - hole) % slots <= (j - self._home(k)) % slots:
+                keys[hole], values[hole], ticks[hole] = k, values[j], ticks[j]
+                hole = j
+        keys[hole], values[hole], ticks[hole] = _EMPTY, 0, 0
+        self._count -= 1
+
+    def get(self, chat_id, default=None):
+        with self._lock:
+            return self._get_locked(int(chat_id), default)
+
+    def __setitem__(self, chat_id, joke_id):
+        chat_id = int(chat_id)
+        if chat_id == _EMPTY or joke_id is None:
+            return
+        with self._lock:
+            self._set_locked(chat_id, joke_id)
+
+    def get_many(self, chat_ids, default=None):
+        """Последние анекдоты для списка чатов под одной блокировкой"""
+        with self._lock:
+            return [self._get_locked(int(chat_id), default) for chat_id in chat_ids]
+
+    def update(self, pairs):
+        """Запоминает пары (chat_id, joke_id) под одной блокировкой"""
+        with self._lock:
+            for chat_id, joke_id in pairs:
+                chat_id = int(chat_id)
+                if chat_id != _EMPTY and joke_id is not None:
+                    self._set_locked(chat_id, joke_id)
+
+    def remove(self, chat_id):
+        with self._lock:
+            i = self._find(int(chat_id))
+            if self._keys[i] != _EMPTY:
+                self._delete_slot(i)
+                self._dirty = True
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def memory_usage(self):
+        """Объём массивов таблицы, байт"""
+        with self._lock:
+            return sum(a.itemsize * len(a) for a in (self._keys, self._values, self._ticks))
+
+    def save(self, path=None):
+        """Атомарно записывает снимок таблицы на диск"""
+        path = path or self.snapshot_path
+        if not path:
+            return False
+        with self._lock:
+            header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, self._slots, self._count, self._clock)
+            data = [header, self._keys.tobytes(), self._values.tobytes(), self._ticks.tobytes()]
+            self._dirty = False
+        tmp_path = path + '.tmp'
+        # Периодическое и финальное сохранения пишут один и тот же временный файл
+        with self._save_lock:
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in data:
+                        f.write(chunk)
+                os.replace(tmp_path, path)
+                return True
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"Error saving last jokes snapshot: {e}")
+                return False
+
+    def load(self, path=None):
+        """Читает снимок; при уменьшенном лимите оставляет самые свежие чаты"""
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                magic, slots, count, clock = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+                if magic != _SNAPSHOT_MAGIC:
+                    raise ValueError("not a last jokes snapshot")
+                keys, values, ticks = array('q'), array('i'), array('I')
+                keys.fromfile(f, slots)
+                values.fromfile(f, slots)
+                ticks.fromfile(f, slots)
+        except Exception as e:
+            logger.error(f"Error loading last jokes snapshot: {e}")
+            return False
+
+        with self._lock:
+            if slots <= self._max_slots and count <= self.max_chats:
+                # Хеш зависит только от размера таблицы — массивы берём как есть
+                self._slots = slots
+                self._keys, self._values, self._ticks = keys, values, ticks
+                self._count = count
+                self._clock = clock
+            else:
+                self._allocate(_MIN_SLOTS)
+                entries = sorted((tick, k, value) for k, value, tick in zip(keys, values, ticks) if k != _EMPTY)
+                for _, k, value in entries[-self.max_chats:]:
+                    self._set_locked(k, value)
+            count = self._count
+        logger.info(f"Loaded last jokes for {count} chats")
+        return True
+
+    def start(self):
+        """Загружает снимок и запускает периодическое сохранение"""
+        if self._running:
+            return
+        try:
+            self.load()
+        except Exception as e:
+            # Без снимка бот работает, просто начинает с пустой таблицы
+            logger.error(f"Error restoring last jokes, starting empty: {e}")
+            with self._lock:
+                self._allocate(_MIN_SLOTS)
+        self._running = True
+        self._thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        # Дожидаемся идущего периодического сохранения, иначе финальное пересечётся с ним
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save()
+
+    def _snapshot_loop(self):
+        while self._running:
+            self._wakeup.wait(config.LAST_JOKE_SNAPSHOT_INTERVAL)
+            if self._running and self._dirty:
+                self.save()
+
+
+# Общий экземпляр для всего процесса
+last_joke_tracker = LastJokeTracker()
@@ -0,0 +1,190 @@
+import logging
+import re
+import threading
+import zlib
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Простое число больше 2^32 для универсального хеширования (a * x + b) mod p
+_MERSENNE_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_for_shingles(text):
+    """Нижний регистр, ё → е, без пунктуации и лишних пробелов"""
+    text = (text or '').lower().replace('ё', 'е')
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def shingle_hashes(text, size):
+    """Хеши символьных шинглов длины size (crc32, без повторов)"""
+    normalized = normalize_for_shingles(text)
+    if len(normalized) <= size:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+class MinHashLSH:
+    """MinHash-сигнатуры с LSH по полосам для поиска почти одинаковых текстов.
+
+    Сигнатура — num_perm минимумов универсальных хешей по шинглам;
+    доля совпавших позиций оценивает коэффициент Жаккара. Сигнатура режется
+    на bands полос, кандидаты — тексты, совпавшие хотя бы в одной полосе.
+    """
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=4, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2^31, x < 2^32: произведение помещается в uint64 без переполнения
+        self._a = rng.integers(1, 2 ** 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.shingle_size)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        values = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return (values & _MAX_HASH).min(axis=0)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, text):
+        signature = self.signature(text)
+        with self._lock:
+            self._remove_locked(key)
+            self._signatures[key] = signature
+            for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del bucket[band]
+
+    def query(self, text, top_k=3, min_score=0.0, exclude_key=None):
+        """Наиболее похожие тексты: список (key, оценка сходства) по убыванию"""
+        signature = self.signature(text)
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(band, ()))
+            candidates.discard(exclude_key)
+            if not candidates:
+                return []
+            keys = list(candidates)
+            matrix = np.stack([self._signatures[k] for k in keys])
+        scores = (matrix == signature).mean(axis=1)
+        order = np.argsort(-scores)[:top_k]
+        return [(keys[i], float(scores[i])) for i in order if scores[i] >= min_score]
+
+
+class NearDuplicateIndex:
+    """LSH-индекс одобренных анекдотов, синхронизированный с корпусом"""
+
+    def __init__(self):
+        self._lsh = MinHashLSH(
+            num_perm=config.NEAR_DUP_NUM_PERM,
+            bands=config.NEAR_DUP_BANDS,
+            shingle_size=config.NEAR_DUP_SHINGLE_SIZE
+        )
+        self._corpus = None
+        self._lock = threading.Lock()
+        self._pending = None
+        self.ready = False
+
+    def start(self, corpus):
+        if self._corpus is not None:
+            return
+        self._corpus = corpus
+        corpus.add_listener(self._on_corpus_event)
+        self._schedule_rebuild()
+
+    def _on_corpus_event(self, event, key, joke):
+        if event == 'reset':
+            self._schedule_rebuild()
+            return
+        with self._lock:
+            # Во время перестроения изменения копятся и применяются после неё
+            if self._pending is not None:
+                self._pending.append((event, key, joke))
+                return
+        self._apply(self._lsh, event, key, joke)
+
+    @staticmethod
+    def _apply(lsh, event, key, joke):
+        if event == 'approved':
+            lsh.add(key, joke.get('text', ''))
+        elif event == 'removed':
+            lsh.remove(key)
+
+    def _schedule_rebuild(self):
+        with self._lock:
+            if self._pending is not None:
+                return
+            self._pending = []
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            lsh = MinHashLSH(
+                num_perm=config.NEAR_DUP_NUM_PERM,
+                bands=config.NEAR_DUP_BANDS,
+                shingle_size=config.NEAR_DUP_SHINGLE_SIZE
+            )
+            items = self._corpus.approved_items()
+            for key, joke in items:
+                lsh.add(key, joke.get('text', ''))
+            with self._lock:
+                for event, key, joke in self._pending:
+                    self._apply(lsh, event, key, joke)
+                self._lsh = lsh
+                self._pending = None
+            self.ready = True
+            logger.info(f"Near-duplicate index built for {len(items)} jokes")
+        except Exception as e:
+            with self._lock:
+                self._pending = None
+            logger.error(f"Error building near-duplicate index: {e}")
+
+    def similar(self, text, exclude_key=None):
+        """Похожие одобренные анекдоты: список (key, оценка)"""
+        return self._lsh.query(
+            text,
+            top_k=config.NEAR_DUP_TOP_K,
+            min_score=config.NEAR_DUP_MIN_SCORE,
+            exclude_key=exclude_key
+        )
+
+
+# Общий экземпляр для всего процесса
+near_duplicates = NearDuplicateIndex()
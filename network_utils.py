@@ -2,29 +2,59 @@ import requests
 import time
 import logging
 
+import config
+from resilience import telegram_circuit, full_jitter
+
 logger = logging.getLogger(__name__)
 
 class RobustSession(requests.Session):
-    """Сессия с повторными попытками и обработкой сетевых сбоев"""
-    
-    def request(self, method, url, max_retries=5, retry_delay=2, **kwargs):
-        """Выполняет запрос с повторными попытками при сбоях"""
+    """Сессия для запросов к Bot API: повторы только при сетевых сбоях, 5xx и коротких 429"""
+
+    def __init__(self, circuit=None, max_retries=None):
+        super().__init__()
+        self.circuit = circuit or telegram_circuit
+        self.max_retries = max_retries or config.MAX_NETWORK_RETRIES
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float((response.json().get('parameters') or {}).get('retry_after', 1))
+        except ValueError:
+            return 1.0
+
+    def request(self, method, url, **kwargs):
+        """Выполняет запрос; ответы 4xx возвращаются сразу, их разбирает вызывающий"""
+        self.circuit.budget.record_request()
         attempt = 0
-        while attempt < max_retries:
+        while True:
+            # Пока Telegram недоступен, запросы падают сразу, а не висят на таймаутах
+            self.circuit.before_call()
+            error = response = None
             try:
                 response = super().request(method, url, **kwargs)
-                if response.status_code == 200:
-                    return response
-                else:
-                    logger.warning(f"Request failed with status {response.status_code}, retrying...")
             except (requests.ConnectionError, requests.Timeout) as e:
-                logger.warning(f"Network error: {str(e)}, retrying...")
-            except Exception as e:
-                logger.error(f"Unexpected request error: {str(e)}")
-                raise
-            
+                self.circuit.record_failure()
+                error = e
+            else:
+                if response.status_code >= 500:
+                    self.circuit.record_failure()
+                else:
+                    self.circuit.record_success()
+                    if response.status_code != 429:
+                        return response
+
             attempt += 1
-            if attempt < max_retries:
-                time.sleep(retry_delay)
-        
-        raise ConnectionError(f"Failed after {max_retries} attempts")
\ No newline at end of file
+            if attempt >= self.max_retries or not self.circuit.budget.try_retry():
+                if response is not None:
+                    return response
+                raise error
+
+            if response is not None and response.status_code == 429:
+                delay = self._retry_after(response)
+                # Долгую паузу пусть выдерживает вызывающий (рассылка ставит на паузу весь конвейер)
+                if delay > config.RETRY_MAX_429_WAIT:
+                    return response
+            else:
+                delay = full_jitter(attempt - 1)
+            logger.warning(f"Telegram request failed ({error or response.status_code}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
@@ -0,0 +1,175 @@
+import logging
+import sqlite3
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    label TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, created_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class Outbox:
+    """Надёжная очередь исходящих сообщений в SQLite (WAL).
+
+    Сообщения рассылки записываются до отправки одной транзакцией на пакет,
+    ключ идемпотентности (PRIMARY KEY) не даёт поставить одно сообщение дважды.
+    Статусы sent/failed копятся в памяти и фиксируются группой раз в
+    OUTBOX_COMMIT_INTERVAL секунд. После перезапуска сообщения в статусе
+    pending досылаются; повтор возможен только для сообщений, отправленных
+    в последние OUTBOX_COMMIT_INTERVAL секунд перед падением.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or config.OUTBOX_DB_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._status_updates = []
+        self._wakeup = threading.Event()
+        self._running = True
+        self._closed = False
+        self._thread = threading.Thread(target=self._commit_loop, daemon=True)
+        self._thread.start()
+
+    def enqueue_many(self, messages, label):
+        """Ставит сообщения [(key, chat_id, text)] в очередь; возвращает ключи, которых ещё не было"""
+        now = time.time()
+        inserted = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key, chat_id, text in messages:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox (key, chat_id, text, label, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, int(chat_id), text, label, now, now)
+                    )
+                    if cursor.rowcount:
+                        inserted.append(key)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def mark_sent(self, key):
+        self._add_status(key, SENT, None)
+
+    def mark_failed(self, key, error):
+        self._add_status(key, FAILED, str(error)[:500])
+
+    def _add_status(self, key, status, error):
+        with self._lock:
+            if self._closed:
+                # Соединение уже закрыто: сообщение останется pending и дошлётся после запуска
+                logger.warning(f"Outbox is closed, status {status} for {key} dropped")
+                return
+            self._status_updates.append((status, error, time.time(), key))
+
+    def commit(self):
+        """Фиксирует накопленные статусы одной транзакцией"""
+        with self._lock:
+            updates, self._status_updates = self._status_updates, []
+            if not updates:
+                return
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "UPDATE outbox SET status = ?, error = ?, updated_at = ? WHERE key = ?", updates
+                )
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                self._conn.execute("ROLLBACK")
+                self._status_updates = updates + self._status_updates
+                logger.error(f"Error committing {len(updates)} outbox statuses: {e}")
+
+    def _commit_loop(self):
+        last_purge = 0
+        while self._running:
+            self._wakeup.wait(config.OUTBOX_COMMIT_INTERVAL)
+            self.commit()
+            if time.time() - last_purge > 60 * 60:
+                last_purge = time.time()
+                self.purge()
+
+    def pending(self, max_age=None):
+        """Неотправленные сообщения [(key, chat_id, text, label)] в порядке постановки"""
+        query = "SELECT key, chat_id, text, label FROM outbox WHERE status = ?"
+        params = [PENDING]
+        if max_age is not None:
+            query += " AND created_at >= ?"
+            params.append(time.time() - max_age)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+
+    def expire(self, max_age):
+        """Помечает слишком старые неотправленные сообщения как failed"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, error = 'expired', updated_at = ? WHERE status = ? AND created_at < ?",
+                (FAILED, time.time(), PENDING, time.time() - max_age)
+            )
+            return cursor.rowcount
+
+    def purge(self):
+        """Удаляет завершённые сообщения старше OUTBOX_RETENTION"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "DELETE FROM outbox WHERE status != ? AND updated_at < ?",
+                    (PENDING, time.time() - config.OUTBOX_RETENTION)
+                )
+        except Exception as e:
+            logger.error(f"Error purging outbox: {e}")
+
+    def counts(self):
+        """Количество сообщений по статусам"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def get_checkpoint(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, name, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO checkpoints (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, value)
+            )
+
+    def close(self):
+        """Фиксирует оставшиеся статусы и закрывает базу; поздние mark_* отбрасываются"""
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self.commit()
+        with self._lock:
+            self._closed = True
+            self._conn.close()
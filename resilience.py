@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+from firebase_admin import exceptions as firebase_exceptions
+
+import config
+from storage import Reference
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Зависимость считается недоступной: запрос отклонён без обращения к ней"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def full_jitter(attempt, base=None, cap=None):
+    """Пауза перед повтором attempt (с нуля): случайная в [0, min(cap, base * 2^attempt)]"""
+    base = config.RETRY_BASE_DELAY if base is None else base
+    cap = config.RETRY_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryBudget:
+    """Бюджет повторов: не больше ratio повторов на каждый исходный запрос.
+
+    Каждый запрос добавляет ratio токена, каждый повтор тратит один. Во время
+    сбоя повторы быстро исчерпывают бюджет и перестают умножать нагрузку.
+    """
+
+    def __init__(self, ratio=None, max_tokens=None):
+        self.ratio = config.RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.max_tokens = config.RETRY_BUDGET_MAX_TOKENS if max_tokens is None else max_tokens
+        self._tokens = self.max_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_retry(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """Автомат для одной зависимости: closed → open → half-open.
+
+    После failure_threshold сбоев подряд цепь размыкается и запросы сразу
+    получают CircuitOpenError. Через reset_timeout пропускается один пробный
+    запрос: успех замыкает цепь, сбой снова размыкает её.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or config.CIRCUIT_RESET_TIMEOUT
+        self.budget = RetryBudget()
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def retry_in(self):
+        """Сколько секунд до пробного запроса (0, если запросы разрешены)"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """Разрешает запрос или поднимает CircuitOpenError"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # Половинное состояние: только один пробный запрос одновременно
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.name, 1.0)
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+# Один автомат на зависимость для всего процесса
+telegram_circuit = CircuitBreaker('Telegram')
+firebase_circuit = CircuitBreaker('Firebase')
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def call_with_retry(func, *args, circuit, is_transient, attempts=None, **kwargs):
+    """Вызов с автоматом, экспоненциальной паузой с полным джиттером и бюджетом повторов"""
+    attempts = attempts or config.RETRY_MAX_ATTEMPTS
+    if _on_event_loop():
+        # time.sleep здесь остановил бы весь цикл событий; корутинам повторы даёт get_async()
+        attempts = 1
+    circuit.budget.record_request()
+    attempt = 0
+    while True:
+        circuit.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                # Ответ получен, значит зависимость жива
+                circuit.record_success()
+                raise
+            circuit.record_failure()
+            attempt += 1
+            if attempt >= attempts or not circuit.budget.try_retry():
+                raise
+            delay = full_jitter(attempt - 1)
+            logger.warning(f"{circuit.name} call failed ({e}), retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        circuit.record_success()
+        return result
+
+
+async def async_call_with_retry(func, *args, circuit, is_transient, attempts=None, **kwargs):
+    """То же для корутин: пауза через asyncio.sleep и не блокирует цикл событий"""
+    attempts = attempts or config.RETRY_MAX_ATTEMPTS
+    circuit.budget.record_request()
+    attempt = 0
+    while True:
+        circuit.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                circuit.record_success()
+                raise
+            circuit.record_failure()
+            attempt += 1
+            if attempt >= attempts or not circuit.budget.try_retry():
+                raise
+            await asyncio.sleep(full_jitter(attempt - 1))
+            continue
+        circuit.record_success()
+        return result
+
+
+_FIREBASE_TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    firebase_exceptions.UnavailableError,
+    firebase_exceptions.DeadlineExceededError,
+    firebase_exceptions.InternalError,
+    firebase_exceptions.UnknownError,
+    sqlite3.OperationalError,
+)
+
+
+def is_transient_storage_error(error):
+    return isinstance(error, _FIREBASE_TRANSIENT_ERRORS)
+
+
+class _TransactionAborted(Exception):
+    """Исключение из функции транзакции: отказ по логике, а не сбой базы"""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+class ResilientReference(Reference):
+    """Обёртка над ссылкой хранилища с автоматом firebase_circuit.
+
+    Пока база недоступна, вызовы сразу падают с CircuitOpenError вместо того,
+    чтобы занимать потоки на таймаутах. Чтение повторяется с паузой;
+    запись и транзакции не повторяются, чтобы не применить их дважды.
+    Варианты *_async для корутин выполняют запрос в пуле потоков.
+    """
+
+    def __init__(self, ref, circuit=None):
+        self._ref = ref
+        self._circuit = circuit or firebase_circuit
+
+    @property
+    def key(self):
+        return self._ref.key
+
+    def child(self, path):
+        return ResilientReference(self._ref.child(path), self._circuit)
+
+    def _call(self, func, *args):
+        return call_with_retry(func, *args, circuit=self._circuit,
+                               is_transient=is_transient_storage_error, attempts=1)
+
+    def get(self):
+        return call_with_retry(self._ref.get, circuit=self._circuit, is_transient=is_transient_storage_error)
+
+    async def get_async(self):
+        """get() для корутин: запрос и паузы между повторами не блокируют цикл событий"""
+        return await _get_in_executor(self._ref.get, self._circuit)
+
+    def set(self, value):
+        return self._call(self._ref.set, value)
+
+    def update(self, value):
+        return self._call(self._ref.update, value)
+
+    def delete(self):
+        return self._call(self._ref.delete)
+
+    async def set_async(self, value):
+        return await _in_executor(self.set, value)
+
+    async def update_async(self, value):
+        return await _in_executor(self.update, value)
+
+    async def delete_async(self):
+        return await _in_executor(self.delete)
+
+    async def transaction_async(self, transaction_update):
+        """transaction() для корутин: у Firebase это несколько запросов подряд"""
+        return await _in_executor(self.transaction, transaction_update)
+
+    def push(self, value=''):
+        return ResilientReference(self._call(self._ref.push, value), self._circuit)
+
+    def transaction(self, transaction_update):
+        def guarded_update(current):
+            try:
+                return transaction_update(current)
+            except Exception as e:
+                raise _TransactionAborted(e)
+
+        try:
+            return self._call(self._ref.transaction, guarded_update)
+        except _TransactionAborted as e:
+            raise e.error
+
+    def order_by_key(self):
+        return _ResilientQuery(self._ref.order_by_key(), self._circuit)
+
+    def listen(self, callback):
+        return self._ref.listen(callback)
+
+
+class _ResilientQuery:
+    def __init__(self, query, circuit):
+        self._query = query
+        self._circuit = circuit
+
+    def limit_to_first(self, limit):
+        return _ResilientQuery(self._query.limit_to_first(limit), self._circuit)
+
+    def get(self):
+        return call_with_retry(self._query.get, circuit=self._circuit, is_transient=is_transient_storage_error)
+
+    async def get_async(self):
+        return await _get_in_executor(self._query.get, self._circuit)
+
+
+async def _in_executor(func, *args):
+    """Синхронный вызов обёртки (автомат и бюджет те же) в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def _get_in_executor(get, circuit):
+    loop = asyncio.get_running_loop()
+    return await async_call_with_retry(loop.run_in_executor, None, get,
+                                       circuit=circuit, is_transient=is_transient_storage_error)
@@ -1,13 +1,20 @@
 import asyncio
+import functools
 import random
 import logging
 import time
 from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from firebase import initialize_firebase, get_random_joke, get_subscribers, get_subscribed_groups
+from firebase import (initialize_firebase, plan_jokes_for_chats, get_subscribers, get_subscribed_groups,
+                      set_group_last_joke_time, add_subscription_listener, add_group_listener, prune_chats,
+                      migrate_groups)
+from broadcast import BroadcastEngine, Delivery
+from async_sender import AsyncTelegramSender
+from async_utils import run_async
+from delivery_wheel import DeliveryWheel
+from group_schedule import GroupSchedule
+from outbox import Outbox
 import config
-from utils import last_joke_cache
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +24,22 @@ class JokeScheduler:
         self.running = False
         self.root_ref = initialize_firebase()
         self.loop = None
-        self.thread_pool = ThreadPoolExecutor(max_workers=10)
+        self.thread_pool = ThreadPoolExecutor(max_workers=config.SCHEDULER_THREAD_POOL_SIZE)
+        self.sender = None
+        # Рассылки сначала записываются в outbox, чтобы пережить перезапуск
+        self.outbox = Outbox() if config.OUTBOX_ENABLED else None
+        # Общий для пользователей и групп: глобальный лимит Telegram один на бота
+        if config.ASYNC_SENDER_ENABLED:
+            self.sender = AsyncTelegramSender(config.BOT_TOKEN)
+            self.broadcast_engine = BroadcastEngine(
+                self._send_message_async, concurrency=config.ASYNC_SENDER_CONCURRENCY, outbox=self.outbox
+            )
+        else:
+            self.broadcast_engine = BroadcastEngine(self._send_message, self.thread_pool, outbox=self.outbox)
+        self.delivery_wheel = DeliveryWheel(config.JOKE_INTERVAL, config.JOKE_DELIVERY_TICK)
+        self.group_schedule = GroupSchedule()
+        self._group_wakeup = None
+        self._resume_future = None
 
     def start(self, loop):
         if self.running:
@@ -25,45 +47,200 @@ class JokeScheduler:
             
         self.running = True
         self.loop = loop
+        if self.outbox is not None:
+            self._resume_future = asyncio.run_coroutine_threadsafe(self._resume_outbox(), loop)
         # Запускаем независимые задачи для пользователей и групп
-        asyncio.run_coroutine_threadsafe(self._user_joke_loop(), loop)
+        if config.JOKE_DELIVERY_MODE == 'spread':
+            asyncio.run_coroutine_threadsafe(self._spread_user_joke_loop(), loop)
+        else:
+            asyncio.run_coroutine_threadsafe(self._user_joke_loop(), loop)
         asyncio.run_coroutine_threadsafe(self._group_joke_loop(), loop)
         logger.info("Random joke scheduler started")
 
     def stop(self):
         self.running = False
+        self.broadcast_engine.stop()
+        if self.loop is not None and self.loop.is_running():
+            # Начатые отправки должны успеть записать mark_sent, иначе после запуска их пошлют повторно
+            drain = asyncio.run_coroutine_threadsafe(
+                self.broadcast_engine.drain(config.SCHEDULER_STOP_TIMEOUT), self.loop
+            )
+            try:
+                drain.result(config.SCHEDULER_STOP_TIMEOUT + 1)
+            except Exception as e:
+                logger.error(f"Error waiting for in-flight deliveries: {e}")
         self.thread_pool.shutdown(wait=False)
+        if self.sender is not None and self.loop is not None:
+            run_async(self.sender.close())
+        if self.loop is not None and self._group_wakeup is not None:
+            self.loop.call_soon_threadsafe(self._group_wakeup.set)
+        # Неотправленное остаётся в outbox со статусом pending и дошлётся после запуска
+        if self.outbox is not None:
+            self.outbox.close()
         logger.info("Random joke scheduler stopped")
 
+    async def _resume_outbox(self):
+        """Досылает сообщения, поставленные в очередь до перезапуска.
+
+        Возвращает {chat_id: время досылки} для групп, чтобы их расписание
+        отсчитывалось от досылки, а не от last_joke_time до падения.
+        """
+        resumed_groups = {}
+        try:
+            expired = self.outbox.expire(config.OUTBOX_MAX_AGE)
+            if expired:
+                logger.warning(f"Outbox: {expired} stale messages expired without sending")
+            deliveries = []
+            for key, chat_id, text, label in self.outbox.pending():
+                on_sent = None
+                if label == 'groups':
+                    resumed_groups[chat_id] = time.time()
+                    on_sent = functools.partial(set_group_last_joke_time, self.root_ref, chat_id, resumed_groups[chat_id])
+                deliveries.append(Delivery(chat_id, text, on_sent, key))
+            if deliveries:
+                logger.info(f"Outbox: resuming {len(deliveries)} unsent messages")
+                progress = await self.broadcast_engine.broadcast(deliveries, label='resume')
+                await self._prune_dead_chats(progress)
+        except Exception as e:
+            logger.error(f"Error resuming outbox: {e}")
+        return resumed_groups
+
+    async def _broadcast(self, deliveries, label):
+        """Записывает рассылку в outbox одной транзакцией и отправляет то, чего там ещё не было"""
+        if self.outbox is not None:
+            loop = asyncio.get_running_loop()
+            inserted = set(await loop.run_in_executor(
+                None, self.outbox.enqueue_many, [(d.key, d.chat_id, d.text) for d in deliveries], label
+            ))
+            skipped = len(deliveries) - len(inserted)
+            if skipped:
+                logger.info(f"Outbox: {skipped} messages of '{label}' already queued or sent")
+            deliveries = [d for d in deliveries if d.key in inserted]
+        progress = await self.broadcast_engine.broadcast(deliveries, label=label)
+        await self._prune_dead_chats(progress)
+        return progress
+
+    async def _prune_dead_chats(self, progress):
+        """Одним пакетом отписывает мёртвые чаты и переносит группы, ставшие супергруппами"""
+        if progress.migrated_chats:
+            await migrate_groups(self.root_ref, progress.migrated_chats)
+        if progress.dead_chats:
+            await prune_chats(self.root_ref, progress.dead_chats)
+
     async def _user_joke_loop(self):
         """Независимый цикл для отправки шуток всем пользователям"""
         while self.running:
             try:
                 user_interval = config.JOKE_INTERVAL
-                logger.info(f"Next user jokes batch in {user_interval} seconds")
+                # После перезапуска ждём только остаток интервала от прошлой рассылки
+                last_cycle = self.outbox.get_checkpoint('users_batch') if self.outbox is not None else None
+                if last_cycle is not None:
+                    user_interval = max(0, last_cycle + config.JOKE_INTERVAL - time.time())
+                logger.info(f"Next user jokes batch in {user_interval:.0f} seconds")
                 await asyncio.sleep(user_interval)
                 if not self.running:
                     break
-                await self._send_jokes_to_all_users()
+                cycle = time.time()
+                if self.outbox is not None:
+                    self.outbox.set_checkpoint('users_batch', cycle)
+                await self._send_jokes_to_all_users(int(cycle))
             except Exception as e:
                 logger.error(f"User joke loop error: {e}")
                 await asyncio.sleep(10)  # Пауза при ошибке
 
+    def _on_subscription_change(self, subscribed, user_id):
+        if subscribed:
+            self.delivery_wheel.add(user_id)
+        else:
+            self.delivery_wheel.remove(user_id)
+
+    async def _spread_user_joke_loop(self):
+        """Равномерная рассылка: каждый тик колеса отправляет шутки подписчикам его слота"""
+        # Подписчиков читаем из базы один раз, дальше колесо обновляют подписки/отписки
+        add_subscription_listener(self._on_subscription_change)
+        for user_id in await get_subscribers(self.root_ref):
+            self.delivery_wheel.add(user_id)
+        wheel = self.delivery_wheel
+        logger.info(f"Spread delivery: {len(wheel)} subscribers over {wheel.size} slots of {wheel.tick}s")
+
+        # Тики считаются от эпохи; после перезапуска догоняем тики с последней контрольной точки
+        # (не дальше одного оборота), иначе начинаем со следующего тика
+        current = int(time.time() // wheel.tick)
+        checkpoint = self.outbox.get_checkpoint('users_spread_tick') if self.outbox is not None else None
+        if checkpoint is not None and 0 <= current - checkpoint <= wheel.size:
+            current = int(checkpoint)
+        while self.running:
+            try:
+                await asyncio.sleep(wheel.seconds_until_next_slot(time.time()))
+                if not self.running:
+                    break
+                target = int(time.time() // wheel.tick)
+                # Если отправка затянулась дольше тика, догоняем пропущенные слоты
+                while current < target and self.running:
+                    current += 1
+                    user_ids = wheel.chats_in(wheel.slot_at(current * wheel.tick))
+                    if user_ids:
+                        await self._send_jokes_to_users(user_ids, label='users (spread)', cycle=current)
+                    if self.outbox is not None:
+                        self.outbox.set_checkpoint('users_spread_tick', current)
+            except Exception as e:
+                logger.error(f"Spread joke loop error: {e}")
+                await asyncio.sleep(10)  # Пауза при ошибке
+
+    def _on_group_change(self, chat_id, changes):
+        now = time.time()
+        if changes is None:
+            self.group_schedule.remove(chat_id)
+        elif 'subscribed' in changes:
+            # Новая подписка: первая шутка сразу, дальше по интервалу группы;
+            # перенесённая при миграции группа продолжает свой интервал
+            interval = changes.get('interval') or config.GROUP_JOKE_INTERVAL
+            last_joke_time = changes.get('last_joke_time') or 0
+            self.group_schedule.schedule(chat_id, max(now, last_joke_time + interval), interval)
+        elif 'interval' in changes:
+            self.group_schedule.set_interval(chat_id, changes['interval'], now)
+        if self.loop is not None and self._group_wakeup is not None:
+            self.loop.call_soon_threadsafe(self._group_wakeup.set)
+
     async def _group_joke_loop(self):
-        """Независимый цикл для отправки шуток всем группам"""
+        """Цикл групп: спит ровно до ближайшей группы в куче расписания"""
+        self._group_wakeup = asyncio.Event()
+        add_group_listener(self._on_group_change)
+        # Сначала дожидаемся досылки из outbox: иначе группа с недосланной шуткой
+        # по старому last_joke_time сразу получила бы вторую
+        resumed_groups = {}
+        if self._resume_future is not None:
+            resumed_groups = await asyncio.wrap_future(self._resume_future)
+        # Расписание строится из базы только при запуске, дальше его ведут подписки и /set_interval
+        groups = await get_subscribed_groups(self.root_ref)
+        now = time.time()
+        for group_id, group_data in groups.items():
+            interval = group_data.get('interval') or config.GROUP_JOKE_INTERVAL
+            last_joke_time = max(group_data.get('last_joke_time') or 0, resumed_groups.get(int(group_id), 0))
+            self.group_schedule.schedule(group_id, max(now, last_joke_time + interval), interval)
+        logger.info(f"Group scheduler started for {len(self.group_schedule)} groups")
+
         while self.running:
             try:
-                group_interval = config.GROUP_JOKE_INTERVAL
-                logger.info(f"Next group jokes batch in {group_interval} seconds")
-                await asyncio.sleep(group_interval)
+                next_due = self.group_schedule.next_due()
+                timeout = None if next_due is None else max(0, next_due - time.time())
+                if timeout is None or timeout > 0:
+                    self._group_wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._group_wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
                 if not self.running:
                     break
-                await self._send_jokes_to_all_groups()
+                due_groups = self.group_schedule.pop_due(time.time())
+                if due_groups:
+                    await self._send_jokes_to_groups(due_groups)
             except Exception as e:
                 logger.error(f"Group joke loop error: {e}")
                 await asyncio.sleep(10)  # Пауза при ошибке
 
-    async def _send_jokes_to_all_users(self):
+    async def _send_jokes_to_all_users(self, cycle):
         """Отправка случайных шуток всем подписанным пользователям"""
         try:
             subscribers = await get_subscribers(self.root_ref)
@@ -72,123 +249,68 @@ class JokeScheduler:
                 return
                 
             logger.info(f"Sending jokes to {len(subscribers)} users")
-            
-            for user_id in subscribers:
-                try:
-                    chat_id = user_id
-                    # Получаем ID последней шутки для этого пользователя
-                    last_joke_id = last_joke_cache.get(chat_id)
-                    
-                    # Получаем случайную шутку, исключая последнюю и только approved
-                    joke = await get_random_joke(
-                        self.root_ref, 
-                        exclude_joke_id=last_joke_id
-                    )
-                    if not joke:
-                        logger.warning("No jokes available for sending")
-                        continue
-                    
-                    # Обновляем кэш для этого пользователя
-                    last_joke_cache[chat_id] = joke['joke_id']
-                    
-                    self.thread_pool.submit(
-                        self._sync_send_message,
-                        user_id,
-                        f"🎲 *Случайный анекдот дня!*\n\n"
-                        f"📜 Анекдот #{joke['joke_id']}\n\n"
-                        f"{joke['text']}"
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending joke to user {user_id}: {e}")
+            await self._send_jokes_to_users(subscribers, label='users', cycle=cycle)
         except Exception as e:
             logger.error(f"Error in sending jokes to users: {e}")
 
-    async def _send_jokes_to_all_groups(self):
-        """Отправка случайных шуток всем подписанным группам"""
+    async def _send_jokes_to_users(self, user_ids, label, cycle):
+        """Назначает и отправляет шутки списку пользователей; cycle входит в ключ идемпотентности"""
         try:
-            groups = await get_subscribed_groups(self.root_ref)
-            if not groups:
-                logger.info("No groups subscribed for random jokes")
+            # Анекдоты назначаются всем получателям за один проход (только approved)
+            plan = await plan_jokes_for_chats(self.root_ref, user_ids)
+            if not len(plan):
+                logger.warning("No jokes available for sending")
                 return
-                
+
+            deliveries = [
+                Delivery(user_id, text, key=f"users:{cycle}:{user_id}")
+                for user_id, text in plan.messages(lambda joke: (
+                    f"🎲 *Случайный анекдот дня!*\n\n"
+                    f"📜 Анекдот #{joke['joke_id']}\n\n"
+                    f"{joke['text']}"
+                ))
+            ]
+            await self._broadcast(deliveries, label=label)
+        except Exception as e:
+            logger.error(f"Error in sending jokes to {label}: {e}")
+
+    async def _send_jokes_to_groups(self, due_groups):
+        """Отправка случайных шуток группам [(chat_id, due, interval)], чьё время подошло"""
+        try:
             current_time = time.time()
-            logger.info(f"Sending jokes to {len(groups)} groups")
-            
-            for group_id, group_data in groups.items():
-                try:
-                    # Проверяем, не слишком ли рано отправлять в эту группу
-                    last_joke_time = group_data.get('last_joke_time', 0)
-                    if current_time - last_joke_time < config.GROUP_JOKE_INTERVAL:
-                        logger.debug(f"Skipping group {group_id} - too soon")
-                        continue
-                    
-                    # Получаем ID последней шутки для этой группы
-                    last_joke_id = last_joke_cache.get(group_id)
-                    
-                    # Получаем случайную шутку, исключая последнюю и только approved
-                    joke = await get_random_joke(
-                        self.root_ref, 
-                        exclude_joke_id=last_joke_id
-                    )
-                    if not joke:
-                        logger.warning("No jokes available for sending")
-                        continue
-                    
-                    # Обновляем кэш для этой группы
-                    last_joke_cache[group_id] = joke['joke_id']
-                    
-                    # Отправляем шутку
-                    self.thread_pool.submit(
-                        self._send_to_group_and_update_time,
-                        group_id,
-                        joke,
-                        current_time
-                    )
-                except Exception as e:
-                    logger.error(f"Error sending joke to group {group_id}: {e}")
+            group_ids = [group_id for group_id, _, _ in due_groups]
+            # Ключ идемпотентности — слот расписания группы, а не время отправки:
+            # повторная постановка того же слота после перезапуска отсекается outbox
+            slots = {group_id: int(due // interval) for group_id, due, interval in due_groups}
+            logger.info(f"Sending jokes to {len(group_ids)} groups")
+
+            # Анекдоты назначаются всем группам за один проход (только approved)
+            plan = await plan_jokes_for_chats(self.root_ref, group_ids)
+            if not len(plan):
+                logger.warning("No jokes available for sending")
+                return
+
+            # После успешной отправки обновляем время последней шутки
+            deliveries = [
+                Delivery(group_id, text, functools.partial(
+                    set_group_last_joke_time, self.root_ref, group_id, current_time
+                ), key=f"groups:{slots[group_id]}:{group_id}")
+                for group_id, text in plan.messages(lambda joke: (
+                    f"🎲 *Случайный анекдот!*\n\n"
+                    f"📜 Анекдот #{joke['joke_id']}\n\n"
+                    f"{joke['text']}"
+                ))
+            ]
+            await self._broadcast(deliveries, label='groups')
         except Exception as e:
             logger.error(f"Error in sending jokes to groups: {e}")
 
-    def _send_to_group_and_update_time(self, group_id, joke, current_time):
-        """Отправляет шутку в группу и обновляет время последней отправки"""
-        text = f"🎲 *Случайный анекдот!*\n\n" \
-               f"📜 Анекдот #{joke['joke_id']}\n\n" \
-               f"{joke['text']}"
-        
-        # Пытаемся отправить сообщение
-        if self._sync_send_message(group_id, text):
-            # Если отправка успешна, обновляем время
-            try:
-                groups_ref = self.root_ref.child(config.GROUP_DB_PATH)
-                groups_ref.child(str(group_id)).update({'last_joke_time': current_time})
-            except Exception as e:
-                logger.error(f"Error updating last joke time for group {group_id}: {e}")
+    def _send_message(self, chat_id, text):
+        """Одна попытка отправки; повторы и лимиты — забота BroadcastEngine"""
+        self.bot.send_message(chat_id, text, parse_mode='Markdown')
+        logger.debug(f"Message sent to {chat_id}")
 
-    def _sync_send_message(self, chat_id, text, max_retries=3, retry_delay=2):
-        """Синхронная отправка сообщения с повторными попытками"""
-        attempt = 0
-        while attempt < max_retries:
-            try:
-                self.bot.send_message(
-                    chat_id,
-                    text,
-                    parse_mode='Markdown'
-                )
-                logger.debug(f"Message sent to {chat_id}")
-                return True
-            except requests.exceptions.ReadTimeout:
-                logger.warning(f"Read timeout for {chat_id}, retrying...")
-                attempt += 1
-                time.sleep(retry_delay)
-            except requests.exceptions.ConnectionError:
-                logger.warning(f"Connection error for {chat_id}, retrying...")
-                attempt += 1
-                time.sleep(retry_delay)
-            except Exception as e:
-                logger.error(f"Error sending to {chat_id} (attempt {attempt}/{max_retries}): {e}")
-                attempt += 1
-                if attempt < max_retries:
-                    time.sleep(retry_delay)
-                    
-        logger.error(f"Failed to send message to {chat_id} after {max_retries} attempts")
-        return False
\ No newline at end of file
+    async def _send_message_async(self, chat_id, text):
+        """Одна попытка отправки через пул соединений aiohttp"""
+        await self.sender.send_message(chat_id, text, parse_mode='Markdown')
+        logger.debug(f"Message sent to {chat_id}")
@@ -0,0 +1,295 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+
+from storage import Reference, generate_push_id
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def _join(*parts):
+    return '/'.join(p for part in parts for p in str(part).split('/') if p)
+
+
+def _subtree_bounds(path):
+    """Границы диапазона путей-потомков: '/' < '0' в ASCII"""
+    return path + '/', path + '0'
+
+
+def _flatten(path, value, out):
+    """Раскладывает JSON-значение на листья (path, json)"""
+    if isinstance(value, dict):
+        for key, child in value.items():
+            _flatten(_join(path, key), child, out)
+    elif isinstance(value, (list, tuple)):
+        for index, child in enumerate(value):
+            _flatten(_join(path, index), child, out)
+    elif value is not None:
+        out.append((path, json.dumps(value, ensure_ascii=False)))
+
+
+def _normalize(node):
+    """Как Firebase: объект с плотными целочисленными ключами читается как список"""
+    if not isinstance(node, dict):
+        return node
+    node = {key: _normalize(child) for key, child in node.items()}
+    if node and all(key.isdigit() for key in node):
+        indexes = [int(key) for key in node]
+        if max(indexes) < 2 * len(indexes):
+            result = [None] * (max(indexes) + 1)
+            for key, child in node.items():
+                result[int(key)] = child
+            return result
+    return node
+
+
+class _Event:
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class _Registration:
+    def __init__(self, database, path, callback):
+        self.database = database
+        self.path = path
+        self.callback = callback
+
+    def close(self):
+        self.database._remove_listener(self)
+
+
+class SQLiteDatabase:
+    """Дерево JSON в SQLite: каждый лист — строка (путь, значение) с индексом по пути.
+
+    WAL-журнал, по соединению на поток, запись сериализуется блокировкой,
+    поэтому update() и transaction() атомарны внутри процесса.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._listeners = []
+        self._events = queue.Queue()
+        conn = self._connection()
+        conn.execute(_SCHEMA)
+        conn.commit()
+        threading.Thread(target=self._dispatch_events, daemon=True).start()
+
+    def reference(self, path='/'):
+        return SQLiteReference(self, _join(path))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def read(self, path):
+        conn = self._connection()
+        if not path:
+            rows = conn.execute("SELECT path, value FROM nodes").fetchall()
+        else:
+            low, high = _subtree_bounds(path)
+            rows = conn.execute(
+                "SELECT path, value FROM nodes WHERE path = ? OR (path > ? AND path < ?)",
+                (path, low, high)
+            ).fetchall()
+        return self._assemble(path, rows)
+
+    @staticmethod
+    def _assemble(path, rows):
+        if not rows:
+            return None
+        if len(rows) == 1 and rows[0][0] == path:
+            return json.loads(rows[0][1])
+        tree = {}
+        offset = len(path) + 1 if path else 0
+        for row_path, value in rows:
+            parts = row_path[offset:].split('/')
+            node = tree
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = json.loads(value)
+        return _normalize(tree)
+
+    def child_keys(self, path, limit):
+        """Первые limit ключей детей по порядку (push-ключи одной длины сортируются верно)"""
+        conn = self._connection()
+        low, high = _subtree_bounds(path) if path else ('', '\U0010ffff')
+        keys = []
+        offset = len(low)
+        for (row_path,) in conn.execute(
+                "SELECT path FROM nodes WHERE path > ? AND path < ? ORDER BY path", (low, high)):
+            key = row_path[offset:].split('/', 1)[0]
+            if not keys or keys[-1] != key:
+                if limit is not None and len(keys) == limit:
+                    break
+                keys.append(key)
+        return keys
+
+    def _write_locked(self, conn, path, value):
+        """Заменяет поддерево path значением value (внутри открытой транзакции)"""
+        if path:
+            low, high = _subtree_bounds(path)
+            conn.execute("DELETE FROM nodes WHERE path = ? OR (path > ? AND path < ?)", (path, low, high))
+            # Лист-предок не может соседствовать с потомками
+            parts = path.split('/')
+            conn.executemany("DELETE FROM nodes WHERE path = ?",
+                             [('/'.join(parts[:i]),) for i in range(1, len(parts))])
+        else:
+            conn.execute("DELETE FROM nodes")
+        leaves = []
+        _flatten(path, value, leaves)
+        conn.executemany("INSERT INTO nodes (path, value) VALUES (?, ?)", leaves)
+
+    def write(self, changes):
+        """Атомарно применяет {путь: значение}"""
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for path, value in changes.items():
+                    self._write_locked(conn, path, value)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._publish(changes)
+
+    def transaction(self, path, transaction_update):
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                new_value = transaction_update(self.read(path))
+                self._write_locked(conn, path, new_value)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._publish({path: new_value})
+        return new_value
+
+    def _publish(self, changes):
+        if self._listeners:
+            self._events.put(changes)
+
+    def add_listener(self, path, callback):
+        registration = _Registration(self, path, callback)
+        with self._write_lock:
+            self._listeners.append(registration)
+            snapshot = self.read(path)
+        self._events.put((registration, _Event('put', '/', snapshot)))
+        return registration
+
+    def _remove_listener(self, registration):
+        with self._write_lock:
+            if registration in self._listeners:
+                self._listeners.remove(registration)
+
+    def _dispatch_events(self):
+        """События доставляются из отдельного потока, как у firebase_admin"""
+        while True:
+            item = self._events.get()
+            try:
+                if isinstance(item, tuple):
+                    registration, event = item
+                    registration.callback(event)
+                    continue
+                for registration in list(self._listeners):
+                    for path, value in item.items():
+                        event = self._event_for(registration.path, path, value)
+                        if event is not None:
+                            registration.callback(event)
+            except Exception as e:
+                logger.error(f"Error dispatching SQLite event: {e}")
+
+    def _event_for(self, listen_path, path, value):
+        if listen_path == path:
+            return _Event('put', '/', value)
+        if not listen_path or path.startswith(listen_path + '/'):
+            relative = path[len(listen_path):].lstrip('/')
+            return _Event('put', '/' + relative, value)
+        if not path or listen_path.startswith(path + '/'):
+            # Записали предка: пересылаем новое значение всего прослушиваемого узла
+            return _Event('put', '/', self.read(listen_path))
+        return None
+
+
+class _Query:
+    def __init__(self, ref):
+        self._ref = ref
+        self._limit = None
+
+    def limit_to_first(self, limit):
+        self._limit = limit
+        return self
+
+    def get(self):
+        database = self._ref._database
+        result = {}
+        for key in database.child_keys(self._ref.path, self._limit):
+            value = database.read(_join(self._ref.path, key))
+            if value is not None:
+                result[key] = value
+        return result
+
+
+class SQLiteReference(Reference):
+    """Ссылка на путь в SQLiteDatabase с интерфейсом firebase_admin.db.Reference"""
+
+    def __init__(self, database, path):
+        self._database = database
+        self.path = path
+
+    @property
+    def key(self):
+        return self.path.rsplit('/', 1)[-1] if self.path else None
+
+    def child(self, path):
+        return SQLiteReference(self._database, _join(self.path, path))
+
+    def get(self):
+        return self._database.read(self.path)
+
+    def set(self, value):
+        if value is None:
+            raise ValueError('Value must not be None.')
+        self._database.write({self.path: value})
+
+    def update(self, value):
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        self._database.write({_join(self.path, key): child for key, child in value.items()})
+
+    def delete(self):
+        self._database.write({self.path: None})
+
+    def push(self, value=''):
+        ref = self.child(generate_push_id())
+        ref.set(value)
+        return ref
+
+    def transaction(self, transaction_update):
+        return self._database.transaction(self.path, transaction_update)
+
+    def order_by_key(self):
+        return _Query(self)
+
+    def listen(self, callback):
+        return self._database.add_listener(self.path, callback)
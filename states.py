@@ -1,12 +1,179 @@
-# Глобальный словарь для хранения состояний пользователей
-user_states = {}
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_states (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+
+def _deep_sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item) for item in value)
+    return size
+
+
+class StateStore:
+    """Состояния диалогов пользователей: TTL на запись и ограничение размера (LRU).
+
+    Состояние живёт ttl секунд с последнего изменения; просроченные записи
+    не возвращаются и периодически вычищаются. Сверх max_entries вытесняются
+    давно не использованные. После start(db_path) состояния записываются
+    в SQLite сразу при изменении и переживают перезапуск. Значения должны
+    быть JSON — ключи и счётчики, а не копии анекдотов.
+    Подписчики add_listener узнают о завершении состояний, чтобы освободить
+    связанные с ними ресурсы.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, db_path=None):
+        self.ttl = ttl or config.USER_STATE_TTL
+        self.max_entries = max_entries or config.USER_STATE_MAX_ENTRIES
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (истекает, состояние)
+        self._last_sweep = time.time()
+        self._listeners = []
+        self._conn = None
+        if db_path:
+            self.start(db_path)
+
+    def start(self, db_path):
+        """Открывает базу состояний и поднимает сохранённые; до вызова состояния живут только в памяти"""
+        conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        with self._lock:
+            self._conn = conn
+            self._load()
+
+    def _load(self):
+        now = time.time()
+        self._conn.execute("DELETE FROM user_states WHERE expires_at <= ?", (now,))
+        rows = self._conn.execute(
+            "SELECT user_id, state, expires_at FROM user_states ORDER BY expires_at DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        # Самые свежие — в конец, как после недавнего обращения
+        for user_id, state, expires_at in reversed(rows):
+            self._entries[user_id] = (expires_at, json.loads(state))
+        if rows:
+            logger.info(f"Restored {len(rows)} user states")
+
+    def _persist(self, sql, params):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(sql, params)
+        except Exception as e:
+            logger.error(f"Error persisting user state: {e}")
+
+    def add_listener(self, callback):
+        """Подписка на завершение состояний.
+
+        callback(user_id, state) вызывается, когда состояние удалено, заменено
+        состоянием другого типа, истекло или вытеснено; вызывается вне блокировки.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, ended):
+        for user_id, state in ended:
+            for callback in self._listeners:
+                try:
+                    callback(user_id, state)
+                except Exception as e:
+                    logger.error(f"Error in user state listener: {e}")
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] > time.time():
+                self._entries.move_to_end(user_id)
+                return entry[1]
+            del self._entries[user_id]
+            self._persist("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+        self._notify([(user_id, entry[1])])
+        return None
+
+    def set(self, user_id, state, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        ended = []
+        with self._lock:
+            previous = self._entries.get(user_id)
+            if previous is not None and previous[1].get('state') != state.get('state'):
+                ended.append((user_id, previous[1]))
+            self._entries[user_id] = (expires_at, state)
+            self._entries.move_to_end(user_id)
+            self._persist(
+                "INSERT INTO user_states (user_id, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+                (user_id, json.dumps(state, ensure_ascii=False), expires_at)
+            )
+            while len(self._entries) > self.max_entries:
+                evicted, (_, evicted_state) = self._entries.popitem(last=False)
+                self._persist("DELETE FROM user_states WHERE user_id = ?", (evicted,))
+                ended.append((evicted, evicted_state))
+            if time.time() - self._last_sweep > config.USER_STATE_SWEEP_INTERVAL:
+                ended.extend(self._sweep_locked())
+        self._notify(ended)
+
+    def delete(self, user_id):
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._persist("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+        if entry is not None:
+            self._notify([(user_id, entry[1])])
+
+    def _sweep_locked(self):
+        """Удаляет просроченные состояния и возвращает их [(user_id, состояние)]"""
+        now = time.time()
+        self._last_sweep = now
+        expired = [(user_id, state) for user_id, (expires_at, state) in self._entries.items() if expires_at <= now]
+        for user_id, _ in expired:
+            del self._entries[user_id]
+        self._persist("DELETE FROM user_states WHERE expires_at <= ?", (now,))
+        if expired:
+            logger.info(f"Expired {len(expired)} abandoned user states")
+        return expired
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def memory_usage(self):
+        """Примерный объём состояний в памяти, байт"""
+        with self._lock:
+            return sys.getsizeof(self._entries) + sum(
+                _deep_sizeof(user_id) + _deep_sizeof(entry) for user_id, entry in self._entries.items()
+            )
+
+
+# Общее хранилище для всего процесса; база открывается в bot.py через start()
+state_store = StateStore()
+
 
 def set_user_state(user_id, state):
-    user_states[user_id] = state
+    state_store.set(user_id, state)
 
 def get_user_state(user_id):
-    return user_states.get(user_id)
+    return state_store.get(user_id)
 
 def delete_user_state(user_id):
-    if user_id in user_states:
-        del user_states[user_id]
\ No newline at end of file
+    state_store.delete(user_id)
@@ -0,0 +1,89 @@
+import random
+import threading
+import time
+from typing import Protocol
+
+
+class Reference(Protocol):
+    """Интерфейс хранилища, которым пользуется бот.
+
+    Это подмножество firebase_admin.db.Reference: firebase.py и остальной код
+    работают только через эти методы, поэтому Firebase и локальная SQLite-база
+    взаимозаменяемы (config.STORAGE_BACKEND). Протокол структурный: ссылки
+    firebase_admin подходят под него без наследования. Данные — дерево JSON,
+    адресуемое путями вида 'jokes/{key}/text'; через него хранятся анекдоты и их
+    индексы, подписчики, группы, счётчики, колоды и прочее состояние.
+    """
+
+    @property
+    def key(self):
+        """Последний сегмент пути (None для корня)"""
+        ...
+
+    def child(self, path):
+        """Ссылка на дочерний путь"""
+        ...
+
+    def get(self):
+        """Значение по пути (None, если его нет)"""
+        ...
+
+    def set(self, value):
+        """Записывает значение целиком"""
+        ...
+
+    def update(self, value):
+        """Атомарная multi-path запись: ключи — относительные пути, None удаляет"""
+        ...
+
+    def delete(self):
+        ...
+
+    def push(self, value=''):
+        """Добавляет дочерний узел с новым push-ключом и возвращает ссылку на него"""
+        ...
+
+    def transaction(self, transaction_update):
+        """Атомарно заменяет значение на transaction_update(текущее); исключение отменяет запись"""
+        ...
+
+    def order_by_key(self):
+        """Запрос с сортировкой детей по ключу; поддерживает limit_to_first(n).get()"""
+        ...
+
+    def listen(self, callback):
+        """Поток событий (event_type, path, data); возвращает регистрацию с close()"""
+        ...
+
+
+# Алфавит push-ключей Firebase (лексикографически упорядочен)
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_lock = threading.Lock()
+_last_push_time = 0
+_last_push_random = []
+
+
+def generate_push_id():
+    """Генерирует push-ключ локально (тот же алгоритм, что у клиентских SDK Firebase).
+
+    Нужен, чтобы записать анекдот и его индексы одним multi-path update().
+    """
+    global _last_push_time, _last_push_random
+    with _push_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            # Тот же миллисекундный тик: увеличиваем случайную часть, чтобы сохранить порядок
+            for i in range(11, -1, -1):
+                if _last_push_random[i] != 63:
+                    _last_push_random[i] += 1
+                    break
+                _last_push_random[i] = 0
+        else:
+            _last_push_time = now
+            _last_push_random = [random.randrange(64) for _ in range(12)]
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return ''.join(reversed(time_chars)) + ''.join(PUSH_CHARS[i] for i in _last_push_random)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при смене с которых или на которые меняется список администраторов
+_ADMIN_STATUSES = ('creator', 'administrator')
+
+
+class _Flight:
+    """Один запрос списка администраторов, который ждут все одновременно промахнувшиеся.
+
+    future ждут и потоки (result), и корутины (asyncio.wrap_future).
+    """
+
+    def __init__(self):
+        self.future = Future()
+        self.stale = False
+
+
+class TelegramMetadataCache:
+    """Кеш метаданных Telegram: профиль бота и списки администраторов групп.
+
+    Профиль бота запрашивается один раз. Списки администраторов хранятся
+    в OrderedDict не дольше ttl секунд и не больше max_chats групп (вытесняется
+    давно не использованная). Одновременные промахи по одной группе сливаются
+    в один запрос get_chat_administrators. Обновления chat_member и
+    my_chat_member сбрасывают список группы, когда меняются её администраторы.
+    """
+
+    def __init__(self, ttl=None, max_chats=None):
+        self.ttl = ttl or config.TELEGRAM_ADMIN_CACHE_TTL
+        self.max_chats = max_chats or config.TELEGRAM_ADMIN_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._identity_lock = threading.Lock()
+        self._bot_user = None
+        self._admins = OrderedDict()  # chat_id -> (истекает, frozenset ID администраторов)
+        self._flights = {}  # chat_id -> _Flight
+        self.hits = 0
+        self.misses = 0
+
+    def get_bot_user(self, bot):
+        """Профиль бота (get_me) — один запрос за всё время работы"""
+        if self._bot_user is None:
+            with self._identity_lock:
+                if self._bot_user is None:
+                    self._bot_user = bot.get_me()
+                    logger.info(f"Bot identity loaded: @{self._bot_user.username}")
+        return self._bot_user
+
+    def get_bot_username(self, bot):
+        return self.get_bot_user(bot).username.lower()
+
+    def _lookup(self, chat_id):
+        """(список из кеша или None, запрос в полёте, ведущий ли вызывающий)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._admins.get(chat_id)
+            if entry is not None and entry[0] > now:
+                self._admins.move_to_end(chat_id)
+                self.hits += 1
+                return entry[1], None, False
+            self.misses += 1
+            flight = self._flights.get(chat_id)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[chat_id] = flight
+            return None, flight, leader
+
+    def _fetch(self, bot, chat_id, flight):
+        """Запрос ведущего: результат или ошибка уходят всем ждущим через flight.future"""
+        try:
+            result = frozenset(admin.user.id for admin in bot.get_chat_administrators(chat_id))
+            error = None
+        except Exception as e:
+            result, error = None, e
+        with self._lock:
+            if self._flights.get(chat_id) is flight:
+                del self._flights[chat_id]
+            # Список сбросили, пока шёл запрос — ответ мог устареть, не кешируем его
+            if error is None and not flight.stale:
+                self._admins[chat_id] = (time.monotonic() + self.ttl, result)
+                self._admins.move_to_end(chat_id)
+                while len(self._admins) > self.max_chats:
+                    self._admins.popitem(last=False)
+        if error is not None:
+            flight.future.set_exception(error)
+        else:
+            flight.future.set_result(result)
+
+    def get_chat_admins(self, bot, chat_id):
+        """ID администраторов группы; поднимает исключение, если Telegram не ответил"""
+        admins, flight, leader = self._lookup(chat_id)
+        if admins is not None:
+            return admins
+        if leader:
+            self._fetch(bot, chat_id, flight)
+        try:
+            return flight.future.result(config.REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Timed out waiting for admins of chat {chat_id}")
+
+    async def get_chat_admins_async(self, bot, chat_id):
+        """То же для корутин: запрос идёт в executor, цикл событий не блокируется"""
+        admins, flight, leader = self._lookup(chat_id)
+        if admins is not None:
+            return admins
+        if leader:
+            asyncio.get_running_loop().run_in_executor(None, self._fetch, bot, chat_id, flight)
+        try:
+            # shield: таймаут одного ждущего не должен отменять общий запрос
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(flight.future)), config.REQUEST_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for admins of chat {chat_id}")
+
+    def is_chat_admin(self, bot, chat_id, user_id):
+        return user_id in self.get_chat_admins(bot, chat_id)
+
+    async def is_chat_admin_async(self, bot, chat_id, user_id):
+        return user_id in await self.get_chat_admins_async(bot, chat_id)
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._admins.pop(chat_id, None)
+            flight = self._flights.pop(chat_id, None)
+            if flight is not None:
+                flight.stale = True
+
+    def on_chat_member_updated(self, update):
+        """Обработка chat_member / my_chat_member: сброс при смене прав администратора"""
+        old_status = update.old_chat_member.status
+        new_status = update.new_chat_member.status
+        bot_removed = (new_status in ('left', 'kicked') and self._bot_user is not None
+                       and update.new_chat_member.user.id == self._bot_user.id)
+        if old_status in _ADMIN_STATUSES or new_status in _ADMIN_STATUSES or bot_removed:
+            logger.info(f"Admins of chat {update.chat.id} changed ({old_status} -> {new_status}), dropping cache")
+            self.invalidate(update.chat.id)
+
+    def stats(self):
+        with self._lock:
+            return {'chats': len(self._admins), 'hits': self.hits, 'misses': self.misses}
+
+
+# Общий экземпляр для всего процесса
+telegram_cache = TelegramMetadataCache()
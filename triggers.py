@@ -0,0 +1,234 @@
+import logging
+import os
+import re
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Слова короче основы триггера не совпадут ни с чем, их не выделяем
+_WORD_PATTERN = re.compile(r'\w{3,}')
+
+# Окончания существительных, прилагательных и глаголов; длинные проверяются первыми
+_ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ите', 'ешь', 'ете', 'ишь',
+    'ой', 'ей', 'ою', 'ею', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев',
+    'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ть',
+    'и', 'ы', 'а', 'я', 'у', 'ю', 'е', 'о', 'ь', 'й',
+), key=len, reverse=True)
+_MIN_STEM_LENGTH = 3
+_PHRASE_MAX_GAP = 2  # «расскажи мне смешное» тоже совпадает с «расскажи смешное»
+
+
+def stem(word):
+    """Грубая основа русского слова: нижний регистр, ё → е, без окончания"""
+    word = word.lower().replace('ё', 'е')
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def _deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class _TriggerIndex:
+    """Неизменяемый индекс одного списка триггеров; при перезагрузке заменяется целиком.
+
+    Разбор слова дорогой, поэтому результат запоминается: _token_stems — все
+    уже разобранные слова, _hits — слова, которые сами по себе являются триггером,
+    _phrase_starts — слова, с которых может начинаться фраза. Для сообщения из
+    знакомых слов проверка сводится к операциям над множествами.
+    """
+
+    def __init__(self, words, max_suffix, typo_min_length, cache_size):
+        self.words = tuple(words)
+        self.max_suffix = max_suffix
+        self.typo_min_length = typo_min_length
+        self.cache_size = cache_size
+        # Фраза — кортеж основ; однословный триггер — фраза из одной основы
+        self.phrases = {}
+        for word in self.words:
+            tokens = _WORD_PATTERN.findall(word.lower())
+            if tokens:
+                self.phrases.setdefault(stem(tokens[0]), []).append(tuple(stem(t) for t in tokens))
+        self.stems = {s for phrase_list in self.phrases.values() for phrase in phrase_list for s in phrase}
+        self.single_stems = {first for first, phrase_list in self.phrases.items()
+                             if any(len(phrase) == 1 for phrase in phrase_list)}
+        self.phrase_stems = {first for first, phrase_list in self.phrases.items()
+                             if any(len(phrase) > 1 for phrase in phrase_list)}
+        # Индекс удалений: любая основа с одной выброшенной буквой -> исходные основы
+        self.deletions = {}
+        for s in self.stems:
+            if len(s) >= typo_min_length:
+                for variant in _deletions(s):
+                    self.deletions.setdefault(variant, set()).add(s)
+        self.prefilter = self._compile_prefilter()
+        self._lock = threading.Lock()
+        self._reset_cache()
+
+    def _compile_prefilter(self):
+        """Одна регулярка из обязательных кусков основ: сообщение без них не совпадёт.
+
+        Любая форма основы содержит её без последней буквы. Одна опечатка не
+        может испортить одновременно начало s[:k] и конец s[k+1:] (даже перестановка
+        соседних букв), поэтому для основ с прощаемой опечаткой берём оба куска.
+        """
+        pieces = set()
+        # Фраза не совпадёт без своего первого слова, остальные слова не нужны
+        for s in self.phrases:
+            if len(s) >= self.typo_min_length:
+                k = len(s) // 2
+                pieces.update((s[:k], s[k + 1:]))
+            else:
+                pieces.add(s[:-1])
+        if not pieces:
+            return None
+        return re.compile('|'.join(re.escape(piece) for piece in sorted(pieces, key=len, reverse=True)))
+
+    def _reset_cache(self):
+        self._hits = set()
+        self._phrase_starts = set()
+        self._token_stems = {}
+
+    def _match_token(self, token):
+        """Основы триггеров, которым соответствует слово сообщения"""
+        token_stem = stem(token)
+        matched = set()
+        # Точная основа или она же с коротким суффиксом (анекдотик, анекдотец)
+        for cut in range(min(self.max_suffix, len(token_stem) - _MIN_STEM_LENGTH) + 1):
+            prefix = token_stem[:len(token_stem) - cut]
+            if prefix in self.stems:
+                matched.add(prefix)
+        # Беглая гласная (шуток -> шутк) и уменьшительное -оч-/-еч- (шуточки -> шутк)
+        if len(token_stem) > _MIN_STEM_LENGTH + 1 and token_stem[-2] in 'ое':
+            fleeting = token_stem[:-2] + token_stem[-1]
+            if fleeting in self.stems:
+                matched.add(fleeting)
+        if len(token_stem) > _MIN_STEM_LENGTH + 2 and token_stem[-3:-1] in ('оч', 'еч'):
+            diminutive = token_stem[:-3] + token_stem[-1]
+            if diminutive in self.stems:
+                matched.add(diminutive)
+        # Одна опечатка: пропущенная, лишняя, заменённая или переставленная буква
+        if not matched and len(token_stem) >= self.typo_min_length - 1:
+            matched.update(self.deletions.get(token_stem, ()))
+            for variant in _deletions(token_stem):
+                if variant in self.stems and len(variant) >= self.typo_min_length:
+                    matched.add(variant)
+                matched.update(self.deletions.get(variant, ()))
+        return frozenset(matched)
+
+    def _match_chunk(self, chunk):
+        """Основы для куска между пробелами: в нём бывает пунктуация и несколько слов (что-нибудь)"""
+        words = _WORD_PATTERN.findall(chunk)
+        if len(words) == 1:
+            return self._match_token(words[0])
+        return frozenset().union(*(self._match_token(word) for word in words))
+
+    def _learn(self, tokens):
+        with self._lock:
+            if len(self._token_stems) + len(tokens) > self.cache_size:
+                self._reset_cache()
+            for token in tokens:
+                matched = self._match_chunk(token)
+                self._token_stems[token] = matched
+                if matched:
+                    if matched & self.single_stems:
+                        self._hits.add(token)
+                    if matched & self.phrase_stems:
+                        self._phrase_starts.add(token)
+
+    def matches(self, text):
+        text = text.lower().replace('ё', 'е')
+        if self.prefilter is None or not self.prefilter.search(text):
+            return False
+        # Делим по пробелам (быстрее регулярки); куски кешируются вместе с пунктуацией
+        tokens = text.split()
+        token_set = set(tokens)
+        unknown = token_set.difference(self._token_stems)
+        if unknown:
+            self._learn(unknown)
+        if not token_set.isdisjoint(self._hits):
+            return True
+        if token_set.isdisjoint(self._phrase_starts):
+            return False
+        # Редкий случай: проверяем порядок слов фразы
+        token_stems = [self._token_stems.get(token) for token in tokens]
+        if None in token_stems:  # Кеш сбросили из другого потока
+            token_stems = [self._match_chunk(token) for token in tokens]
+        for i, stems in enumerate(token_stems):
+            for first in stems & self.phrase_stems:
+                for phrase in self.phrases[first]:
+                    if len(phrase) > 1 and self._phrase_follows(phrase, token_stems, i + 1):
+                        return True
+        return False
+
+    @staticmethod
+    def _phrase_follows(phrase, token_stems, start):
+        """Остальные слова фразы идут по порядку, между ними не больше _PHRASE_MAX_GAP слов"""
+        position = start
+        for phrase_stem in phrase[1:]:
+            window = token_stems[position:position + _PHRASE_MAX_GAP + 1]
+            for offset, stems in enumerate(window):
+                if phrase_stem in stems:
+                    position += offset + 1
+                    break
+            else:
+                return False
+        return True
+
+
+def load_trigger_words():
+    """Список триггеров: файл GROUP_TRIGGER_WORDS_FILE, если он есть, иначе config"""
+    path = config.GROUP_TRIGGER_WORDS_FILE
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            words = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        if words:
+            return words
+    return list(config.GROUP_TRIGGER_WORDS)
+
+
+class TriggerMatcher:
+    """Поиск триггерных слов в сообщениях групп.
+
+    Список слов компилируется один раз в индекс основ: совпадают целые слова
+    в любой форме (анекдоты, анекдотик, шутку), а слова от typo_min_length
+    букв — ещё и с одной опечаткой, через индекс вариантов с удалённой буквой.
+    Результаты по словам кешируются, поэтому сообщение из знакомых слов
+    проверяется парой операций над множествами. reload() атомарно подменяет индекс.
+    """
+
+    def __init__(self, words=None):
+        self._lock = threading.Lock()
+        self._index = None
+        self.reload(words)
+
+    @property
+    def words(self):
+        return self._index.words
+
+    def reload(self, words=None):
+        """Пересобирает индекс из words или из load_trigger_words()"""
+        words = load_trigger_words() if words is None else list(words)
+        index = _TriggerIndex(
+            words,
+            config.GROUP_TRIGGER_MAX_SUFFIX,
+            config.GROUP_TRIGGER_TYPO_MIN_LENGTH,
+            config.GROUP_TRIGGER_CACHE_SIZE,
+        )
+        with self._lock:
+            self._index = index
+        logger.info(f"Loaded {len(index.words)} trigger words")
+        return index.words
+
+    def matches(self, text):
+        if not text:
+            return False
+        return self._index.matches(text)
+
+
+# Общий экземпляр для всего процесса
+trigger_matcher = TriggerMatcher()
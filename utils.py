@@ -1,6 +1,7 @@
 import logging
 from telebot import types
 import config
+from telegram_cache import telegram_cache
 
 def setup_logging():
     logging.basicConfig(
@@ -16,28 +17,22 @@ def log_message(logger, message):
 def is_admin(user_id):
     return user_id in config.ADMIN_IDS
 
-def is_group_admin(bot, chat, user_id):
+def format_similar_jokes(similar):
+    """Блок «похожие анекдоты» для сообщений модерации"""
+    if not similar:
+        return ""
+    lines = ["\n\n🔁 *Похожие анекдоты:*"]
+    for joke, score in similar:
+        text = joke.get('text', '')
+        preview = text[:60] + '...' if len(text) > 60 else text
+        lines.append(f"• #{joke.get('joke_id')} ({score:.0%}): {preview}")
+    return "\n".join(lines)
+
+async def is_group_admin(bot, chat, user_id):
+    """Администратор ли пользователь группы; запрос к Telegram не блокирует цикл событий"""
     try:
-        admins = bot.get_chat_administrators(chat.id)
-        admin_ids = [admin.user.id for admin in admins]
-        return user_id in admin_ids
+        return await telegram_cache.is_chat_admin_async(bot, chat.id, user_id)
     except Exception as e:
         logger = logging.getLogger(__name__)
         logger.error(f"Error checking admin status: {e}")
         return False
-
-# Глобальный словарь для хранения состояний пользователей
-user_states = {}
-
-# Глобальный словарь для хранения последних отправленных шуток по chat_id
-last_joke_cache = {}
-
-def set_user_state(user_id, state):
-    user_states[user_id] = state
-
-def get_user_state(user_id):
-    return user_states.get(user_id)
-
-def delete_user_state(user_id):
-    if user_id in user_states:
-        del user_states[user_id]
\ No newline at end of file
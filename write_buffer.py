@@ -0,0 +1,157 @@
+import asyncio
+import copy
+import logging
+import threading
+from collections import Counter, deque
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _set_nested(tree, parts, value):
+    """Записывает value по относительному пути внутри словаря (None удаляет)"""
+    node = tree
+    for part in parts[:-1]:
+        child = node.get(part)
+        if not isinstance(child, dict):
+            child = {}
+            node[part] = child
+        node = child
+    if value is None:
+        node.pop(parts[-1], None)
+    else:
+        node[parts[-1]] = value
+
+
+class WriteBuffer:
+    """Отложенная запись в базу: изменения копятся по путям и уходят одним multi-path update().
+
+    Запись по пути заменяет ожидающие записи потомков, а запись внутрь уже
+    ожидающего предка вливается в его значение — поэтому пути в пакете никогда
+    не перекрываются, как того требует update(). Сброс — раз в
+    WRITE_BUFFER_FLUSH_INTERVAL секунд или при WRITE_BUFFER_MAX_ENTRIES путях;
+    неудачные пакеты уходят в очередь повторов и отправляются раньше новых.
+    """
+
+    def __init__(self):
+        self._root_ref = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._prefixes = Counter()  # Предки ожидающих путей, чтобы искать потомков без перебора
+        self._retry = deque()
+        self._running = False
+        self.writes = 0
+        self.flushes = 0
+
+    def start(self, root_ref):
+        if self._running:
+            return
+        self._root_ref = root_ref
+        self._running = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def stop(self):
+        """Останавливает фоновый сброс и записывает всё, что накопилось"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self.flush()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def set(self, path, value):
+        """Отложенный ref.set(value) по пути; None удаляет узел"""
+        path = path.strip('/')
+        with self._lock:
+            self._put_locked(path, copy.deepcopy(value))
+            self.writes += 1
+            if len(self._pending) >= config.WRITE_BUFFER_MAX_ENTRIES:
+                self._wakeup.notify()
+
+    def update(self, path, values):
+        """Отложенный ref.update(values) по пути"""
+        for key, value in values.items():
+            self.set(f"{path.strip('/')}/{key}", value)
+
+    def delete(self, path):
+        self.set(path, None)
+
+    def _put_locked(self, path, value):
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            ancestor = '/'.join(parts[:i])
+            if ancestor in self._pending:
+                base = self._pending[ancestor]
+                if not isinstance(base, dict):
+                    base = {}
+                _set_nested(base, parts[i:], value)
+                self._pending[ancestor] = base
+                return
+
+        if self._prefixes[path]:
+            prefix = path + '/'
+            for descendant in [p for p in self._pending if p.startswith(prefix)]:
+                self._remove_locked(descendant)
+        if path not in self._pending:
+            for i in range(1, len(parts)):
+                self._prefixes['/'.join(parts[:i])] += 1
+        self._pending[path] = value
+
+    def _remove_locked(self, path):
+        del self._pending[path]
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            ancestor = '/'.join(parts[:i])
+            self._prefixes[ancestor] -= 1
+            if not self._prefixes[ancestor]:
+                del self._prefixes[ancestor]
+
+    def flush(self):
+        """Отправляет очередь повторов и текущий пакет; False, если что-то не записалось"""
+        if self._root_ref is None:
+            return True
+        with self._flush_lock:
+            with self._lock:
+                if self._pending:
+                    self._retry.append(self._pending)
+                    self._pending = {}
+                    self._prefixes = Counter()
+            # Пакеты отправляются по порядку: более поздняя запись не должна обогнать раннюю
+            while self._retry:
+                batch = self._retry[0]
+                try:
+                    self._root_ref.update(batch)
+                except Exception as e:
+                    logger.error(f"Error flushing {len(batch)} buffered writes, will retry: {e}")
+                    while len(self._retry) > config.WRITE_BUFFER_MAX_RETRY_BATCHES:
+                        dropped = self._retry.popleft()
+                        logger.error(f"Dropping {len(dropped)} buffered writes after repeated failures")
+                    return False
+                self._retry.popleft()
+                self.flushes += 1
+        return True
+
+    async def flush_async(self):
+        """flush() для корутин: сетевая запись и ожидание _flush_lock — в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.flush)
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._pending) < config.WRITE_BUFFER_MAX_ENTRIES:
+                    self._wakeup.wait(config.WRITE_BUFFER_FLUSH_INTERVAL)
+                if not self._running:
+                    return
+            if not self.flush():
+                with self._lock:
+                    self._wakeup.wait(config.WRITE_BUFFER_RETRY_DELAY)
+
+
+# Общий экземпляр для всего процесса
+write_buffer = WriteBuffer()